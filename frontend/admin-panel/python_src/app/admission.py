@@ -0,0 +1,174 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+DEFAULT_TENANT = "default"
+DEFAULT_MAX_TENANT_BUCKETS = 10000 # Token buckets kept at most; the least recently used are dropped beyond it
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        # Retry-After takes whole seconds
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take one token. Returns 0 on success, otherwise seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def refund(self):
+        # Returns the token of a request that was rejected after taking it
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        # A refilled bucket behaves exactly like a new one, so it can be dropped
+        return self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+
+class AdmissionController:
+    """Bounds concurrent workflow executions.
+
+    Requests beyond max_concurrent wait in a bounded queue. A request is rejected
+    straight away when its tenant is out of tokens, the queue is full, or the expected
+    wait already exceeds max_wait. It is also rejected if it is still queued when
+    max_wait runs out.
+
+    Tenant buckets are kept in least recently used order: idle buckets that have refilled are
+    dropped, and at most max_tenants are kept, so arbitrary X-Tenant-ID values cannot grow memory.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, max_wait: float = 30.0,
+                 tenant_rate: float = 1.0, tenant_burst: float = 5.0, max_tenants: int = DEFAULT_MAX_TENANT_BUCKETS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.max_tenants = max_tenants
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.avg_service_time = 1.0 # Seconds, exponentially smoothed; seeds the wait estimate
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("WORKFLOW_MAX_QUEUE", "16")),
+            max_wait=float(os.getenv("WORKFLOW_MAX_WAIT_SECONDS", "30")),
+            tenant_rate=float(os.getenv("TENANT_RATE_PER_SECOND", "1")),
+            tenant_burst=float(os.getenv("TENANT_BURST", "5")),
+            max_tenants=int(os.getenv("TENANT_MAX_BUCKETS", str(DEFAULT_MAX_TENANT_BUCKETS))),
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def _estimated_wait(self) -> float:
+        return self.avg_service_time * (self.queue_depth + 1) / self.max_concurrent
+
+    def _tenant_bucket(self, tenant: str) -> TokenBucket:
+        bucket = self._buckets.pop(tenant, None) or TokenBucket(self.tenant_rate, self.tenant_burst)
+        now = time.monotonic()
+        # Least recently used first: drop the idle buckets that have refilled, then any beyond the bound
+        while self._buckets and (len(self._buckets) >= self.max_tenants or next(iter(self._buckets.values())).is_full(now)):
+            self._buckets.popitem(last=False)
+        self._buckets[tenant] = bucket
+        return bucket
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, tenant: str = DEFAULT_TENANT) -> float:
+        """Wait for an execution slot. Returns the time spent queued."""
+        # Capacity is checked before the tenant's token is taken, so a request the queue turns
+        # away does not also use up the tenant's rate limit
+        semaphore = self._get_semaphore()
+        if self.in_flight >= self.max_concurrent:
+            if self.queue_depth >= self.max_queue:
+                self._reject("Workflow queue is full", self._estimated_wait())
+            if self._estimated_wait() > self.max_wait:
+                self._reject("Expected queue wait exceeds the deadline", self._estimated_wait())
+
+        bucket = self._tenant_bucket(tenant)
+        token_wait = bucket.try_acquire()
+        if token_wait:
+            self._reject(f"Rate limit exceeded for tenant '{tenant}'", token_wait)
+
+        start = time.monotonic()
+        if not semaphore.locked():
+            await semaphore.acquire() # Free slot: no queueing
+        else:
+            self.queue_depth += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                bucket.refund()
+                self._reject("Timed out waiting for a workflow slot", self._estimated_wait())
+            finally:
+                self.queue_depth -= 1
+        waited = time.monotonic() - start
+
+        self.in_flight += 1
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_observed_wait = max(self.max_observed_wait, waited)
+        return waited
+
+    def release(self, service_time: Optional[float] = None):
+        self.in_flight -= 1
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        self._get_semaphore().release()
+
+    @asynccontextmanager
+    async def admit(self, tenant: str = DEFAULT_TENANT):
+        await self.acquire(tenant)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_observed_wait,
+            "avg_service_seconds": self.avg_service_time,
+        }
@@ -1,20 +1,107 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+import logging
+import os
+import threading
 import uuid
-from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
 from app.models.memory import ShortTermMemory, LongTermMemory
-# Ensure this import path is correct based on your structure
-from app.services.elasticsearch_service import ElasticsearchService 
+from app.models.agent import AbstractAgentPydantic
+from app.models.task import Rule
+from app.models.message import ChatMessage
+from app.agents.merge import merge_agent_state
+from app.services.storage import StorageBackend, WritePolicy, VersionConflict, STORAGE_BACKEND, create_storage_backend, DEFAULT_RULE_RESULTS, DEFAULT_HISTORY_PAGE_SIZE
+from app.storage_accounting import accounted
+from app.services.write_ahead_log import WriteAheadLog, WAL_MODE, WAL_PATH, GROUP_COMMIT
+from app.services.message_buffer import MessageBuffer, MESSAGE_INDEXING
+
+logger = logging.getLogger(__name__)
 
 # Global ES service instance, or inject it. For simplicity here, global.
 # Consider dependency injection for better testability.
 _es_service_instance = None
+_es_service_lock = threading.Lock()
+# Imported on first use so importing the agents (and app.main) does not load the elasticsearch client
+ElasticsearchService = None
+_write_ahead_log = None
+_message_buffer = None
+
+# Number of most recent history turns kept in STM; override per agent with config["history_window"].
+# Older turns are spilled to the append-only history index and can be paged back with get_history_page.
+DEFAULT_HISTORY_WINDOW = 50
+COMPACTION_SNIPPET_LENGTH = 80
+# With config["compact_spilled_history"], the spills of a session fold into one past_project_iterations
+# entry whose summary keeps the most recent snippets up to this length, so the document stays bounded
+COMPACTION_SUMMARY_LENGTH = 400
+# Conditional saves that hit a concurrent write are merged with it and retried this many times
+AGENT_SAVE_MAX_RETRIES = int(os.getenv("AGENT_SAVE_MAX_RETRIES", "3"))
 
-def get_es_service():
-    global _es_service_instance
+def get_es_service(connect: bool = True) -> StorageBackend:
+    # Elasticsearch unless STORAGE_BACKEND selects the memory or sqlite backend.
+    # connect=False creates the Elasticsearch service without blocking on the cluster; it stays
+    # unavailable (client None) until its connect() succeeds.
+    global _es_service_instance, ElasticsearchService
     if _es_service_instance is None:
-        _es_service_instance = ElasticsearchService()
+        with _es_service_lock:
+            if _es_service_instance is None:
+                if STORAGE_BACKEND == "elasticsearch":
+                    if ElasticsearchService is None:
+                        from app.services.elasticsearch_service import ElasticsearchService
+                    _es_service_instance = ElasticsearchService(connect=connect)
+                else:
+                    _es_service_instance = create_storage_backend(STORAGE_BACKEND)
     return _es_service_instance
 
+def get_write_ahead_log() -> Optional[WriteAheadLog]:
+    # None unless WAL_MODE is fallback or group_commit
+    global _write_ahead_log
+    if _write_ahead_log is None and WAL_MODE != "off":
+        with _es_service_lock:
+            if _write_ahead_log is None:
+                _write_ahead_log = WriteAheadLog(WAL_PATH, mode=WAL_MODE, max_save_retries=AGENT_SAVE_MAX_RETRIES)
+    return _write_ahead_log
+
+def close_write_ahead_log():
+    # Unreplayed records stay in the file and are picked up by the next get_write_ahead_log()
+    global _write_ahead_log
+    with _es_service_lock:
+        if _write_ahead_log is not None:
+            _write_ahead_log.close()
+            _write_ahead_log = None
+
+def _storage_usable(es_service) -> bool:
+    # Connected and, for Elasticsearch, not failing fast behind an open circuit
+    return bool(es_service and es_service.client and getattr(es_service, "available", True))
+
+def flush_write_ahead_log() -> int:
+    """Replays pending write-ahead log records to storage; returns how many were applied."""
+    wal = get_write_ahead_log()
+    if not wal or not wal.pending():
+        return 0
+    es_service = accounted(get_es_service())
+    if not _storage_usable(es_service):
+        return 0
+    return wal.replay(es_service)
+
+def get_message_buffer() -> Optional[MessageBuffer]:
+    # None when MESSAGE_INDEXING is off
+    global _message_buffer
+    if _message_buffer is None and MESSAGE_INDEXING:
+        with _es_service_lock:
+            if _message_buffer is None:
+                _message_buffer = MessageBuffer()
+    return _message_buffer
+
+def flush_message_buffer() -> int:
+    """Bulk-indexes the buffered conversation turns; returns how many were written."""
+    buffer = get_message_buffer()
+    if buffer is None or not len(buffer):
+        return 0
+    es_service = accounted(get_es_service())
+    if not _storage_usable(es_service):
+        return 0
+    return buffer.flush(es_service)
+
 class AbstractAgent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str = "Unnamed Agent"
@@ -22,16 +109,48 @@ class AbstractAgent(BaseModel):
     stm: ShortTermMemory = Field(default_factory=ShortTermMemory)
     ltm: LongTermMemory = Field(default_factory=LongTermMemory)
     config: Dict[str, Any] = {}
+    # Version of the stored document this state was last loaded from or saved as (used as ETag)
+    _version: Optional[str] = PrivateAttr(default=None)
+    # Persisted fields as of _version: the common ancestor when merging with a concurrent write
+    _base_state: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+    # LSN of this state's last write to the write-ahead log (then _base_state is that write): the
+    # base of its next logged write, so replay can tell its writes from concurrent ones
+    _logged_lsn: Optional[int] = PrivateAttr(default=None)
+    # RuleScorerCache of the local fallback of find_relevant_rules, created on first use
+    _rule_scorers: Any = PrivateAttr(default=None)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
+
+    def _document(self) -> Dict[str, Any]:
+        return self.model_dump(mode="json", include=set(AbstractAgentPydantic.model_fields))
+
+    def _set_version(self, version: Optional[str]):
+        # Called when this state matches the stored document at `version` (after a load or save)
+        self._version = version
+        self._base_state = self._document() if version else None
+        self._logged_lsn = None
+
+    def _available_es_service(self, action: str) -> Optional[StorageBackend]:
+        es_service = accounted(get_es_service()) # Counted against the active request/workflow storage budget
+        if not es_service or not es_service.client:
+            logger.warning("Elasticsearch service not available. Cannot %s for agent %s.", action, self.id)
+            return None
+        return es_service
 
     def load_state(self, agent_id: Optional[str] = None) -> bool:
         target_id = agent_id if agent_id else self.id
-        es_service = get_es_service()
-        if not es_service or not es_service.client:
-            print(f"Elasticsearch service not available. Cannot load state for agent {target_id}.")
-            return False
-        
-        print(f"Attempting to load state for agent {target_id}...")
-        agent_data = es_service.get_agent(target_id)
+        wal = get_write_ahead_log()
+        # A save still waiting in the write-ahead log is newer than the stored document
+        agent_data = wal.pending_agent(target_id) if wal else None
+        if agent_data is None:
+            es_service = accounted(get_es_service())
+            if not es_service or not es_service.client:
+                logger.warning("Elasticsearch service not available. Cannot load state for agent %s.", target_id)
+                return False
+            logger.debug("Attempting to load state for agent %s...", target_id)
+            agent_data = es_service.get_agent(target_id)
         if agent_data:
             self.id = agent_data.get('id', self.id) # agent_data['id'] is from agent_id field in ES
             self.name = agent_data.get('name', self.name)
@@ -50,33 +169,202 @@ class AbstractAgent(BaseModel):
                 self.ltm = LongTermMemory(**ltm_data)
             elif ltm_data:
                 self.ltm = ltm_data
+            self._set_version(agent_data.get('version'))
+            if agent_data.get('lsn') is not None: # Loaded from the write-ahead log
+                self._logged_lsn, self._base_state = agent_data['lsn'], self._document()
                 
-            print(f"State for agent {self.id} ({self.name}) loaded successfully from Elasticsearch.")
+            logger.debug("State for agent %s (%s) loaded successfully from Elasticsearch.", self.id, self.name)
             return True
         else:
-            print(f"No state found in Elasticsearch for agent {target_id}. Agent will use default/current state.")
+            logger.info("No state found in Elasticsearch for agent %s. Agent will use default/current state.", target_id)
             return False
 
-    def save_state(self) -> bool:
-        es_service = get_es_service()
-        if not es_service or not es_service.client:
-            print(f"Elasticsearch service not available. Cannot save state for agent {self.id}.")
+    def _log_write(self, wal: WriteAheadLog, append, *args) -> bool:
+        append(*args)
+        if wal.mode == GROUP_COMMIT and wal.over_capacity():
+            flush_write_ahead_log()
+        return True
+
+    def _log_state(self, wal: WriteAheadLog) -> bool:
+        lsn = wal.append_agent(self, base_version=self._version, base_lsn=self._logged_lsn, base_state=self._base_state)
+        self._logged_lsn, self._base_state = lsn, self._document()
+        if wal.mode == GROUP_COMMIT and wal.over_capacity():
+            flush_write_ahead_log()
+        return True
+
+    def save_state(self, policy: Optional[WritePolicy] = None) -> bool:
+        # policy=None uses the backend's default write policy (see WritePolicy)
+        wal = get_write_ahead_log()
+        # Writes queue behind records already in the log so they reach storage in order
+        if wal and (wal.mode == GROUP_COMMIT or wal.pending()):
+            return self._log_state(wal)
+        es_service = accounted(get_es_service())
+        if not _storage_usable(es_service):
+            if wal:
+                logger.warning("Elasticsearch service not available. Logging state of agent %s to the write-ahead log.", self.id)
+                return self._log_state(wal)
+            logger.warning("Elasticsearch service not available. Cannot save state for agent %s.", self.id)
             return False
 
-        print(f"Attempting to save state for agent {self.id} ({self.name})...")
+        logger.debug("Attempting to save state for agent %s (%s)...", self.id, self.name)
         # The ElasticsearchService's save_agent method expects a Pydantic model
         # that matches AbstractAgentPydantic, which self already is.
-        if es_service.save_agent(self): # Pass the current instance
-            print(f"State for agent {self.id} ({self.name}) saved to Elasticsearch.")
+        try:
+            saved = self._save_document(es_service, policy)
+        except VersionConflict as conflict:
+            logger.warning("Giving up saving agent %s after %s concurrent writes: %s", self.id, AGENT_SAVE_MAX_RETRIES + 1, conflict, extra={"agent_id": self.id})
+            return False
+        if saved:
+            logger.debug("State for agent %s (%s) saved to Elasticsearch.", self.id, self.name, extra={"agent_id": self.id})
             return True
+        elif wal:
+            logger.warning("Failed to save state for agent %s (%s); logged to the write-ahead log.", self.id, self.name, extra={"agent_id": self.id})
+            return self._log_state(wal)
         else:
-            print(f"Failed to save state for agent {self.id} ({self.name}) to Elasticsearch.")
+            logger.warning("Failed to save state for agent %s (%s) to Elasticsearch.", self.id, self.name, extra={"agent_id": self.id})
             return False
 
+    def _save_document(self, es_service: StorageBackend, policy: Optional[WritePolicy]):
+        # Conditional on the version this state was loaded from or last saved as, so a concurrent
+        # writer is never silently overwritten. On a conflict its changes are merged in and the
+        # save is retried; VersionConflict is raised once the retries are used up.
+        for attempt in range(AGENT_SAVE_MAX_RETRIES + 1):
+            kwargs: Dict[str, Any] = {"policy": policy} if policy else {}
+            if self._version:
+                kwargs["expected_version"] = self._version
+            try:
+                saved = es_service.save_agent(self, **kwargs)
+            except VersionConflict:
+                if attempt == AGENT_SAVE_MAX_RETRIES:
+                    raise
+                self._merge_stored(es_service)
+                continue
+            if saved:
+                self._set_version(saved if isinstance(saved, str) else None)
+            return saved
+
+    def _merge_stored(self, es_service: StorageBackend):
+        stored = es_service.get_agent(self.id)
+        if not stored or self._base_state is None:
+            self._set_version(None) # Deleted meanwhile: nothing to merge with, the retry is a plain write
+            return
+        theirs = AbstractAgentPydantic(**stored).model_dump(mode="json")
+        merged, conflicts = merge_agent_state(self._base_state, self._document(), theirs)
+        if conflicts:
+            logger.warning("Agent %s was changed concurrently; keeping this writer's %s.", self.id, ", ".join(conflicts), extra={"agent_id": self.id})
+        else:
+            logger.info("Agent %s was changed concurrently; merged and retrying the save.", self.id, extra={"agent_id": self.id})
+        merged_agent = AbstractAgentPydantic(**merged)
+        self.name, self.role, self.config = merged_agent.name, merged_agent.role, merged_agent.config
+        # In place, so references held to stm/ltm see the merged state
+        for memory, merged_memory in ((self.stm, merged_agent.stm), (self.ltm, merged_agent.ltm)):
+            for field in type(memory).model_fields:
+                setattr(memory, field, getattr(merged_memory, field))
+        self._version = stored.get("version")
+        self._base_state = theirs
+
+    def save_rules(self, rules: List[Rule]) -> bool:
+        # Keeps the searchable rules index in sync with ltm.learned_rules.
+        wal = get_write_ahead_log()
+        if wal and (wal.mode == GROUP_COMMIT or wal.pending()):
+            return self._log_write(wal, wal.append_rules, rules)
+        es_service = accounted(get_es_service())
+        if not _storage_usable(es_service):
+            if wal:
+                return self._log_write(wal, wal.append_rules, rules)
+            logger.warning("Elasticsearch service not available. Cannot index rules for agent %s.", self.id)
+            return False
+        if es_service.save_rules(rules):
+            return True
+        return self._log_write(wal, wal.append_rules, rules) if wal else False
+
+    def find_relevant_rules(self, query: str, context: Optional[str] = None, k: int = DEFAULT_RULE_RESULTS) -> List[Rule]:
+        es_service = accounted(get_es_service())
+        if not es_service or not es_service.client:
+            # Fall back to scoring the rules held in LTM locally
+            logger.warning("Elasticsearch service not available. Scoring %s local rules for agent %s.", len(self.ltm.learned_rules), self.id)
+            from app.services.rule_scoring import RuleScorerCache # NumPy is only loaded when the fallback is used
+            if self._rule_scorers is None:
+                self._rule_scorers = RuleScorerCache(max_entries=1)
+            # Rules are appended and revalidated in place, so the scorer is keyed by what those change
+            fingerprint = tuple((rule.id, rule.context, rule.validation_count, rule.last_validated_at) for rule in self.ltm.learned_rules)
+            rules = list(self.ltm.learned_rules)
+            return self._rule_scorers.get(fingerprint, lambda: rules).top_k(query, context=context, k=k)
+        return es_service.find_relevant_rules(query, context=context, k=k)
+
+    def append_history(self, *entries: Dict[str, Any]):
+        self.stm.history.extend(entries)
+        self._spill_history()
+
+    def _spill_history(self) -> bool:
+        window = self.config.get("history_window", DEFAULT_HISTORY_WINDOW)
+        overflow = len(self.stm.history) - window
+        if overflow <= 0:
+            return True
+
+        evicted = self.stm.history[:overflow]
+        es_service = accounted(get_es_service())
+        if not es_service or not es_service.client:
+            # Keep the turns in STM until they can be spilled rather than dropping them
+            logger.warning("Elasticsearch service not available. Cannot spill history for agent %s.", self.id)
+            return False
+        first_seq = self.stm.history_spilled
+        if not es_service.append_history(self.id, self.stm.session_id, first_seq, evicted):
+            return False
+
+        if self.config.get("compact_spilled_history"):
+            self._compact_spilled(first_seq, evicted)
+        del self.stm.history[:overflow]
+        self.stm.history_spilled += overflow
+        return True
+
+    def _compact_spilled(self, first_seq: int, evicted: List[Dict[str, Any]]):
+        snippet = str(evicted[0].get("content", ""))[:COMPACTION_SNIPPET_LENGTH]
+        iterations = self.ltm.past_project_iterations
+        last = iterations[-1] if iterations else None
+        if (last and last.get("type") == "history_compaction" and last.get("session_id") == self.stm.session_id
+                and last.get("to_seq") == first_seq - 1):
+            # Continues the session's rolling entry instead of adding one per spill
+            iterations[-1] = dict(last, to_seq=first_seq + len(evicted) - 1, turns=last["turns"] + len(evicted),
+                                  summary=f"{last['summary']} | {snippet}"[-COMPACTION_SUMMARY_LENGTH:])
+            return
+        iterations.append({
+            "type": "history_compaction",
+            "session_id": self.stm.session_id,
+            "from_seq": first_seq,
+            "to_seq": first_seq + len(evicted) - 1,
+            "turns": len(evicted),
+            "summary": snippet
+        })
+
+    def get_history_page(self, before_seq: Optional[int] = None, size: int = DEFAULT_HISTORY_PAGE_SIZE) -> List[Dict[str, Any]]:
+        # Defaults to the page just before the oldest turn still held in STM
+        if before_seq is None:
+            before_seq = self.stm.history_spilled
+        es_service = accounted(get_es_service())
+        if not es_service or not es_service.client:
+            logger.warning("Elasticsearch service not available. Cannot page history for agent %s.", self.id)
+            return []
+        return es_service.get_history_page(self.id, before_seq=before_seq, size=size)
+
+    def _index_messages(self, first_seq: int, *entries: Dict[str, Any]):
+        # Buffered for bulk indexing; a full batch is written right away, the rest by the API's background flush
+        buffer = get_message_buffer()
+        if buffer is None:
+            return
+        timestamp = datetime.now(timezone.utc).isoformat()
+        messages = [ChatMessage(agent_id=self.id, session_id=self.stm.session_id, seq=first_seq + offset,
+                                role=str(entry.get("role", "")), content=str(entry.get("content", "")), timestamp=timestamp)
+                    for offset, entry in enumerate(entries)]
+        if buffer.add(*messages):
+            flush_message_buffer()
+
     def process_message(self, message: str) -> str:
-        self.stm.history.append({"role": "user", "content": message})
         response = f"Agent {self.name} ({self.id}) received: {message}"
-        self.stm.history.append({"role": "assistant", "content": response})
+        turns = ({"role": "user", "content": message}, {"role": "assistant", "content": response})
+        first_seq = self.stm.history_spilled + len(self.stm.history)
+        self.append_history(*turns)
+        self._index_messages(first_seq, *turns)
         self.save_state() # Example: save state after processing a message
         return response
 
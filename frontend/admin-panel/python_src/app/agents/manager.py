@@ -1,9 +1,26 @@
 from .base import AbstractAgent, get_es_service
 from pydantic import Field
+import logging
 from typing import List, Dict, Any, Optional
 import uuid
-from app.models.task import TaskStatus, SubTask, Goal, Rule, MainTask
+from datetime import datetime, timezone
+from app.models.task import TaskStatus, SubTask, Goal, Rule, MainTask, TaskEvent
 from app.models.memory import ShortTermMemory # For type hinting if needed
+from .task_graph import TaskGraph
+from .task_events import record_transition, project_main_task
+from app.tracing import start_span
+from app.logging_setup import log_sampled
+from app.services.storage import ASYNC_WRITE, READ_YOUR_WRITES
+
+logger = logging.getLogger(__name__)
+
+# Number of recent history turns copied into MainTask.session_stm_snapshot
+SNAPSHOT_HISTORY_TURNS = 10
+# Task events logged between full MainTask snapshots; override with config["task_snapshot_interval"]
+DEFAULT_TASK_SNAPSHOT_INTERVAL = 20
+# Writes of these states wait until they are searchable, so results and timelines can be read back at once.
+# Intermediate states use the cheaper default write policy.
+FINAL_TASK_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
 
 class ManagerAgent(AbstractAgent):
     name: str = "Manager Agent"
@@ -12,43 +29,109 @@ class ManagerAgent(AbstractAgent):
     current_main_task_id: Optional[str] = None
     # available_agents: List[str] = [] # List of agent IDs or names (can be part of config or discovered)
 
-    def _get_main_task(self) -> Optional[MainTask]:
-        # Helper to load the current MainTask from STM or LTM (if persisted)
-        # For now, assume it's primarily in STM for an active session.
+    def _get_main_task_data(self) -> Optional[Dict[str, Any]]:
+        # The current MainTask as persisted in STM (trusted, already validated on save)
         if self.current_main_task_id and 'active_main_task' in self.stm.current_task_data:
             task_data = self.stm.current_task_data['active_main_task']
             if task_data.get('id') == self.current_main_task_id:
-                return MainTask(**task_data)
+                return task_data
         return None
 
+    def _get_main_task(self) -> Optional[MainTask]:
+        # Helper to load the current MainTask from STM or LTM (if persisted)
+        # For now, assume it's primarily in STM for an active session.
+        task_data = self._get_main_task_data()
+        return MainTask(**task_data) if task_data else None
+
     def _save_main_task(self, main_task: MainTask):
         self.stm.current_task_data['active_main_task'] = main_task.model_dump()
         self.current_main_task_id = main_task.id
         # Consider if MainTask itself should be an ES document or part of agent's LTM.
         # For now, primarily in STM during execution, and agent state save captures it.
-        self.save_state()
+        self.save_state(READ_YOUR_WRITES if main_task.status in FINAL_TASK_STATUSES else ASYNC_WRITE)
+
+    def _merge_stored(self, es_service):
+        # active_main_task belongs to current_main_task_id of this writer: another manager
+        # storing its own task meanwhile must not replace the task this one is running
+        own_task_data = self._get_main_task_data()
+        super()._merge_stored(es_service)
+        if own_task_data is not None:
+            self.stm.current_task_data['active_main_task'] = own_task_data
 
 
+    def _append_task_event(self, main_task: MainTask, subtask: Optional[SubTask], to_status: TaskStatus, results: Optional[Dict[str, Any]] = None) -> bool:
+        # Status transitions are appended to the task event log instead of rewriting the
+        # agent document; _save_main_task snapshots the full state periodically.
+        event = record_transition(main_task, subtask, to_status, results)
+        es_service = self._available_es_service("append task events")
+        policy = READ_YOUR_WRITES if to_status in FINAL_TASK_STATUSES else ASYNC_WRITE
+        if es_service and es_service.append_task_events([event], policy=policy):
+            return True
+        # Without the event log the transition is only durable through a full snapshot
+        self._save_main_task(main_task)
+        return False
+
+    def _set_main_task_status(self, main_task: MainTask, status: TaskStatus):
+        # Main-task status changes are logged as task events like subtask ones, so timelines and
+        # fleet stats see them; the snapshot then persists the rest of the task's state
+        if self._append_task_event(main_task, None, status):
+            self._save_main_task(main_task)
+
+    def load_state(self, agent_id: Optional[str] = None) -> bool:
+        if not super().load_state(agent_id):
+            return False
+        self._replay_task_events()
+        return True
+
+    def _replay_task_events(self):
+        # Bring the persisted active_main_task snapshot up to date with events logged after it
+        task_data = self.stm.current_task_data.get('active_main_task')
+        if not task_data:
+            return
+        es_service = self._available_es_service("replay task events")
+        if not es_service:
+            return
+        events = es_service.get_task_events(task_data['id'], after_seq=task_data.get('event_seq', 0))
+        if events:
+            main_task = project_main_task(MainTask(**task_data), events)
+            self.stm.current_task_data['active_main_task'] = main_task.model_dump()
+            logger.debug("Replayed %s task event(s) onto MainTask %s.", len(events), main_task.id)
+
+    def get_task_timeline(self, main_task_id: str) -> List[TaskEvent]:
+        es_service = self._available_es_service("get task timeline")
+        return es_service.get_task_events(main_task_id) if es_service else []
+
+    def _stm_snapshot(self) -> Dict[str, Any]:
+        # Task-scoped projection of STM. current_task_data is excluded because it holds the
+        # previous active_main_task (and its own snapshot), which would nest every earlier task
+        # into the new one and grow the agent document with each run.
+        return {
+            "session_id": self.stm.session_id,
+            "history": self.stm.history[-SNAPSHOT_HISTORY_TURNS:],
+            "history_spilled": self.stm.history_spilled,
+            "scratchpad": dict(self.stm.scratchpad)
+        }
+
     def initiate_main_task(self, user_query: str, designated_agent_ids: List[str], overall_goal_desc: str, goal_priority: int = 1) -> MainTask:
         goal = Goal(description=overall_goal_desc, priority=goal_priority)
         main_task = MainTask(
             user_query=user_query,
             overall_goal=goal,
             designated_agent_ids=designated_agent_ids,
-            session_stm_snapshot=self.stm.model_dump() # Snapshot of manager's STM at initiation
+            session_stm_snapshot=self._stm_snapshot() # Snapshot of manager's STM at initiation
         )
         self.current_main_task_id = main_task.id
         self._save_main_task(main_task)
-        print(f"Manager Agent {self.name} initiated MainTask: {main_task.id} for query: '{user_query}'")
+        logger.info("Manager Agent %s initiated MainTask: %s for query: '%s'", self.name, main_task.id, user_query)
         return main_task
 
     def plan_subtasks(self) -> Optional[List[SubTask]]:
         main_task = self._get_main_task()
         if not main_task:
-            print(f"Manager Agent {self.name}: No active MainTask to plan for.")
+            logger.info("Manager Agent %s: No active MainTask to plan for.", self.name)
             return None
 
-        print(f"Manager Agent {self.name}: Planning subtasks for MainTask {main_task.id} ('{main_task.user_query}')")
+        logger.info("Manager Agent %s: Planning subtasks for MainTask %s ('%s')", self.name, main_task.id, main_task.user_query)
         
         # Mock planning logic:
         # Simple decomposition based on query words or predefined templates
@@ -68,97 +151,98 @@ class ManagerAgent(AbstractAgent):
             subtasks.append(SubTask(name="Generic Step 2", description="Second general step", dependencies=[subtasks[0].id if subtasks else ""]))
 
         main_task.sub_tasks = subtasks
-        main_task.status = TaskStatus.IN_PROGRESS # Assuming planning means it's now in progress
-        self._save_main_task(main_task)
+        # Attach the top-k learned rules for this query. The rules index does the ranking,
+        # so this stays a single bounded query regardless of how many rules have been learned.
+        applied_rule_ids = {rule.id for rule in main_task.applied_rules}
+        for rule in self.find_relevant_rules(main_task.user_query):
+            if rule.id not in applied_rule_ids:
+                main_task.applied_rules.append(rule)
+                applied_rule_ids.add(rule.id)
+        self._set_main_task_status(main_task, TaskStatus.IN_PROGRESS) # Assuming planning means it's now in progress
         
-        print(f"Subtasks planned: {[st.name for st in main_task.sub_tasks]}")
+        logger.info("Subtasks planned: %s", [st.name for st in main_task.sub_tasks])
         return main_task.sub_tasks
 
     def get_next_executable_group(self) -> List[SubTask]:
-        main_task = self._get_main_task()
-        if not main_task or not main_task.sub_tasks:
+        task_data = self._get_main_task_data()
+        if not task_data or not task_data.get('sub_tasks'):
             return []
 
-        executable_group = []
-        pending_subtasks = [st for st in main_task.sub_tasks if st.status == TaskStatus.PENDING]
-        
-        for subtask in pending_subtasks:
-            dependencies_met = True
-            if subtask.dependencies:
-                for dep_id in subtask.dependencies:
-                    dep_task = next((st for st in main_task.sub_tasks if st.id == dep_id), None)
-                    if not dep_task or dep_task.status != TaskStatus.COMPLETED:
-                        dependencies_met = False
-                        break
-            if dependencies_met:
-                executable_group.append(subtask)
+        # Schedule on the compact graph built from the persisted dicts; only the
+        # selected subtasks are turned into SubTask models.
+        sub_tasks_data = task_data['sub_tasks']
+        ready_indices = TaskGraph.from_task_data(sub_tasks_data).ready()
         
         # For true synchronous groups, this logic might need to be more sophisticated
         # e.g., identifying all tasks that can run in parallel at the current stage.
         # This simple version just takes one task if its direct dependencies are met.
         # For this iteration, we'll just return the first one found that can be run.
-        return executable_group[:1] if executable_group else []
+        return [SubTask(**sub_tasks_data[i]) for i in ready_indices[:1]]
 
 
     def execute_subtask_group(self, subtask_group: List[SubTask]):
         main_task = self._get_main_task()
         if not main_task or not subtask_group:
-            print(f"Manager Agent {self.name}: No subtasks to execute or no active main task.")
+            logger.info("Manager Agent %s: No subtasks to execute or no active main task.", self.name)
             return
 
-        print(f"Manager Agent {self.name}: Executing subtask group for MainTask {main_task.id}:")
+        logger.info("Manager Agent %s: Executing subtask group for MainTask %s:", self.name, main_task.id)
+        snapshot_interval = self.config.get("task_snapshot_interval", DEFAULT_TASK_SNAPSHOT_INTERVAL)
+        snapshot_seq = main_task.event_seq
         for subtask_to_execute in subtask_group:
             # Find the actual subtask instance in the main_task.sub_tasks list to update it
             task_in_main = next((st for st in main_task.sub_tasks if st.id == subtask_to_execute.id), None)
             if not task_in_main:
-                print(f"  Error: Subtask {subtask_to_execute.id} not found in main task's list.")
+                logger.error("Subtask %s not found in main task's list.", subtask_to_execute.id)
                 continue
 
-            print(f"  Executing Subtask: {task_in_main.name} (ID: {task_in_main.id})")
-            task_in_main.status = TaskStatus.IN_PROGRESS
-            self._save_main_task(main_task) # Save state: task is in progress
-
-            # Mock execution:
-            # In a real system, this would involve:
-            # 1. Selecting an appropriate agent (from main_task.designated_agent_ids or a pool).
-            # 2. Formatting the subtask for that agent.
-            # 3. Sending it to the agent (e.g., via an API call, message queue).
-            # 4. Waiting for/receiving the results.
-            # For now, we'll just simulate completion.
-            print(f"    ... Subtask {task_in_main.name} (mock) execution in progress ...")
-            task_in_main.results = {"mock_output": f"Successfully completed {task_in_main.name}", "status_message": "Mock execution successful"}
-            task_in_main.status = TaskStatus.COMPLETED
-            print(f"    ... Subtask {task_in_main.name} completed.")
-            self._save_main_task(main_task) # Save state: task is completed
+            with start_span("subtask.execute", main_task_id=main_task.id, subtask_id=task_in_main.id, subtask_name=task_in_main.name):
+                logger.debug("Executing Subtask: %s (ID: %s)", task_in_main.name, task_in_main.id, extra={"subtask_id": task_in_main.id})
+                self._append_task_event(main_task, task_in_main, TaskStatus.IN_PROGRESS) # Log: task is in progress
+
+                # Mock execution:
+                # In a real system, this would involve:
+                # 1. Selecting an appropriate agent (from main_task.designated_agent_ids or a pool).
+                # 2. Formatting the subtask for that agent.
+                # 3. Sending it to the agent (e.g., via an API call, message queue).
+                # 4. Waiting for/receiving the results.
+                # For now, we'll just simulate completion.
+                logger.debug("Subtask %s (mock) execution in progress...", task_in_main.name)
+                results = {"mock_output": f"Successfully completed {task_in_main.name}", "status_message": "Mock execution successful"}
+                self._append_task_event(main_task, task_in_main, TaskStatus.COMPLETED, results) # Log: task is completed
+                logger.debug("Subtask %s completed.", task_in_main.name, extra={"subtask_id": task_in_main.id})
+            if main_task.event_seq - snapshot_seq >= snapshot_interval:
+                self._save_main_task(main_task) # Periodic snapshot bounds the events replayed on read
+                snapshot_seq = main_task.event_seq
         
         # Check if all subtasks are completed
         all_completed = all(st.status == TaskStatus.COMPLETED for st in main_task.sub_tasks)
         if all_completed:
-            main_task.status = TaskStatus.COMPLETED
+            self._append_task_event(main_task, None, TaskStatus.COMPLETED)
             main_task.final_results = {"summary": "All subtasks completed successfully.", "outputs": [st.results for st in main_task.sub_tasks]}
-            print(f"MainTask {main_task.id} completed successfully.")
+            logger.info("MainTask %s completed successfully.", main_task.id)
         self._save_main_task(main_task)
 
 
     def retrospect(self, completed_group_ids: List[str]):
         main_task = self._get_main_task()
         if not main_task:
-            print(f"Manager Agent {self.name}: No active MainTask for retrospection.")
+            logger.info("Manager Agent %s: No active MainTask for retrospection.", self.name)
             return
 
-        print(f"Manager Agent {self.name}: Performing retrospection for MainTask {main_task.id} on completed group: {completed_group_ids}")
+        logger.info("Manager Agent %s: Performing retrospection for MainTask %s on completed group: %s", self.name, main_task.id, completed_group_ids)
         
         completed_subtasks = [st for st in main_task.sub_tasks if st.id in completed_group_ids and st.status == TaskStatus.COMPLETED]
 
         if not completed_subtasks:
-            print("  No completed subtasks found for retrospection in the given group.")
+            logger.info("No completed subtasks found for retrospection in the given group.")
             return
 
         # Mock retrospection logic:
         # Analyze results, agent performance (if tracked), efficiency.
         # Propose rules.
         for subtask in completed_subtasks:
-            print(f"  Analyzing subtask: {subtask.name} (Results: {subtask.results.get('status_message', 'N/A')})")
+            logger.debug("Analyzing subtask: %s (Results: %s)", subtask.name, subtask.results.get('status_message', 'N/A'))
         
         # Example: Propose a generic rule based on this retrospection
         new_rule_desc = f"Review task outcomes if 'mock execution' is mentioned, for MainTask type: {main_task.user_query[:20]}"
@@ -176,9 +260,10 @@ class ManagerAgent(AbstractAgent):
             )
             self.ltm.learned_rules.append(proposed_rule) # Add to Long-Term Memory
             main_task.applied_rules.append(proposed_rule) # Also note it was applied/considered for this task
-            print(f"  Proposed and added new rule: {proposed_rule.description}")
+            self.save_rules([proposed_rule]) # Make the rule searchable for future planning
+            logger.info("Proposed and added new rule: %s", proposed_rule.description)
         else:
-            print(f"  Rule similar to '{new_rule_desc}' already exists. Skipping addition.")
+            logger.warning("Rule similar to '%s' already exists. Skipping addition.", new_rule_desc)
 
         self.stm.scratchpad['last_retrospection_summary'] = f"Retrospection on {len(completed_subtasks)} tasks. New rules proposed: {'Yes' if not rule_exists and completed_subtasks else 'No'}."
         self._save_main_task(main_task) # Save changes to main_task (e.g. applied_rules)
@@ -188,24 +273,29 @@ class ManagerAgent(AbstractAgent):
     def revalidate_rules(self):
         main_task = self._get_main_task() # For context, if needed
 
-        print(f"Manager Agent {self.name}: Revalidating rules.")
+        logger.info("Manager Agent %s: Revalidating rules.", self.name)
         if not self.ltm.learned_rules:
-            print("  No rules in LTM to revalidate.")
+            logger.info("No rules in LTM to revalidate.")
             return
 
+        revalidated_rules = []
         for rule in self.ltm.learned_rules:
             # Mock revalidation logic:
             # - Check if rule is still relevant (e.g., based on recent task outcomes, new info).
             # - Could involve LLM evaluation or statistical checks.
             # - Update validation_count or modify/deprecate rule.
-            print(f"  Revalidating rule ID {rule.id}: '{rule.description}' (Source: {rule.source})")
+            # Runs for every rule on every iteration, so only a sample is logged
+            log_sampled(logger, logging.DEBUG, "revalidate_rule", "Revalidating rule ID %s: '%s' (Source: %s)", rule.id, rule.description, rule.source)
             if "mock execution" in rule.description.lower(): # Example condition
                 rule.validation_count += 1
-                rule.last_validated_at = str(uuid.uuid4()) # Simulate timestamp update
-                print(f"    Rule '{rule.description}' deemed still relevant. Validation count: {rule.validation_count}")
+                rule.last_validated_at = datetime.now(timezone.utc).isoformat() # Used for recency in rule scoring
+                revalidated_rules.append(rule)
+                log_sampled(logger, logging.DEBUG, "rule_still_relevant", "Rule '%s' deemed still relevant. Validation count: %s", rule.description, rule.validation_count)
             else:
-                print(f"    Rule '{rule.description}' - no specific revalidation action taken in this mock.")
+                log_sampled(logger, logging.DEBUG, "rule_not_revalidated", "Rule '%s' - no specific revalidation action taken in this mock.", rule.description)
         
+        self.save_rules(revalidated_rules) # Keep validation_count in the rules index current for ranking
+
         # If main_task context is used for revalidation, save it
         if main_task:
             self._save_main_task(main_task)
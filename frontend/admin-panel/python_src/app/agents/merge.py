@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Tuple
+
+_MISSING = object()
+
+
+def _merge_value(base: Any, ours: Any, theirs: Any, path: str, conflicts: List[str]) -> Any:
+    # Ours where this writer changed the value since base, the stored value otherwise
+    if ours == base:
+        return theirs
+    if theirs != base and theirs != ours:
+        conflicts.append(path)
+    return ours
+
+
+def _merge_dict(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any], path: str,
+                conflicts: List[str]) -> Dict[str, Any]:
+    merged = dict(theirs)
+    for key in list(base) + [key for key in ours if key not in base]:
+        value = _merge_value(base.get(key, _MISSING), ours.get(key, _MISSING), theirs.get(key, _MISSING),
+                             f"{path}.{key}", conflicts)
+        if value is _MISSING:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _merge_rules(base: List[Dict[str, Any]], ours: List[Dict[str, Any]], theirs: List[Dict[str, Any]],
+                 conflicts: List[str]) -> List[Dict[str, Any]]:
+    merged = _merge_dict({rule["id"]: rule for rule in base}, {rule["id"]: rule for rule in ours},
+                         {rule["id"]: rule for rule in theirs}, "ltm.learned_rules", conflicts)
+    # Stored order first, then the rules this writer added
+    order = [rule["id"] for rule in theirs] + [rule["id"] for rule in ours]
+    return [merged[rule_id] for rule_id in dict.fromkeys(order) if rule_id in merged]
+
+
+def _appended(base: List[Any], ours: List[Any]) -> List[Any]:
+    # Entries this writer appended to an append-only list since base
+    return ours[len(base):]
+
+
+def merge_agent_state(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Three-way merge of agent documents (AbstractAgentPydantic dumps) after a version conflict.
+
+    base is the stored state this writer started from, ours its current state and theirs what
+    another writer stored meanwhile. Commutative changes combine: history turns and past
+    iterations appended on both sides are all kept (turns below either side's spill mark stay in
+    the history index only), and rules are merged by id. Other fields merge
+    per key; where both sides changed the same key to different values ours wins and the key is
+    reported in the returned conflict list.
+    """
+    conflicts: List[str] = []
+    base_stm, ours_stm, theirs_stm = base["stm"], ours["stm"], theirs["stm"]
+    # History is spilled from the front, so the turns this writer added are the last
+    # (total turns now - total turns at base) of its history
+    added_turns = ours_stm["history_spilled"] + len(ours_stm["history"]) - base_stm["history_spilled"] - len(base_stm["history"])
+    kept_turns = ours_stm["history"][-added_turns:] if added_turns > 0 else []
+    # Added turns this writer already spilled are only in the history index (None placeholders)
+    history = theirs_stm["history"] + [None] * (max(added_turns, 0) - len(kept_turns)) + kept_turns
+    # Turns below the higher spill mark are already in the history index (spilled by either
+    # writer), so they leave STM and history_spilled stays the index's high-water mark
+    history_spilled = max(ours_stm["history_spilled"], theirs_stm["history_spilled"])
+    stm = {
+        "session_id": _merge_value(base_stm["session_id"], ours_stm["session_id"], theirs_stm["session_id"], "stm.session_id", conflicts),
+        "history": [turn for turn in history[history_spilled - theirs_stm["history_spilled"]:] if turn is not None],
+        "history_spilled": history_spilled,
+    }
+    for key in ("current_task_data", "scratchpad"):
+        stm[key] = _merge_dict(base_stm[key], ours_stm[key], theirs_stm[key], f"stm.{key}", conflicts)
+
+    base_ltm, ours_ltm, theirs_ltm = base["ltm"], ours["ltm"], theirs["ltm"]
+    ltm = {
+        "knowledge_base": _merge_dict(base_ltm["knowledge_base"], ours_ltm["knowledge_base"], theirs_ltm["knowledge_base"],
+                                      "ltm.knowledge_base", conflicts),
+        "learned_rules": _merge_rules(base_ltm["learned_rules"], ours_ltm["learned_rules"], theirs_ltm["learned_rules"], conflicts),
+        "past_project_iterations": theirs_ltm["past_project_iterations"] + _appended(base_ltm["past_project_iterations"],
+                                                                                   ours_ltm["past_project_iterations"]),
+    }
+
+    merged = {
+        "id": theirs["id"],
+        "name": _merge_value(base["name"], ours["name"], theirs["name"], "name", conflicts),
+        "role": _merge_value(base["role"], ours["role"], theirs["role"], "role", conflicts),
+        "config": _merge_dict(base["config"], ours["config"], theirs["config"], "config", conflicts),
+        "stm": stm,
+        "ltm": ltm,
+    }
+    return merged, conflicts
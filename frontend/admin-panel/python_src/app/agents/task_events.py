@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+from app.models.task import TaskStatus, MainTask, SubTask, TaskEvent
+
+
+def record_transition(main_task: MainTask, subtask: Optional[SubTask], to_status: TaskStatus, results: Optional[Dict[str, Any]] = None) -> TaskEvent:
+    """Apply a status transition to main_task in place and return the event describing it."""
+    target = subtask if subtask is not None else main_task
+    main_task.event_seq += 1
+    event = TaskEvent(
+        main_task_id=main_task.id,
+        seq=main_task.event_seq,
+        subtask_id=subtask.id if subtask is not None else None,
+        from_status=target.status,
+        to_status=to_status,
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        results=results or {}
+    )
+    target.status = to_status
+    if subtask is not None and results:
+        subtask.results = results
+    return event
+
+
+def project_main_task(snapshot: MainTask, events: List[TaskEvent]) -> MainTask:
+    """Materialize MainTask state from a snapshot plus the events logged after it."""
+    subtasks_by_id = {st.id: st for st in snapshot.sub_tasks}
+    for event in sorted(events, key=lambda e: e.seq):
+        if event.main_task_id != snapshot.id or event.seq <= snapshot.event_seq:
+            continue # Already reflected in the snapshot
+        if event.subtask_id is None:
+            snapshot.status = event.to_status
+        elif event.subtask_id in subtasks_by_id:
+            subtask = subtasks_by_id[event.subtask_id]
+            subtask.status = event.to_status
+            if event.results:
+                subtask.results = event.results
+        snapshot.event_seq = event.seq
+    return snapshot
@@ -0,0 +1,56 @@
+from typing import List, Dict, Any, Tuple
+from app.models.task import TaskStatus, SubTask
+
+# One byte per subtask status instead of a full SubTask model
+STATUS_CODES = {status: code for code, status in enumerate(TaskStatus)}
+COMPLETED_CODE = STATUS_CODES[TaskStatus.COMPLETED]
+PENDING_CODE = STATUS_CODES[TaskStatus.PENDING]
+
+
+class TaskGraph:
+    """Compact status/dependency view of a plan used by the scheduler.
+
+    Built straight from the subtask dicts persisted in STM, so selecting the next
+    executable group does not have to validate every SubTask of the plan. Dependencies
+    are stored as index tuples; unknown dependency ids point at a sentinel slot that is
+    never completed, so such subtasks are never scheduled.
+    """
+    __slots__ = ("ids", "index", "status", "dependencies")
+
+    def __init__(self, ids: List[str], index: Dict[str, int], status: bytearray, dependencies: List[Tuple[int, ...]]):
+        self.ids = ids
+        self.index = index
+        self.status = status
+        self.dependencies = dependencies
+
+    @classmethod
+    def from_task_data(cls, sub_tasks: List[Dict[str, Any]]) -> "TaskGraph":
+        # Trusted data written by ManagerAgent._save_main_task; no model validation.
+        ids = [st["id"] for st in sub_tasks]
+        index = {subtask_id: i for i, subtask_id in enumerate(ids)}
+        missing = len(ids) # Sentinel slot
+        status = bytearray(STATUS_CODES[TaskStatus(st.get("status", TaskStatus.PENDING))] for st in sub_tasks)
+        status.append(PENDING_CODE)
+        dependencies = [tuple(index.get(dep_id, missing) for dep_id in st.get("dependencies") or ()) for st in sub_tasks]
+        return cls(ids, index, status, dependencies)
+
+    @classmethod
+    def from_subtasks(cls, sub_tasks: List[SubTask]) -> "TaskGraph":
+        return cls.from_task_data([{"id": st.id, "status": st.status, "dependencies": st.dependencies} for st in sub_tasks])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def ready(self) -> List[int]:
+        """Indices of pending subtasks whose dependencies are all completed, in plan order."""
+        status = self.status
+        return [
+            i for i, deps in enumerate(self.dependencies)
+            if status[i] == PENDING_CODE and all(status[d] == COMPLETED_CODE for d in deps)
+        ]
+
+    def set_status(self, subtask_id: str, status: TaskStatus):
+        self.status[self.index[subtask_id]] = STATUS_CODES[TaskStatus(status)]
+
+    def all_completed(self) -> bool:
+        return all(code == COMPLETED_CODE for code in self.status[:len(self.ids)])
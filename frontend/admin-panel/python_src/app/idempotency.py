@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import orjson
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+# How long a request waits for the same key running in another process before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+POLL_INTERVAL = 0.1
+KEY_PREFIX = "idempotency:"
+
+
+class IdempotencyConflict(Exception):
+    # The key is in use with a different request body, or its first request is still running elsewhere
+    pass
+
+
+def request_fingerprint(payload: Any) -> str:
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class InMemoryIdempotencyStore:
+    # Process-local store for development and tests
+    def __init__(self):
+        self._entries: Dict[str, Tuple[bytes, float]] = {}
+        self._claims: Dict[str, float] = {}
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        for key in [key for key, expires_at in self._claims.items() if expires_at <= now]:
+            del self._claims[key]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self._prune()
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._claims.pop(key, None)
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        self._prune()
+        if key in self._claims:
+            return False
+        self._claims[key] = time.monotonic() + ttl
+        return True
+
+    async def release(self, key: str):
+        self._claims.pop(key, None)
+
+
+class RedisIdempotencyStore:
+    def __init__(self, host: str, port: int):
+        import redis.asyncio as redis_asyncio # Only needed when Redis is configured
+        self.client = redis_asyncio.Redis(host=host, port=port)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(KEY_PREFIX + key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(KEY_PREFIX + key, value, ex=ttl)
+        await self.client.delete(KEY_PREFIX + key + ":claim")
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        # SET NX makes exactly one process the owner of an in-flight key
+        return bool(await self.client.set(KEY_PREFIX + key + ":claim", b"1", nx=True, ex=ttl))
+
+    async def release(self, key: str):
+        await self.client.delete(KEY_PREFIX + key + ":claim")
+
+
+class IdempotencyCache:
+    """Runs a request at most once per idempotency key within the TTL.
+
+    Concurrent callers with the same key in this process await the first caller's
+    future; callers in other processes poll the shared store for the stored result.
+    Failed executions are not cached, so a retry after an error runs again.
+    """
+
+    def __init__(self, store, ttl: int = IDEMPOTENCY_TTL, wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyCache":
+        redis_host = os.getenv("REDIS_HOST")
+        if redis_host:
+            return cls(RedisIdempotencyStore(redis_host, int(os.getenv("REDIS_PORT", "6379"))))
+        return cls(InMemoryIdempotencyStore())
+
+    def _unpack(self, stored: bytes, fingerprint: str) -> Any:
+        entry = orjson.loads(stored)
+        if entry["fingerprint"] != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+        return entry["result"]
+
+    async def run(self, key: str, fingerprint: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        stored = await self.store.get(key)
+        if stored is not None:
+            return self._unpack(stored, fingerprint)
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            result, in_flight_fingerprint = await asyncio.shield(in_flight)
+            if in_flight_fingerprint != fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+            return result
+
+        # The claim expires on its own if this process dies mid-request
+        if not await self.store.claim(key, math.ceil(self.wait_seconds)):
+            return await self._wait_for_other_process(key, fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception()) # Waiters are optional
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+            await self.store.set(key, orjson.dumps({"fingerprint": fingerprint, "result": result}), self.ttl)
+        except asyncio.CancelledError:
+            await self.store.release(key)
+            future.cancel()
+            raise
+        except Exception as e:
+            await self.store.release(key)
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result((result, fingerprint))
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _wait_for_other_process(self, key: str, fingerprint: str) -> Any:
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            stored = await self.store.get(key)
+            if stored is not None:
+                return self._unpack(stored, fingerprint)
+        raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
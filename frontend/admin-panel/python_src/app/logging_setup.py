@@ -0,0 +1,103 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Dict, Optional
+import orjson
+from app.tracing import TraceContextFilter
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower() # json | text
+# High-frequency events logged through log_sampled are emitted once every N occurrences
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+ROOT_LOGGER_NAME = "app"
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is emitted as a field
+_STANDARD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line: time, level, logger, message, trace ids and any extra fields
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        return orjson.dumps(entry, default=str).decode()
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> logging.Logger:
+    """Route the "app" loggers through a queue to a background thread that writes to stdout.
+
+    Calling it again only updates the level.
+    """
+    global _listener
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.setLevel(level)
+    with _configure_lock:
+        if _listener is not None:
+            return logger
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if fmt == "json":
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(logging.Formatter(
+                "%(asctime)s %(levelname)s %(name)s [trace=%(trace_id)s span=%(span_id)s] %(message)s"))
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        # Filters and message formatting run on the calling thread, only for records that pass the
+        # level check; trace ids are captured there while the caller's span is still current
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(TraceContextFilter())
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging():
+    # Flushes records still in the queue
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class EveryNSampler:
+    # Counts occurrences per key; True on the 1st, (N+1)th, (2N+1)th... occurrence
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, key: str, every: int) -> bool:
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+_sampler = EveryNSampler()
+
+
+def log_sampled(logger: logging.Logger, level: int, key: str, msg: str, *args, every: int = LOG_SAMPLE_EVERY, **kwargs):
+    """Log a high-frequency event once every `every` occurrences of `key`.
+
+    Costs a level check when the level is disabled. Emitted records carry sample_every so counts can be scaled back.
+    """
+    if not logger.isEnabledFor(level) or not _sampler(key, every):
+        return
+    extra = dict(kwargs.pop("extra", None) or {}, sample_every=every)
+    logger.log(level, msg, *args, extra=extra, **kwargs)
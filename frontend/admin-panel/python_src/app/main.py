@@ -1,35 +1,193 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from contextlib import asynccontextmanager
-from app.services.elasticsearch_service import ElasticsearchService, AGENT_INDEX_NAME, AbstractAgentPydantic
-from app.agents.base import AbstractAgent, get_es_service # To use the getter
+from app.models.agent import AbstractAgentPydantic
+from app.agents.base import AbstractAgent, get_es_service, get_write_ahead_log, flush_write_ahead_log, close_write_ahead_log, get_message_buffer, flush_message_buffer # To use the getter
+from app.services.write_ahead_log import WAL_FLUSH_INTERVAL
+from app.services.message_buffer import MESSAGE_FLUSH_INTERVAL
+from app.services.storage import DEFAULT_MESSAGE_PAGE_SIZE
 from app.agents.manager import ManagerAgent # Example agent
 from app.models.memory import ShortTermMemory, LongTermMemory # For creating new agents
-from app.models.task import MainTask # For type hinting
-from typing import List
+from app.models.task import MainTask, TaskEvent # For type hinting
+from app.models.stats import FleetStats
+from app.models.message import MessageSearchPage
+from typing import List, Optional, Tuple
+import asyncio
+import hmac
+import logging
+import os
+import time
 
 # Add these imports to backend/app/main.py
 from app.workflow_manager import WorkflowManager
 from pydantic import BaseModel as PydanticBaseModel # Alias to avoid conflict with AbstractAgent's BaseModel
+from app.responses import FastJSONResponse
+from app.admission import AdmissionController, AdmissionRejected, DEFAULT_TENANT
+from app.idempotency import IdempotencyCache, IdempotencyConflict, request_fingerprint
+from fastapi.concurrency import run_in_threadpool
+from app.metrics import REGISTRY
+from app.tracing import EXPORTER, start_span, build_trace_tree
+from app.storage_accounting import accounted, storage_accounting
+from app.logging_setup import configure_logging
+from app.profiling import PROFILES, PROFILE_MODES, ADMIN_TOKEN, PROFILING_OPEN, profile_request, profiled
+from fastapi.responses import PlainTextResponse, JSONResponse
+
+# Structured, queue-backed logging for all app.* loggers (see LOG_LEVEL / LOG_FORMAT)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 es_service_instance = None
 
+# Backoff between background attempts to reach the storage backend at startup
+STORAGE_CONNECT_RETRY_SECONDS = float(os.getenv("STORAGE_CONNECT_RETRY_SECONDS", "1"))
+STORAGE_CONNECT_RETRY_MAX_SECONDS = float(os.getenv("STORAGE_CONNECT_RETRY_MAX_SECONDS", "30"))
+# Interval of the background health check while the backend is healthy
+STORAGE_HEALTH_INTERVAL = float(os.getenv("STORAGE_HEALTH_INTERVAL", "5"))
+
+# Dashboards poll GET /stats; the aggregations behind it run at most once per this many seconds
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "10"))
+_stats_cache: Optional[Tuple[FleetStats, float]] = None # (stats, expires_at)
+MAX_MESSAGE_PAGE_SIZE = 100 # Upper bound of ?size= for message search pages
+
+# Opt-in orjson/compressed responses for large payloads (agent lists, workflow results)
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+
+# Limits concurrent run_main_task_loop executions (see WORKFLOW_MAX_* / TENANT_* env vars)
+workflow_admission = AdmissionController.from_env()
+# Results of workflow submissions by Idempotency-Key (Redis when REDIS_HOST is set, else in-memory)
+workflow_idempotency = IdempotencyCache.from_env()
+
+# Admission state is read at scrape time
+REGISTRY.gauge("workflow_admission_queue_depth", "Workflow requests waiting for a slot", lambda: workflow_admission.queue_depth)
+REGISTRY.gauge("workflow_admission_in_flight", "Workflow requests currently executing", lambda: workflow_admission.in_flight)
+REGISTRY.gauge("workflow_admission_avg_wait_seconds", "Average queue wait of admitted workflow requests", lambda: workflow_admission.metrics()["avg_wait_seconds"])
+REGISTRY.gauge("storage_available", "1 while the storage backend is connected and its circuit is not open", lambda: float(_storage_ready()))
+
+def _storage_ready() -> bool:
+    # Connected, and not failing fast behind an open circuit (Elasticsearch)
+    if not es_service_instance or not es_service_instance.client:
+        return False
+    return getattr(es_service_instance, "available", True)
+
+def _check_storage() -> bool:
+    check_health = getattr(es_service_instance, "check_health", None)
+    if check_health:
+        return check_health()
+    if es_service_instance and es_service_instance.client:
+        return True
+    connect = getattr(es_service_instance, "connect", None)
+    return bool(connect and connect())
+
+async def monitor_storage():
+    # Connects in the background, then keeps probing so the circuit breaker notices outages and
+    # recoveries without requests having to wait on timeouts. /health/ready reports the outcome.
+    delay = STORAGE_CONNECT_RETRY_SECONDS
+    healthy = False
+    while True:
+        was_healthy, healthy = healthy, await run_in_threadpool(_check_storage)
+        if healthy:
+            if not was_healthy:
+                logger.info("Elasticsearch connection established successfully.")
+            if not hasattr(es_service_instance, "check_health"):
+                return # Nothing to monitor once connected
+            delay = STORAGE_CONNECT_RETRY_SECONDS
+            await asyncio.sleep(STORAGE_HEALTH_INTERVAL)
+        else:
+            logger.error("Elasticsearch service unavailable. Retrying in %.1fs.", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STORAGE_CONNECT_RETRY_MAX_SECONDS)
+
+async def flush_write_ahead_log_periodically():
+    # Replays writes logged during outages (or batched by group commit) once storage takes them
+    while True:
+        await asyncio.sleep(WAL_FLUSH_INTERVAL)
+        if _storage_ready():
+            try:
+                await run_in_threadpool(flush_write_ahead_log)
+            except Exception as e:
+                logger.exception("Write-ahead log replay failed: %s", e)
+
+async def flush_messages_periodically():
+    # Bulk-indexes conversation turns buffered since the last flush (see MessageBuffer)
+    while True:
+        await asyncio.sleep(MESSAGE_FLUSH_INTERVAL)
+        if _storage_ready():
+            try:
+                await run_in_threadpool(flush_message_buffer)
+            except Exception as e:
+                logger.exception("Message index flush failed: %s", e)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global es_service_instance
-    print("Application startup: Initializing Elasticsearch connection...")
-    # Initialize ES Service from agents.base to ensure it's the same instance
-    es_service_instance = get_es_service() 
-    if not es_service_instance or not es_service_instance.client:
-        print("ERROR: Elasticsearch service failed to initialize. API might not function correctly.")
-        # Optionally, raise an exception here to prevent startup if ES is critical
-    else:
-        print("Elasticsearch connection established successfully.")
+    logger.info("Application startup: Initializing Elasticsearch connection in the background...")
+    # Same instance as agents.base; created unconnected so the app serves (and reports not ready) right away
+    es_service_instance = get_es_service(connect=False)
+    background_tasks = [asyncio.create_task(monitor_storage())]
+    wal = get_write_ahead_log()
+    if wal:
+        background_tasks.append(asyncio.create_task(flush_write_ahead_log_periodically()))
+    if get_message_buffer() is not None:
+        background_tasks.append(asyncio.create_task(flush_messages_periodically()))
     yield
-    print("Application shutdown: Cleaning up resources (if any)...")
+    logger.info("Application shutdown: Cleaning up resources (if any)...")
+    for task in background_tasks:
+        task.cancel()
+    flush_message_buffer()
+    if wal:
+        flush_write_ahead_log()
+        close_write_ahead_log() # Anything not replayed stays in the log for the next start
 
 
 app = FastAPI(title="Agent Management System API", lifespan=lifespan)
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Root span of each request; workflow, subtask and ES spans nest under it. Storage calls are
+    # only counted here (budgets apply per workflow) and reported in X-Storage-Calls.
+    with start_span("http.request", http_method=request.method, http_route=request.url.path) as span, \
+         storage_accounting("request", mode="off") as storage_usage:
+        response = await call_next(request)
+        response.headers["X-Storage-Calls"] = str(storage_usage.total_calls)
+        if span:
+            span.set_attribute("http_status_code", response.status_code)
+            response.headers["X-Trace-ID"] = span.trace_id
+        return response
+
+def _is_admin(request: Request) -> bool:
+    # Closed without ADMIN_TOKEN, unless PROFILING_OPEN is set for local development
+    if not ADMIN_TOKEN:
+        return PROFILING_OPEN
+    return hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    # Profiles a request when it sends X-Profile: cprofile|sample, or when profiling was armed via /admin/profiling
+    mode = request.headers.get("x-profile")
+    if mode not in PROFILE_MODES or not _is_admin(request):
+        mode = PROFILES.take_armed(request.url.path)
+    if not mode:
+        return await call_next(request)
+    with profile_request(mode, request.method, request.url.path) as session:
+        response = await call_next(request)
+    PROFILES.add(session.finish(response.status_code))
+    response.headers["X-Profile-ID"] = session.id
+    return response
+
+@app.get("/health/live")
+async def liveness():
+    # The process is up and serving; it does not depend on the storage backend
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    # Ready to take traffic once the storage backend is connected and its indices exist
+    ready = _storage_ready()
+    body = {"status": "ready" if ready else "not_ready", "storage": "available" if ready else "unavailable"}
+    breaker = getattr(es_service_instance, "breaker", None)
+    if breaker:
+        body["circuit"] = breaker.state
+    return body if ready else JSONResponse(body, status_code=503)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Agent Management System API", "elasticsearch_status": "initialized" if es_service_instance and es_service_instance.client else "error"}
@@ -50,25 +208,109 @@ async def create_agent_api(agent_data: AbstractAgentPydantic):
     # AbstractAgent and ManagerAgent instances are compatible with AbstractAgentPydantic
     return agent 
 
+def _etag(version: str) -> str:
+    return f'"{version}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
 @app.get("/agents/{agent_id}", response_model=AbstractAgentPydantic)
-async def get_agent_api(agent_id: str):
+async def get_agent_api(agent_id: str, request: Request, response: Response):
+    # Conditional GET: polling clients send back the ETag they have. The version check is a
+    # source-less lookup (usually served from the service's version cache), so an unchanged
+    # agent is answered with 304 without loading or serializing the document.
+    if request.headers.get("if-none-match"):
+        es_service = accounted(get_es_service())
+        version = es_service.get_agent_version(agent_id) if es_service and es_service.client else None
+        if version and _etag_matches(request, _etag(version)):
+            return Response(status_code=304, headers={"ETag": _etag(version)})
+
     # Create a new agent instance to load data into. 
     agent_shell = AbstractAgent() 
     if not agent_shell.load_state(agent_id):
         raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found")
     
+    if agent_shell.version:
+        response.headers["ETag"] = _etag(agent_shell.version)
     # agent_shell is an instance of AbstractAgent, which is compatible with AbstractAgentPydantic
     return agent_shell
 
 @app.get("/agents/", response_model=List[AbstractAgentPydantic])
-async def list_agents_api():
+async def list_agents_api(request: Request, partition: Optional[str] = None):
+    # ?partition= limits the listing to one tenant (or role, see AGENT_PARTITION_BY)
     global es_service_instance # Ensure we are using the initialized instance
     if not es_service_instance or not es_service_instance.client:
         raise HTTPException(status_code=500, detail="Elasticsearch service not available")
-    agents_data = es_service_instance.get_all_agents()
+    agents_data = accounted(es_service_instance).get_all_agents(partition=partition)
+    if FAST_JSON_RESPONSES:
+        # STM/LTM were already validated by get_all_agents; only project the response fields
+        agent_fields = AbstractAgentPydantic.model_fields.keys()
+        return FastJSONResponse(
+            [{field: data.get(field) for field in agent_fields} for data in agents_data],
+            accept_encoding=request.headers.get("accept-encoding")
+        )
     # Convert list of dicts from ES service to list of AbstractAgentPydantic models
     return [AbstractAgentPydantic(**data) for data in agents_data]
 
+@app.get("/stats", response_model=FleetStats)
+async def fleet_stats_api(response: Response):
+    # Agents per role, tasks per status, rules per context and history sizes, aggregated by the
+    # backend instead of counting a full agent listing client-side
+    global _stats_cache
+    now = time.monotonic()
+    if _stats_cache is None or _stats_cache[1] <= now:
+        if not es_service_instance or not es_service_instance.client:
+            raise HTTPException(status_code=500, detail="Elasticsearch service not available")
+        stats = accounted(es_service_instance).get_fleet_stats()
+        if stats is None:
+            raise HTTPException(status_code=500, detail="Failed to compute fleet statistics")
+        _stats_cache = (stats, now + STATS_CACHE_TTL)
+    response.headers["Cache-Control"] = f"max-age={max(0, int(_stats_cache[1] - now))}"
+    return _stats_cache[0]
+
+@app.get("/search/messages", response_model=MessageSearchPage)
+async def search_messages_api(q: str = Query(min_length=1), agent_id: Optional[str] = None, session_id: Optional[str] = None,
+                              size: int = Query(DEFAULT_MESSAGE_PAGE_SIZE, ge=1, le=MAX_MESSAGE_PAGE_SIZE), cursor: Optional[str] = None):
+    # Full-text search over conversation turns; follow next_cursor for further pages
+    if not es_service_instance or not es_service_instance.client:
+        raise HTTPException(status_code=500, detail="Elasticsearch service not available")
+    try:
+        page = accounted(es_service_instance).search_messages(q, agent_id=agent_id, session_id=session_id, size=size, cursor=cursor)
+    except ValueError as e: # Malformed cursor
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=500, detail="Failed to search messages")
+    return page
+
+@app.get("/tasks/{main_task_id}/events", response_model=List[TaskEvent])
+async def get_task_events_api(main_task_id: str, request: Request, response: Response):
+    # Full execution timeline of a MainTask from the append-only task event log
+    global es_service_instance
+    if not es_service_instance or not es_service_instance.client:
+        raise HTTPException(status_code=500, detail="Elasticsearch service not available")
+    storage = accounted(es_service_instance)
+    # The log is append-only, so its last seq and size version the whole timeline; a revalidation
+    # that still matches costs one aggregation instead of fetching every event
+    version = storage.get_task_events_version(main_task_id)
+    if version is not None:
+        etag = _etag(f"{main_task_id}-{version[0]}-{version[1]}")
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return storage.get_task_events(main_task_id)
+
+@app.get("/tasks/{main_task_id}/trace")
+async def get_task_trace_api(main_task_id: str):
+    # Span tree of the request that ran a MainTask, from the in-memory trace buffer
+    trace_id = EXPORTER.trace_id_for_main_task(main_task_id)
+    if not trace_id:
+        raise HTTPException(status_code=404, detail=f"No trace recorded for main task {main_task_id}")
+    return {"main_task_id": main_task_id, "trace_id": trace_id, "spans": build_trace_tree(EXPORTER.get_trace(trace_id))}
+
 # Example: Test endpoint to create and load a ManagerAgent
 @app.post("/test_manager_lifecycle/")
 async def test_manager():
@@ -101,38 +343,115 @@ class RunWorkflowRequest(PydanticBaseModel):
     designated_agent_ids: List[str] = [] # Optional, Manager might have defaults or discover
     overall_goal_desc: str
 
-@app.post("/workflow/run_main_task")
-async def run_main_task_workflow(request: RunWorkflowRequest):
-    # This assumes a single ManagerAgent instance for simplicity.
-    # In a multi-user or multi-tenant system, you'd fetch or create a ManagerAgent per user/session.
+def _run_workflow(request: RunWorkflowRequest) -> dict:
+    with profiled(): # Collects cProfile/sampler data in this worker thread when the request is profiled
+        # This assumes a single ManagerAgent instance for simplicity.
+        # In a multi-user or multi-tenant system, you'd fetch or create a ManagerAgent per user/session.
     
-    # Try to load a default manager or create one if not found
-    manager_id = "default_manager_001" # Example static ID
-    manager = ManagerAgent(id=manager_id, name="DefaultWorkflowManager")
+        # Try to load a default manager or create one if not found
+        manager_id = "default_manager_001" # Example static ID
+        manager = ManagerAgent(id=manager_id, name="DefaultWorkflowManager")
     
-    # Try to load its state. If not found, it's a new manager (or using default state).
-    if not manager.load_state(): 
-        print(f"Manager with ID {manager_id} not found or failed to load. Using new/default state.")
-        # Save initial state if it's considered "new"
-        manager.save_state() 
-    else:
-        print(f"Loaded existing Manager {manager.id} ({manager.name})")
+        # Try to load its state. If not found, it's a new manager (or using default state).
+        if not manager.load_state(): 
+            logger.warning("Manager with ID %s not found or failed to load. Using new/default state.", manager_id)
+            # Save initial state if it's considered "new"
+            manager.save_state() 
+        else:
+            logger.info("Loaded existing Manager %s (%s)", manager.id, manager.name)
 
-    workflow_runner = WorkflowManager(manager_agent=manager)
+        workflow_runner = WorkflowManager(manager_agent=manager)
     
+        try:
+            return workflow_runner.run_main_task_loop(
+                user_query=request.user_query,
+                designated_agent_ids=request.designated_agent_ids,
+                overall_goal_desc=request.overall_goal_desc
+            )
+        except Exception as e:
+            # Log the exception details for debugging
+            logger.exception("Error during workflow execution: %s", e)
+            raise HTTPException(status_code=500, detail=f"Workflow execution failed: {str(e)}")
+
+async def _admit_and_run_workflow(request: RunWorkflowRequest, tenant: str) -> dict:
     try:
-        result = workflow_runner.run_main_task_loop(
-            user_query=request.user_query,
-            designated_agent_ids=request.designated_agent_ids,
-            overall_goal_desc=request.overall_goal_desc
-        )
-        return result
-    except Exception as e:
-        # Log the exception details for debugging
-        print(f"Error during workflow execution: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Workflow execution failed: {str(e)}")
+        async with workflow_admission.admit(tenant):
+            # The loop is blocking; run it in the threadpool so queued requests and
+            # other endpoints keep being served while it executes.
+            return await run_in_threadpool(_run_workflow, request)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": e.retry_after_header})
+
+@app.post("/workflow/run_main_task")
+async def run_main_task_workflow(request: RunWorkflowRequest, http_request: Request):
+    tenant = http_request.headers.get("x-tenant-id", DEFAULT_TENANT)
+    idempotency_key = http_request.headers.get("idempotency-key")
+    if idempotency_key:
+        # Retries with the same key share the first submission's execution and result
+        try:
+            result = await workflow_idempotency.run(
+                f"{tenant}:{idempotency_key}",
+                request_fingerprint(request.model_dump()),
+                lambda: _admit_and_run_workflow(request, tenant)
+            )
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    else:
+        result = await _admit_and_run_workflow(request, tenant)
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(result, accept_encoding=http_request.headers.get("accept-encoding"))
+    return result
+
+@app.get("/workflow/admission")
+async def workflow_admission_metrics():
+    # Queue depth, in-flight count and wait times of the workflow admission controller
+    return workflow_admission.metrics()
+
+class ArmProfilingRequest(PydanticBaseModel):
+    mode: str = "sample"
+    path_prefix: str = "/workflow/"
+    count: int = 1
+
+def _require_admin(request: Request):
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/profiling", status_code=202)
+async def arm_profiling(arm_request: ArmProfilingRequest, request: Request):
+    # Profile the next `count` requests whose path starts with path_prefix
+    _require_admin(request)
+    if arm_request.mode not in PROFILE_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(PROFILE_MODES)}")
+    PROFILES.arm(arm_request.mode, arm_request.path_prefix, arm_request.count)
+    return {"armed": PROFILES.armed()}
+
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    _require_admin(request)
+    return PROFILES.summaries()
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    # Top-N functions; cumulative time for cprofile, self samples for sample
+    _require_admin(request)
+    profile = PROFILES.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return {key: value for key, value in profile.items() if key != "collapsed"}
+
+@app.get("/admin/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed(profile_id: str, request: Request):
+    # Collapsed stacks ("frame;frame;frame count"), the input format of flamegraph.pl and speedscope
+    _require_admin(request)
+    profile = PROFILES.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return PlainTextResponse(profile["collapsed"])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Prometheus text exposition format: workflow phase latencies, ES operation latency/payload/errors, admission gauges
+    return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -1,2 +1,2 @@
 from .memory import ShortTermMemory, LongTermMemory
-from .task import TaskStatus, SubTask, Goal, Rule, MainTask
+from .task import TaskStatus, SubTask, Goal, Rule, MainTask, TaskEvent
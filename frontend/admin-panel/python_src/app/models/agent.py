@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import Dict, Any
+from app.models.memory import ShortTermMemory, LongTermMemory
+
+# Pydantic model of a stored agent, used for API request/response bodies and for type hinting
+# in the storage services. It should match the structure of app.agents.base.AbstractAgent
+class AbstractAgentPydantic(BaseModel):
+    id: str
+    name: str
+    role: str
+    stm: ShortTermMemory
+    ltm: LongTermMemory
+    config: Dict[str, Any]
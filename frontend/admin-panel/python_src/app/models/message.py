@@ -0,0 +1,25 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+import uuid
+
+# One conversation turn as indexed for full-text search (GET /search/messages).
+# The id is assigned when the turn is recorded, so re-sending a batch never duplicates it.
+class ChatMessage(BaseModel):
+    id: str = Field(default_factory=lambda: "msg_" + str(uuid.uuid4()))
+    agent_id: str
+    session_id: str
+    seq: int # Position in the agent's full history (STM plus spilled turns)
+    role: str
+    content: str
+    timestamp: str
+
+class MessageHit(BaseModel):
+    message: ChatMessage
+    score: Optional[float] = None
+    highlights: List[str] = [] # Fragments of content with the matched terms in <em> tags
+
+class MessageSearchPage(BaseModel):
+    total: int
+    total_relation: Literal["eq", "gte"] = "eq" # "gte": total is a lower bound (counting stopped early)
+    hits: List[MessageHit]
+    next_cursor: Optional[str] = None # Pass as ?cursor= for the next page; None on the last page
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+from typing import Dict, List
+
+class HistorySizeBucket(BaseModel):
+    min_turns: int # Lower bound of the bucket; it spans history_bucket_size turns
+    agents: int
+
+# Fleet-wide counts for the admin dashboards (GET /stats)
+class FleetStats(BaseModel):
+    agents_total: int
+    agents_by_role: Dict[str, int]
+    # Current status of each MainTask that has logged a transition
+    tasks_by_status: Dict[str, int]
+    rules_total: int
+    rules_by_context: Dict[str, int]
+    history_bucket_size: int
+    # Agents by total conversation turns (in STM plus spilled); empty buckets are omitted
+    history_sizes: List[HistorySizeBucket]
+    generated_at: str
@@ -62,3 +62,16 @@ class MainTask(BaseModel):
     applied_rules: List[Rule] = []
     # Results of the main task execution
     final_results: Dict[str, Any] = {}
+    # Sequence number of the last task event reflected in this state (see TaskEvent)
+    event_seq: int = 0
+
+class TaskEvent(BaseModel):
+    # One status transition in the append-only task event log.
+    # subtask_id is None for transitions of the MainTask itself.
+    main_task_id: str
+    seq: int
+    subtask_id: Optional[str] = None
+    from_status: Optional[TaskStatus] = None
+    to_status: TaskStatus
+    timestamp: str
+    results: Dict[str, Any] = {}
@@ -0,0 +1,197 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Modes: "cprofile" (deterministic, higher overhead) or "sample" (periodic stack sampling, low overhead)
+PROFILE_MODES = ("cprofile", "sample")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "20")) # Finished profiles kept for the admin endpoints
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005")) # Seconds between stack samples
+# Profiling headers and admin endpoints require a matching X-Admin-Token header. Without
+# ADMIN_TOKEN they are closed, unless PROFILING_OPEN=true opens them to anyone (local development only).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILING_OPEN = os.getenv("PROFILING_OPEN", "false").lower() == "true"
+
+
+class StackSampler:
+    # Samples the stacks of registered threads from a background thread
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread_ids: set = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def add_thread(self, thread_id: int):
+        self._thread_ids.add(thread_id)
+        if not self._thread.is_alive() and not self._stop.is_set():
+            self._thread.start()
+
+    def remove_thread(self, thread_id: int):
+        self._thread_ids.discard(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self._thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class ProfileSession:
+    """Profile data collected for one request, from every thread that ran part of it."""
+
+    def __init__(self, mode: str, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self.sampler = StackSampler() if mode == "sample" else None
+
+    @contextmanager
+    def collect(self):
+        # Profiles the calling thread for the duration of the block
+        if self.sampler is not None:
+            thread_id = threading.get_ident()
+            self.sampler.add_thread(thread_id)
+            try:
+                yield
+            finally:
+                self.sampler.remove_thread(thread_id)
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profilers.append(profiler)
+
+    def finish(self, status_code: Optional[int] = None, top_n: int = PROFILE_TOP_N) -> Dict[str, Any]:
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        result = {"id": self.id, "mode": self.mode, "method": self.method, "path": self.path,
+                  "status_code": status_code, "started_at": self.started_at, "duration_ms": duration_ms}
+        if self.sampler is not None:
+            self.sampler.stop()
+            stacks = self.sampler.stacks
+            self_samples: Counter = Counter()
+            for stack, count in stacks.items():
+                self_samples[stack.rsplit(";", 1)[-1]] += count
+            result["samples"] = sum(stacks.values())
+            result["top"] = [{"function": function, "samples": count} for function, count in self_samples.most_common(top_n)]
+            result["collapsed"] = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        else:
+            result["top"] = self._top_functions(top_n)
+            result["collapsed"] = ""
+        return result
+
+    def _top_functions(self, top_n: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return []
+        stats = pstats.Stats(profilers[0], stream=io.StringIO())
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n] # By cumulative time
+        return [{
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "ncalls": ncalls,
+            "tottime": tottime,
+            "cumtime": cumtime,
+        } for (filename, line, name), (_, ncalls, tottime, cumtime, _) in rows]
+
+
+class ProfileStore:
+    # Finished profiles, plus requests armed for profiling through the admin endpoint
+    def __init__(self, max_profiles: int = PROFILE_HISTORY):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._armed: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def arm(self, mode: str, path_prefix: str = "/", count: int = 1):
+        with self._lock:
+            self._armed.append({"mode": mode, "path_prefix": path_prefix, "remaining": count})
+
+    def take_armed(self, path: str) -> Optional[str]:
+        """Mode to profile this request with, consuming one armed slot; None if nothing is armed for it."""
+        with self._lock:
+            for armed in self._armed:
+                if path.startswith(armed["path_prefix"]):
+                    armed["remaining"] -= 1
+                    if armed["remaining"] <= 0:
+                        self._armed.remove(armed)
+                    return armed["mode"]
+        return None
+
+    def armed(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(armed) for armed in self._armed]
+
+    def add(self, profile: Dict[str, Any]):
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._profiles.get(profile_id)
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{key: value for key, value in profile.items() if key not in ("top", "collapsed")}
+                    for profile in reversed(self._profiles.values())]
+
+
+PROFILES = ProfileStore()
+
+_current_session: ContextVar[Optional[ProfileSession]] = ContextVar("profile_session", default=None)
+
+
+@contextmanager
+def profile_request(mode: str, method: str, path: str):
+    """Make a ProfileSession current for a request. Work inside profiled() blocks is collected."""
+    session = ProfileSession(mode, method, path)
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+
+
+@contextmanager
+def profiled():
+    # Wrap synchronous work (e.g. the workflow loop in the threadpool); a no-op unless the request is profiled
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    with session.collect():
+        yield
@@ -0,0 +1,70 @@
+import gzip
+from typing import Any, Optional, Mapping
+import orjson
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+
+try:
+    import brotli # Optional: enables "br" negotiation when installed
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed; compression would cost more than it saves
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _default(obj: Any) -> Any:
+    # orjson handles dicts, lists, enums and datetimes natively; models are dumped as-is
+    # since they were already validated when they were built.
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> set:
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.add(coding.lower())
+    return encodings
+
+
+class FastJSONResponse(Response):
+    """orjson-rendered JSON response with gzip/brotli negotiation for large bodies.
+
+    Returning it from an endpoint bypasses FastAPI's jsonable_encoder and response_model
+    re-validation, so it is meant for content that is already validated.
+    """
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: Any,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        accept_encoding: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.accept_encoding = accept_encoding
+        self.content_encoding = None
+        super().__init__(content, status_code, headers, self.media_type, background)
+        self.headers["vary"] = "Accept-Encoding"
+        if self.content_encoding:
+            self.headers["content-encoding"] = self.content_encoding
+
+    def render(self, content: Any) -> bytes:
+        body = orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return body
+        encodings = _accepted_encodings(self.accept_encoding)
+        if brotli is not None and "br" in encodings:
+            self.content_encoding = "br"
+            return brotli.compress(body, quality=BROTLI_QUALITY)
+        if "gzip" in encodings:
+            self.content_encoding = "gzip"
+            return gzip.compress(body, compresslevel=GZIP_LEVEL)
+        return body
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Fails calls fast while a dependency is unhealthy.
+
+    closed: calls go through; failure_threshold consecutive failures open the circuit.
+    open: calls are rejected until reset_timeout has passed or a health probe succeeds.
+    half_open: up to half_open_calls trial calls go through; a success closes the circuit,
+    a failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._transition(HALF_OPEN)
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        logger.warning("Circuit %s: %s -> %s", self.name, self._state, state, extra={"circuit": self.name, "state": state})
+        self._state = state
+        self._trial_calls = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._failures = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go through now; in half_open this takes one of the trial slots."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._trial_calls < self.half_open_calls:
+                self._trial_calls += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def record_probe(self, healthy: bool):
+        # Result of a background health check: an unhealthy dependency opens the circuit right
+        # away, a healthy one lets trial calls through without waiting for reset_timeout
+        with self._lock:
+            if not healthy:
+                self._transition(OPEN)
+                self._opened_at = time.monotonic() # Stay open while probes keep failing
+            elif self._state == OPEN:
+                self._transition(HALF_OPEN)
@@ -1,14 +1,99 @@
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Document, Text, Keyword, Object, connections, InnerDoc
+from elasticsearch import Elasticsearch, ApiError, ConflictError, TransportError
+from elasticsearch_dsl import Document, Text, Keyword, Object, Integer, Long, Date, MultiSearch, connections, InnerDoc, Q
 from elasticsearch.helpers import bulk
-from pydantic import BaseModel
+import logging
 import os
-from typing import Dict, Any, List
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Dict, Any, List, Optional, Tuple, Union
+import orjson
 from app.models.memory import ShortTermMemory, LongTermMemory # Assuming these are Pydantic models
+from app.models.task import Rule, TaskEvent
+from app.models.agent import AbstractAgentPydantic
+from app.models.stats import FleetStats, HistorySizeBucket
+from app.models.message import ChatMessage, MessageHit, MessageSearchPage
+from app.services.storage import WritePolicy, VersionConflict, agent_partition, format_version, parse_version, history_size, encode_cursor, decode_cursor, DEFAULT_RULE_RESULTS, DEFAULT_HISTORY_PAGE_SIZE, DEFAULT_MESSAGE_PAGE_SIZE, STATS_HISTORY_BUCKET_SIZE, STATS_TERMS_SIZE
+from app.metrics import timed_es_operation, record_es_payload, record_es_error
+from app.tracing import traced
+from app.services.circuit_breaker import CircuitBreaker, OPEN
+
+logger = logging.getLogger(__name__)
 
 # Get Elasticsearch host from environment variable
 ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST", "http://localhost:9200")
 AGENT_INDEX_NAME = "agents_index"
+RULE_INDEX_NAME = "rules_index"
+HISTORY_INDEX_NAME = "history_index"
+TASK_EVENT_INDEX_NAME = "task_events_index"
+MESSAGE_INDEX_NAME = "messages_index"
+# How long a known agent version is trusted before ES is asked again (conditional GETs)
+AGENT_VERSION_CACHE_TTL = float(os.getenv("AGENT_VERSION_CACHE_TTL", "2"))
+# Client-level timeout and retries of each request; the circuit breaker bounds how often a sick cluster is waited on
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "30"))
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "3"))
+# Consecutive failed operations that open the circuit, and how long it stays open before trial calls
+ES_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("ES_CIRCUIT_FAILURE_THRESHOLD", "5"))
+ES_CIRCUIT_RESET_TIMEOUT = float(os.getenv("ES_CIRCUIT_RESET_TIMEOUT", "30"))
+ES_HEALTH_TIMEOUT = float(os.getenv("ES_HEALTH_TIMEOUT", "2")) # Per-ping timeout of the health monitor, without retries
+# Settings of every managed index. ES_INDEX_SETTINGS (JSON) overrides them per index, e.g.
+# {"task_events_index": {"refresh_interval": "5s"}}. Replicas and refresh_interval are also
+# applied to existing indices on connect; shard counts only take effect when an index is created.
+ES_NUMBER_OF_SHARDS = int(os.getenv("ES_NUMBER_OF_SHARDS", "1"))
+ES_NUMBER_OF_REPLICAS = int(os.getenv("ES_NUMBER_OF_REPLICAS", "0"))
+ES_REFRESH_INTERVAL = os.getenv("ES_REFRESH_INTERVAL", "1s")
+ES_INDEX_SETTINGS: Dict[str, Dict[str, Any]] = orjson.loads(os.getenv("ES_INDEX_SETTINGS", "{}"))
+DYNAMIC_INDEX_SETTINGS = ("number_of_replicas", "refresh_interval")
+DEFAULT_WRITE_POLICY = WritePolicy()
+# Message search: hits are counted exactly up to this many (beyond, the total is a lower bound),
+# and each hit returns up to MESSAGE_HIGHLIGHT_FRAGMENTS highlighted fragments of this many characters
+MESSAGE_TRACK_TOTAL_HITS = int(os.getenv("MESSAGE_TRACK_TOTAL_HITS", "10000"))
+MESSAGE_HIGHLIGHT_FRAGMENT_SIZE = int(os.getenv("MESSAGE_HIGHLIGHT_FRAGMENT_SIZE", "150"))
+MESSAGE_HIGHLIGHT_FRAGMENTS = int(os.getenv("MESSAGE_HIGHLIGHT_FRAGMENTS", "3"))
+# How agents are spread by partition (AGENT_PARTITION_BY):
+# none: all agents in agents_index (default).
+# routing: agents_index with each partition routed to one shard; give the index several shards
+#   (ES_INDEX_SETTINGS) so partitions spread out, while a per-partition query hits one shard.
+# index: one index per partition, agents_index-<partition>, created on first write from an index
+#   template with the agents_index settings.
+# In both sharded modes ES_AGENT_ALIAS spans all agent indices, for fleet-wide reads and for
+# finding an agent whose partition is not known yet.
+ES_AGENT_SHARDING = os.getenv("ES_AGENT_SHARDING", "none").lower()
+ES_AGENT_ALIAS = os.getenv("ES_AGENT_ALIAS", "agents")
+AGENT_TEMPLATE_NAME = f"{AGENT_INDEX_NAME}_template"
+
+
+def index_settings(index_name: str) -> Dict[str, Any]:
+    settings = {
+        "number_of_shards": ES_NUMBER_OF_SHARDS,
+        "number_of_replicas": ES_NUMBER_OF_REPLICAS,
+        "refresh_interval": ES_REFRESH_INTERVAL,
+    }
+    settings.update(ES_INDEX_SETTINGS.get(index_name, {}))
+    return settings
+
+def agent_index_name(partition: str) -> str:
+    # Index names must be lowercase and cannot hold most punctuation
+    return f"{AGENT_INDEX_NAME}-{re.sub(r'[^a-z0-9_-]', '_', partition.lower())}"
+
+
+def agent_location(partition: str) -> Tuple[str, Optional[str]]:
+    """(index, routing) of the agents of a partition under ES_AGENT_SHARDING."""
+    if ES_AGENT_SHARDING == "index":
+        return agent_index_name(partition), None
+    if ES_AGENT_SHARDING == "routing":
+        return AGENT_INDEX_NAME, partition
+    return AGENT_INDEX_NAME, None
+
+
+def _location_params(location: Tuple[str, Optional[str]]) -> Dict[str, Any]:
+    index, routing = location
+    params: Dict[str, Any] = {"index": index}
+    if routing:
+        params["routing"] = routing
+    return params
 
 # --- Pydantic to Elasticsearch-DSL InnerDocs ---
 # We need to represent Pydantic models as InnerDocs for embedding in the AgentDocument
@@ -16,6 +101,7 @@ AGENT_INDEX_NAME = "agents_index"
 
 class STMDocument(InnerDoc):
     session_id = Keyword()
+    history_spilled = Integer()
     history = Object(enabled=False) # Can be complex, store as generic object
     current_task_data = Object(enabled=False)
     scratchpad = Object(enabled=False)
@@ -45,16 +131,15 @@ class AgentDocument(Document):
     agent_id = Keyword(required=True) # Using 'agent_id' as the document ID
     name = Text(fields={'keyword': Keyword()})
     role = Keyword()
+    partition = Keyword() # See agent_partition
+    history_size = Integer() # Total conversation turns, for the history size histogram of get_fleet_stats
     config = Object(enabled=False) 
     stm = Object(STMDocument)
     ltm = Object(LTMDocument)
 
     class Index:
         name = AGENT_INDEX_NAME
-        settings = {
-            "number_of_shards": 1,
-            "number_of_replicas": 0
-        }
+        settings = index_settings(AGENT_INDEX_NAME)
 
     def save(self, **kwargs):
         # Use agent_id as the _id for the document
@@ -63,12 +148,13 @@ class AgentDocument(Document):
 
     @classmethod
     def from_pydantic(cls, agent_model: 'AbstractAgentPydantic'): # Forward reference for AbstractAgent
-        # This method is illustrative; AbstractAgent itself is not a Document.
-        # It's more about how an instance of AbstractAgent gets stored.
+        # AbstractAgent itself is not a Document; this is how an instance of it gets stored.
         doc = cls(
             agent_id=agent_model.id,
             name=agent_model.name,
             role=agent_model.role,
+            partition=agent_partition(agent_model.config, agent_model.role),
+            history_size=history_size(agent_model.stm.model_dump(include={"history", "history_spilled"})),
             config=agent_model.config,
             stm=STMDocument.from_pydantic(agent_model.stm),
             ltm=LTMDocument.from_pydantic(agent_model.ltm)
@@ -76,60 +162,254 @@ class AgentDocument(Document):
         return doc
 
 
+class RuleDocument(Document):
+    # Searchable copy of the rules kept in LongTermMemory.learned_rules.
+    # The rule id is used as the document id so re-indexing a rule updates it in place.
+    rule_id = Keyword(required=True)
+    description = Text()
+    actionable_guideline = Text()
+    context = Keyword()
+    source = Keyword()
+    validation_count = Integer()
+    last_validated_at = Keyword()
+
+    class Index:
+        name = RULE_INDEX_NAME
+        settings = index_settings(RULE_INDEX_NAME)
+
+    @classmethod
+    def from_pydantic(cls, rule: Rule):
+        doc = cls(rule_id=rule.id, **rule.model_dump(exclude={'id'}))
+        doc.meta.id = rule.id
+        return doc
+
+    def to_pydantic(self) -> Rule:
+        rule_data = self.to_dict()
+        rule_data['id'] = rule_data.pop('rule_id')
+        return Rule(**rule_data)
+
+
+class HistoryDocument(Document):
+    # Append-only store for conversation turns evicted from the bounded STM history window.
+    # seq is the turn's position in the agent's full history, so pages can be fetched by range.
+    agent_id = Keyword(required=True)
+    session_id = Keyword()
+    seq = Long()
+    role = Keyword()
+    content = Text()
+    entry = Object(enabled=False) # The original history entry, returned as-is when paging
+
+    class Index:
+        name = HISTORY_INDEX_NAME
+        settings = index_settings(HISTORY_INDEX_NAME)
+
+
+class TaskEventDocument(Document):
+    # Append-only log of task status transitions. Each event is a small document, so a
+    # transition costs one tiny write instead of rewriting the whole manager document.
+    main_task_id = Keyword(required=True)
+    seq = Long()
+    subtask_id = Keyword()
+    from_status = Keyword()
+    to_status = Keyword()
+    timestamp = Date()
+    results = Object(enabled=False)
+
+    class Index:
+        name = TASK_EVENT_INDEX_NAME
+        settings = index_settings(TASK_EVENT_INDEX_NAME)
+
+
+class MessageDocument(Document):
+    # Full-text index of conversation turns, fed in bulk from AbstractAgent.process_message.
+    # Only content is analyzed; the rest are exact-match filters. message_id (also the _id)
+    # breaks ties in the sort, so search_after pages are stable.
+    message_id = Keyword(required=True)
+    agent_id = Keyword()
+    session_id = Keyword()
+    seq = Long()
+    role = Keyword()
+    content = Text()
+    timestamp = Date()
+
+    class Index:
+        name = MESSAGE_INDEX_NAME
+        settings = index_settings(MESSAGE_INDEX_NAME)
+
+
+# Indices created on startup, in creation order
+MANAGED_DOCUMENTS = (AgentDocument, RuleDocument, HistoryDocument, TaskEventDocument, MessageDocument)
+
+
+def agent_index_template() -> Dict[str, Any]:
+    # Per-partition agent indices get the agents_index mappings and settings, and join the alias
+    return {
+        "index_patterns": [f"{AGENT_INDEX_NAME}-*"],
+        "template": {**AgentDocument._index.to_dict(), "aliases": {ES_AGENT_ALIAS: {}}},
+    }
+
+
+def _is_unhealthy_error(error: Exception) -> bool:
+    # Connection errors, timeouts and overload count against the circuit; e.g. a missing document does not
+    if isinstance(error, TransportError):
+        return True
+    return isinstance(error, ApiError) and (error.status_code >= 500 or error.status_code == 429)
+
+
+def circuit_guarded(fallback):
+    """Decorator failing an operation fast with `fallback` while the service's circuit is open."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.breaker.allow():
+                logger.debug("Elasticsearch circuit open. Skipping %s.", func.__name__)
+                return list(fallback) if isinstance(fallback, list) else fallback
+            self._call_state.failed = False
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                # Exceptions raised to the caller (e.g. VersionConflict) are answers from a healthy cluster
+                if not self._call_state.failed:
+                    self.breaker.record_success()
+        return wrapper
+    return decorator
+
+
 class ElasticsearchService:
-    def __init__(self, host: str = ELASTICSEARCH_HOST):
+    def __init__(self, host: str = ELASTICSEARCH_HOST, connect: bool = True):
+        self.host = host
+        self._agent_versions: Dict[str, Tuple[str, float]] = {} # agent_id -> (version, expires_at)
+        self._agent_locations: Dict[str, Tuple[str, Optional[str]]] = {} # agent_id -> (index, routing), sharded modes only
+        self.client = None # Set once connected and the indices exist; operations are no-ops until then
+        self.breaker = CircuitBreaker("elasticsearch", ES_CIRCUIT_FAILURE_THRESHOLD, ES_CIRCUIT_RESET_TIMEOUT)
+        self._call_state = threading.local() # Whether the current thread's operation failed
+        if connect:
+            self.connect()
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None and self.breaker.state != OPEN
+
+    def check_health(self) -> bool:
+        """One health probe, run periodically by the API: reconnects when never connected,
+        otherwise pings without retries and feeds the result to the circuit breaker."""
+        if self.client is None:
+            return self.connect()
+        try:
+            healthy = bool(self.client.options(request_timeout=ES_HEALTH_TIMEOUT, max_retries=0).ping())
+        except Exception as e:
+            logger.warning("Elasticsearch health check failed: %s", e)
+            healthy = False
+        self.breaker.record_probe(healthy)
+        return healthy
+
+    def _record_failure(self, operation: str, error: Exception):
+        record_es_error(operation)
+        if _is_unhealthy_error(error):
+            self._call_state.failed = True
+            self.breaker.record_failure()
+
+    def connect(self) -> bool:
+        # Blocking (ping, index checks, client retries); the API calls it from a background task
         try:
-            self.client = Elasticsearch(host, timeout=30, max_retries=3, retry_on_timeout=True)
-            if not self.client.ping():
+            client = Elasticsearch(self.host, timeout=ES_REQUEST_TIMEOUT, max_retries=ES_MAX_RETRIES, retry_on_timeout=True)
+            if not client.ping():
                 raise ConnectionError("Failed to connect to Elasticsearch")
-            connections.create_connection(alias='default', hosts=[host])
-            self._ensure_index_exists()
-            print(f"Successfully connected to Elasticsearch at {host} and index '{AGENT_INDEX_NAME}' is ready.")
+            connections.create_connection(alias='default', hosts=[self.host])
+            self._ensure_index_exists(client)
+            self.client = client
+            logger.info("Successfully connected to Elasticsearch at %s and index '%s' is ready.", self.host, AGENT_INDEX_NAME)
+            return True
         except ConnectionError as e:
-            print(f"Elasticsearch connection error: {e}")
-            self.client = None # Indicate connection failure
+            logger.error("Elasticsearch connection error: %s", e)
         except Exception as e:
-            print(f"An unexpected error occurred during Elasticsearch initialization: {e}")
-            self.client = None
+            logger.error("An unexpected error occurred during Elasticsearch initialization: %s", e)
+        return False
 
+    def _ensure_index_exists(self, client: Elasticsearch):
+        for document_class in MANAGED_DOCUMENTS:
+            index_name = document_class.Index.name
+            if client.indices.exists(index=index_name):
+                # Keep dynamic settings of existing indices in line with the configuration, and add new fields
+                settings = index_settings(index_name)
+                client.indices.put_settings(index=index_name, settings={key: settings[key] for key in DYNAMIC_INDEX_SETTINGS if key in settings})
+                client.indices.put_mapping(index=index_name, properties=document_class._doc_type.mapping.to_dict()["properties"])
+            else:
+                try:
+                    document_class.init()
+                    logger.debug("Index '%s' created successfully.", index_name)
+                except Exception as e:
+                    logger.error("Error creating index '%s': %s", index_name, e)
+                    # Potentially raise or handle more gracefully
+                    raise
+        if ES_AGENT_SHARDING != "none":
+            # agents_index (and the agents stored there before sharding) stays readable through the alias
+            client.indices.put_alias(index=AGENT_INDEX_NAME, name=ES_AGENT_ALIAS)
+        if ES_AGENT_SHARDING == "index":
+            client.indices.put_index_template(name=AGENT_TEMPLATE_NAME, **agent_index_template())
 
-    def _ensure_index_exists(self):
-        if self.client and not self.client.indices.exists(index=AGENT_INDEX_NAME):
-            try:
-                AgentDocument.init()
-                print(f"Index '{AGENT_INDEX_NAME}' created successfully.")
-            except Exception as e:
-                print(f"Error creating index '{AGENT_INDEX_NAME}': {e}")
-                # Potentially raise or handle more gracefully
-                raise
-
-    def save_agent(self, agent_model: 'AbstractAgentPydantic') -> bool:
+    @timed_es_operation("save_agent")
+    @traced("es.save_agent")
+    @circuit_guarded(False)
+    def save_agent(self, agent_model: 'AbstractAgentPydantic', policy: Optional[WritePolicy] = None,
+                   expected_version: Optional[str] = None) -> Union[str, bool]:
         if not self.client:
-            print("Elasticsearch client not available. Cannot save agent.")
+            logger.warning("Elasticsearch client not available. Cannot save agent.")
             return False
         try:
-            agent_doc = AgentDocument(
-                agent_id=agent_model.id,
-                name=agent_model.name,
-                role=agent_model.role,
-                config=agent_model.config,
-                stm=STMDocument.from_pydantic(agent_model.stm),
-                ltm=LTMDocument.from_pydantic(agent_model.ltm)
-            )
+            agent_doc = AgentDocument.from_pydantic(agent_model)
             agent_doc.meta.id = agent_model.id # Explicitly set document ID
-            agent_doc.save()
-            print(f"Agent {agent_model.id} ({agent_model.name}) saved/updated successfully.")
-            return True
+            record_es_payload("save_agent", lambda: len(orjson.dumps(agent_doc.to_dict(), default=str)))
+            params = (policy or DEFAULT_WRITE_POLICY).request_params()
+            location = previous_location = None
+            if ES_AGENT_SHARDING != "none":
+                location = agent_location(agent_doc.partition)
+                previous_location = self._agent_locations.get(agent_model.id)
+                params.update(_location_params(location))
+            moved = previous_location is not None and previous_location != location
+            if expected_version and not moved:
+                # Optimistic concurrency: rejected with 409 if another writer saved the agent meanwhile.
+                # Not possible when the agent moves to another partition: seq_no is per shard.
+                params["if_seq_no"], params["if_primary_term"] = parse_version(expected_version)
+            agent_doc.save(**params)
+            version = format_version(getattr(agent_doc.meta, 'seq_no', None), getattr(agent_doc.meta, 'primary_term', None))
+            self._cache_agent_version(agent_model.id, version)
+            if location:
+                if moved and expected_version:
+                    # Conditional on the old copy's version: if both copies share a shard the save has
+                    # already replaced it, and the delete must then not remove the new document
+                    seq_no, primary_term = parse_version(expected_version)
+                    self.client.options(ignore_status=(404, 409)).delete(
+                        id=agent_model.id, if_seq_no=seq_no, if_primary_term=primary_term, **_location_params(previous_location))
+                elif moved:
+                    logger.warning("Agent %s moved to partition '%s' without a known version; its old copy in %s is left in place.",
+                                   agent_model.id, agent_doc.partition, previous_location[0])
+                self._agent_locations[agent_model.id] = location
+            logger.debug("Agent %s (%s) saved/updated successfully.", agent_model.id, agent_model.name)
+            return version or True
+        except ConflictError as e:
+            self._agent_versions.pop(agent_model.id, None)
+            raise VersionConflict(agent_model.id, expected_version) from e
         except Exception as e:
-            print(f"Error saving agent {agent_model.id} to Elasticsearch: {e}")
+            self._record_failure("save_agent", e)
+            logger.error("Error saving agent %s to Elasticsearch: %s", agent_model.id, e)
             return False
 
+    @timed_es_operation("get_agent")
+    @traced("es.get_agent")
+    @circuit_guarded(None)
     def get_agent(self, agent_id: str) -> Dict[str, Any] | None:
         if not self.client:
-            print("Elasticsearch client not available. Cannot get agent.")
+            logger.warning("Elasticsearch client not available. Cannot get agent.")
             return None
         try:
-            doc = AgentDocument.get(id=agent_id)
+            location = self._agent_locations.get(agent_id)
+            if ES_AGENT_SHARDING == "none":
+                doc = AgentDocument.get(id=agent_id)
+            elif location:
+                doc = AgentDocument.get(id=agent_id, **_location_params(location))
+            else:
+                doc = self._find_agent(agent_id)
             if doc:
                 # Convert STMDocument and LTMDocument back to Pydantic models
                 agent_data = doc.to_dict()
@@ -140,18 +420,81 @@ class ElasticsearchService:
                 
                 # The agent_id from AgentDocument is already the 'id' we want for AbstractAgent Pydantic model
                 agent_data['id'] = doc.agent_id 
+                agent_data['version'] = format_version(getattr(doc.meta, 'seq_no', None), getattr(doc.meta, 'primary_term', None))
+                self._cache_agent_version(doc.agent_id, agent_data['version'])
+                record_es_payload("get_agent", lambda: len(orjson.dumps(agent_data, default=str)))
                 return agent_data
             return None
         except Exception as e: # elasticsearch.exceptions.NotFoundError if not found
-            print(f"Error retrieving agent {agent_id} from Elasticsearch: {e}")
+            self._record_failure("get_agent", e)
+            logger.error("Error retrieving agent %s from Elasticsearch: %s", agent_id, e)
+            return None
+
+    def _find_agent(self, agent_id: str) -> Optional[AgentDocument]:
+        # Partition not known yet (sharded modes): an ids query over the alias asks every shard once,
+        # after which the agent's location is remembered and reads go straight to its shard
+        search = (AgentDocument.search(index=ES_AGENT_ALIAS)
+                  .filter("ids", values=[agent_id])
+                  .params(seq_no_primary_term=True, ignore_unavailable=True))[:1]
+        hits = list(search.execute())
+        if not hits:
+            return None
+        self._agent_locations[agent_id] = (hits[0].meta.index, getattr(hits[0].meta, 'routing', None))
+        return hits[0]
+
+    def _cache_agent_version(self, agent_id: str, version: Optional[str]):
+        if version:
+            self._agent_versions[agent_id] = (version, time.monotonic() + AGENT_VERSION_CACHE_TTL)
+        else:
+            self._agent_versions.pop(agent_id, None)
+
+    @timed_es_operation("get_agent_version")
+    @traced("es.get_agent_version")
+    @circuit_guarded(None)
+    def get_agent_version(self, agent_id: str) -> Optional[str]:
+        """Current version of an agent document without fetching its source."""
+        cached = self._agent_versions.get(agent_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        if not self.client:
+            return None
+        try:
+            location = self._agent_locations.get(agent_id)
+            if ES_AGENT_SHARDING != "none" and not location:
+                doc = self._find_agent(agent_id)
+                version = format_version(getattr(doc.meta, 'seq_no', None), getattr(doc.meta, 'primary_term', None)) if doc else None
+                self._cache_agent_version(agent_id, version)
+                return version
+            response = self.client.get(id=agent_id, source=False, **_location_params(location or (AGENT_INDEX_NAME, None)))
+        except Exception as e: # NotFoundError if the agent does not exist
+            self._record_failure("get_agent_version", e)
+            logger.error("Error retrieving version of agent %s from Elasticsearch: %s", agent_id, e)
+            self._agent_versions.pop(agent_id, None)
             return None
+        version = format_version(response.get('_seq_no'), response.get('_primary_term'))
+        self._cache_agent_version(agent_id, version)
+        return version
 
-    def get_all_agents(self) -> List[Dict[str, Any]]:
+    @timed_es_operation("get_all_agents")
+    @traced("es.get_all_agents")
+    @circuit_guarded([])
+    def get_all_agents(self, partition: Optional[str] = None) -> List[Dict[str, Any]]:
         if not self.client:
-            print("Elasticsearch client not available. Cannot get all agents.")
+            logger.warning("Elasticsearch client not available. Cannot get all agents.")
             return []
         try:
-            search = AgentDocument.search()
+            if ES_AGENT_SHARDING == "none":
+                search = AgentDocument.search()
+            elif partition is None:
+                search = AgentDocument.search(index=ES_AGENT_ALIAS)
+            else:
+                # Only the partition's own index or shard is searched
+                index, routing = agent_location(partition)
+                search = AgentDocument.search(index=index).params(ignore_unavailable=True)
+                if routing:
+                    search = search.params(routing=routing)
+            if partition is not None:
+                search = search.filter("term", partition=partition)
             agents = []
             for hit in search.execute():
                 agent_data = hit.to_dict()
@@ -163,21 +506,292 @@ class ElasticsearchService:
                 agents.append(agent_data)
             return agents
         except Exception as e:
-            print(f"Error retrieving all agents from Elasticsearch: {e}")
+            self._record_failure("get_all_agents", e)
+            logger.error("Error retrieving all agents from Elasticsearch: %s", e)
             return []
 
-# --- AbstractAgentPydantic (Illustrative Pydantic model for type hinting) ---
-# This is needed because AbstractAgent itself is a Pydantic model
-# and we need to type hint it in ElasticsearchService.
-# It should match the structure of app.agents.base.AbstractAgent
-class AbstractAgentPydantic(BaseModel):
-    id: str
-    name: str
-    role: str
-    stm: ShortTermMemory
-    ltm: LongTermMemory
-    config: Dict[str, Any]
-
-# Global instance (can be initialized in main app or on first use)
-# es_service = ElasticsearchService() 
-# Defer initialization to where it's used to manage lifecycle better, e.g., in FastAPI app startup.
+    @timed_es_operation("save_rules")
+    @traced("es.save_rules")
+    @circuit_guarded(False)
+    def save_rules(self, rules: List[Rule], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot save rules.")
+            return False
+        if not rules:
+            return True
+        try:
+            actions = [RuleDocument.from_pydantic(rule).to_dict(include_meta=True) for rule in rules]
+            record_es_payload("save_rules", lambda: len(orjson.dumps(actions, default=str)))
+            bulk(self.client, actions, **(policy or DEFAULT_WRITE_POLICY).request_params())
+            logger.debug("%s rule(s) indexed into '%s'.", len(rules), RULE_INDEX_NAME)
+            return True
+        except Exception as e:
+            self._record_failure("save_rules", e)
+            logger.error("Error indexing rules into Elasticsearch: %s", e)
+            return False
+
+    @timed_es_operation("find_relevant_rules")
+    @traced("es.find_relevant_rules")
+    @circuit_guarded([])
+    def find_relevant_rules(self, query: str, context: Optional[str] = None, k: int = DEFAULT_RULE_RESULTS) -> List[Rule]:
+        """Return the top-k rules for a query, ranked by text relevance weighted by validation_count."""
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot search rules.")
+            return []
+        try:
+            text_query = Q("multi_match", query=query, fields=["description^2", "actionable_guideline"])
+            filters = [Q("term", context=context)] if context else []
+            scored_query = Q(
+                "function_score",
+                query=Q("bool", must=[text_query], filter=filters),
+                field_value_factor={"field": "validation_count", "modifier": "log2p", "missing": 0},
+                boost_mode="multiply"
+            )
+            search = RuleDocument.search().query(scored_query)[:k]
+            return [hit.to_pydantic() for hit in search.execute()]
+        except Exception as e:
+            self._record_failure("find_relevant_rules", e)
+            logger.error("Error searching rules in Elasticsearch: %s", e)
+            return []
+
+    @timed_es_operation("append_history")
+    @traced("es.append_history")
+    @circuit_guarded(False)
+    def append_history(self, agent_id: str, session_id: str, start_seq: int, entries: List[Dict[str, Any]],
+                       policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot append history.")
+            return False
+        if not entries:
+            return True
+        try:
+            actions = []
+            for offset, entry in enumerate(entries):
+                seq = start_seq + offset
+                actions.append({
+                    "_op_type": "create", # Append-only: never overwrite a spilled turn
+                    "_index": HISTORY_INDEX_NAME,
+                    "_id": f"{agent_id}:{seq}",
+                    "_source": {
+                        "agent_id": agent_id,
+                        "session_id": session_id,
+                        "seq": seq,
+                        "role": entry.get("role"),
+                        "content": entry.get("content"),
+                        "entry": entry
+                    }
+                })
+            record_es_payload("append_history", lambda: len(orjson.dumps(actions, default=str)))
+            _, errors = bulk(self.client, actions, raise_on_error=False, **(policy or DEFAULT_WRITE_POLICY).request_params())
+            # A 409 means the turn was spilled before (e.g. a save after the spill failed): it is already stored
+            failed = [error for error in errors if next(iter(error.values())).get("status") != 409]
+            if failed:
+                logger.error("%s of %s history turn(s) for agent %s could not be appended: %s", len(failed), len(entries), agent_id, failed[0])
+                return False
+            logger.debug("%s history turn(s) for agent %s appended to '%s'.", len(entries), agent_id, HISTORY_INDEX_NAME)
+            return True
+        except Exception as e:
+            self._record_failure("append_history", e)
+            logger.error("Error appending history for agent %s to Elasticsearch: %s", agent_id, e)
+            return False
+
+    @timed_es_operation("get_history_page")
+    @traced("es.get_history_page")
+    @circuit_guarded([])
+    def get_history_page(self, agent_id: str, before_seq: Optional[int] = None, size: int = DEFAULT_HISTORY_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Return up to `size` spilled turns older than `before_seq`, oldest first."""
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot get history page.")
+            return []
+        try:
+            search = HistoryDocument.search().filter("term", agent_id=agent_id)
+            if before_seq is not None:
+                search = search.filter("range", seq={"lt": before_seq})
+            search = search.sort("-seq")[:size]
+            hits = list(search.execute())
+            return [hit.entry.to_dict() if hasattr(hit.entry, 'to_dict') else hit.entry for hit in reversed(hits)]
+        except Exception as e:
+            self._record_failure("get_history_page", e)
+            logger.error("Error retrieving history page for agent %s from Elasticsearch: %s", agent_id, e)
+            return []
+
+    @timed_es_operation("append_task_events")
+    @traced("es.append_task_events")
+    @circuit_guarded(False)
+    def append_task_events(self, events: List[TaskEvent], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot append task events.")
+            return False
+        if not events:
+            return True
+        try:
+            actions = [{
+                "_op_type": "create",
+                "_index": TASK_EVENT_INDEX_NAME,
+                "_id": f"{event.main_task_id}:{event.seq}",
+                "_source": event.model_dump(mode="json")
+            } for event in events]
+            record_es_payload("append_task_events", lambda: len(orjson.dumps(actions, default=str)))
+            bulk(self.client, actions, **(policy or DEFAULT_WRITE_POLICY).request_params())
+            return True
+        except Exception as e:
+            self._record_failure("append_task_events", e)
+            logger.error("Error appending task events to Elasticsearch: %s", e)
+            return False
+
+    @timed_es_operation("get_task_events")
+    @traced("es.get_task_events")
+    @circuit_guarded([])
+    def get_task_events(self, main_task_id: str, after_seq: int = 0) -> List[TaskEvent]:
+        """Return the events of a MainTask with seq > after_seq, in order."""
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot get task events.")
+            return []
+        try:
+            search = (TaskEventDocument.search()
+                      .filter("term", main_task_id=main_task_id)
+                      .filter("range", seq={"gt": after_seq}))
+            events = []
+            for hit in search.scan(): # scan does not keep sort order, so sort by seq below
+                event_data = hit.to_dict()
+                if hasattr(event_data.get('timestamp'), 'isoformat'):
+                    event_data['timestamp'] = event_data['timestamp'].isoformat()
+                events.append(TaskEvent(**event_data))
+            return sorted(events, key=lambda event: event.seq)
+        except Exception as e:
+            self._record_failure("get_task_events", e)
+            logger.error("Error retrieving task events for %s from Elasticsearch: %s", main_task_id, e)
+            return []
+
+    @timed_es_operation("get_task_events_version")
+    @traced("es.get_task_events_version")
+    @circuit_guarded(None)
+    def get_task_events_version(self, main_task_id: str) -> Optional[Tuple[int, int]]:
+        """Last seq and number of the events of a MainTask, from one aggregation without hits."""
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot get task event version.")
+            return None
+        try:
+            search = (TaskEventDocument.search().filter("term", main_task_id=main_task_id)
+                      .extra(size=0, track_total_hits=True))
+            search.aggs.metric("last_seq", "max", field="seq")
+            response = search.execute()
+            return (int(response.aggregations.last_seq.value or 0), response.hits.total.value)
+        except Exception as e:
+            self._record_failure("get_task_events_version", e)
+            logger.error("Error retrieving task event version for %s from Elasticsearch: %s", main_task_id, e)
+            return None
+
+    @timed_es_operation("get_fleet_stats")
+    @traced("es.get_fleet_stats")
+    @circuit_guarded(None)
+    def get_fleet_stats(self, bucket_size: int = STATS_HISTORY_BUCKET_SIZE) -> Optional[FleetStats]:
+        """Fleet counts from aggregations only (no hits), sent as one multi-search request."""
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot compute fleet statistics.")
+            return None
+        try:
+            agents = AgentDocument.search(index=ES_AGENT_ALIAS if ES_AGENT_SHARDING != "none" else None).extra(size=0, track_total_hits=True)
+            agents.aggs.bucket("by_role", "terms", field="role", size=STATS_TERMS_SIZE)
+            agents.aggs.bucket("history_sizes", "histogram", field="history_size", interval=bucket_size, min_doc_count=1)
+            rules = RuleDocument.search().extra(size=0, track_total_hits=True)
+            rules.aggs.bucket("by_context", "terms", field="context", size=STATS_TERMS_SIZE)
+            # Task-level transitions only. Every task in a status entered it once more than it left
+            # it, so entries minus exits counts the tasks currently there without a per-task lookup.
+            # Tasks are counted from their first transition on (creation logs no event).
+            transitions = TaskEventDocument.search().exclude("exists", field="subtask_id").extra(size=0)
+            transitions.aggs.bucket("entered", "terms", field="to_status", size=STATS_TERMS_SIZE)
+            transitions.aggs.bucket("left", "terms", field="from_status", size=STATS_TERMS_SIZE)
+            agent_counts, rule_counts, transition_counts = MultiSearch().add(agents).add(rules).add(transitions).execute()
+
+            left = {bucket.key: bucket.doc_count for bucket in transition_counts.aggregations.left.buckets}
+            tasks_by_status = {bucket.key: bucket.doc_count - left.get(bucket.key, 0)
+                               for bucket in transition_counts.aggregations.entered.buckets}
+            return FleetStats(
+                agents_total=agent_counts.hits.total.value,
+                agents_by_role={bucket.key: bucket.doc_count for bucket in agent_counts.aggregations.by_role.buckets},
+                tasks_by_status={status: count for status, count in sorted(tasks_by_status.items(), key=lambda item: -item[1]) if count > 0},
+                rules_total=rule_counts.hits.total.value,
+                rules_by_context={bucket.key: bucket.doc_count for bucket in rule_counts.aggregations.by_context.buckets},
+                history_bucket_size=bucket_size,
+                history_sizes=[HistorySizeBucket(min_turns=int(bucket.key), agents=bucket.doc_count)
+                               for bucket in agent_counts.aggregations.history_sizes.buckets],
+                generated_at=datetime.now(timezone.utc).isoformat(),
+            )
+        except Exception as e:
+            self._record_failure("get_fleet_stats", e)
+            logger.error("Error computing fleet statistics in Elasticsearch: %s", e)
+            return None
+
+    @timed_es_operation("index_messages")
+    @traced("es.index_messages")
+    @circuit_guarded(False)
+    def index_messages(self, messages: List[ChatMessage], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot index messages.")
+            return False
+        if not messages:
+            return True
+        try:
+            actions = [{
+                "_op_type": "create", # A re-sent batch leaves already indexed turns alone
+                "_index": MESSAGE_INDEX_NAME,
+                "_id": message.id,
+                "_source": {"message_id": message.id, **message.model_dump(exclude={"id"})}
+            } for message in messages]
+            record_es_payload("index_messages", lambda: len(orjson.dumps(actions, default=str)))
+            _, errors = bulk(self.client, actions, raise_on_error=False, **(policy or DEFAULT_WRITE_POLICY).request_params())
+            failed = [error for error in errors if next(iter(error.values())).get("status") != 409]
+            if failed:
+                logger.error("%s of %s message(s) could not be indexed: %s", len(failed), len(messages), failed[0])
+                return False
+            return True
+        except Exception as e:
+            self._record_failure("index_messages", e)
+            logger.error("Error indexing messages into Elasticsearch: %s", e)
+            return False
+
+    @timed_es_operation("search_messages")
+    @traced("es.search_messages")
+    @circuit_guarded(None)
+    def search_messages(self, query: str, agent_id: Optional[str] = None, session_id: Optional[str] = None,
+                        size: int = DEFAULT_MESSAGE_PAGE_SIZE, cursor: Optional[str] = None) -> Optional[MessageSearchPage]:
+        """Conversation turns matching `query`, best match first, newest first among equals.
+
+        Pages continue with search_after from the previous page's last sort values (the cursor),
+        so deep pages cost the same as the first one.
+        """
+        if not self.client:
+            logger.warning("Elasticsearch client not available. Cannot search messages.")
+            return None
+        search = MessageDocument.search().query("match", content=query)
+        if agent_id:
+            search = search.filter("term", agent_id=agent_id)
+        if session_id:
+            search = search.filter("term", session_id=session_id)
+        search = (search.sort("_score", {"timestamp": "desc"}, {"message_id": "asc"})
+                  .highlight("content", encoder="html", fragment_size=MESSAGE_HIGHLIGHT_FRAGMENT_SIZE, number_of_fragments=MESSAGE_HIGHLIGHT_FRAGMENTS)
+                  .extra(size=size, track_total_hits=MESSAGE_TRACK_TOTAL_HITS))
+        if cursor:
+            search = search.extra(search_after=decode_cursor(cursor)) # ValueError for a malformed cursor
+        try:
+            response = search.execute()
+            hits = []
+            for hit in response:
+                message_data = hit.to_dict()
+                if hasattr(message_data.get('timestamp'), 'isoformat'):
+                    message_data['timestamp'] = message_data['timestamp'].isoformat()
+                message_data['id'] = message_data.pop('message_id')
+                highlight = getattr(hit.meta, 'highlight', None)
+                hits.append(MessageHit(message=ChatMessage(**message_data), score=hit.meta.score,
+                                       highlights=list(highlight.content) if highlight and 'content' in highlight else []))
+            return MessageSearchPage(
+                total=response.hits.total.value,
+                total_relation=response.hits.total.relation,
+                hits=hits,
+                next_cursor=encode_cursor(list(response.hits[-1].meta.sort)) if len(hits) == size else None,
+            )
+        except Exception as e:
+            self._record_failure("search_messages", e)
+            logger.error("Error searching messages in Elasticsearch: %s", e)
+            return None
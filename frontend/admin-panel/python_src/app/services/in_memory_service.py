@@ -0,0 +1,197 @@
+import html
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Dict, Any, List, Optional, Tuple, Union
+import orjson
+from app.models.task import Rule, TaskEvent
+from app.models.stats import FleetStats, HistorySizeBucket
+from app.models.message import ChatMessage, MessageHit, MessageSearchPage
+from app.services.storage import WritePolicy, VersionConflict, agent_partition, format_version, history_size, encode_cursor, decode_cursor, DEFAULT_RULE_RESULTS, DEFAULT_HISTORY_PAGE_SIZE, DEFAULT_MESSAGE_PAGE_SIZE, STATS_HISTORY_BUCKET_SIZE, STATS_TERMS_SIZE
+from app.services.rule_scoring import RuleScorerCache
+
+IN_MEMORY_PRIMARY_TERM = 1
+
+
+def _highlight_html(pattern: re.Pattern, content: str) -> str:
+    # Content is user input and escaped; split() alternates text and matched terms, which get <em> tags
+    parts = pattern.split(content)
+    return "".join(f"<em>{html.escape(part)}</em>" if i % 2 else html.escape(part) for i, part in enumerate(parts))
+
+
+def _counted(operation: str):
+    # Counts calls per operation, e.g. to report storage calls per workflow in benchmarks
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            self.calls[operation] += 1
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InMemoryStorageService:
+    """Process-local storage backend (STORAGE_BACKEND=memory), for tests, benchmarks and single-process runs.
+
+    Agent documents are stored serialized, so saves and loads pay a serialization cost
+    comparable to the real service and callers never share mutable state with the store.
+    """
+
+    def __init__(self):
+        self.client = True # Callers check service.client before using the service
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Tuple[bytes, int]] = {} # agent_id -> (document, seq_no)
+        self._rules: Dict[str, Rule] = {}
+        self._rule_scorers = RuleScorerCache() # Per context filter, cleared by save_rules
+        self._history: Dict[str, Dict[int, Dict[str, Any]]] = {} # agent_id -> seq -> entry
+        self._task_events: Dict[str, Dict[int, TaskEvent]] = {}
+        self._messages: Dict[str, ChatMessage] = {}
+        self._seq_no = 0
+
+    @_counted("save_agent")
+    def save_agent(self, agent_model, policy: Optional[WritePolicy] = None,
+                   expected_version: Optional[str] = None) -> Union[str, bool]:
+        document = orjson.dumps({
+            "agent_id": agent_model.id,
+            "name": agent_model.name,
+            "role": agent_model.role,
+            "config": agent_model.config,
+            "stm": agent_model.stm.model_dump(mode="json"),
+            "ltm": agent_model.ltm.model_dump(mode="json"),
+        })
+        with self._lock:
+            if expected_version is not None:
+                stored = self._agents.get(agent_model.id)
+                current_version = format_version(stored[1], IN_MEMORY_PRIMARY_TERM) if stored else None
+                if current_version != expected_version:
+                    raise VersionConflict(agent_model.id, expected_version, current_version)
+            self._seq_no += 1
+            self._agents[agent_model.id] = (document, self._seq_no)
+            return format_version(self._seq_no, IN_MEMORY_PRIMARY_TERM)
+
+    def _agent_data(self, document: bytes, seq_no: int) -> Dict[str, Any]:
+        agent_data = orjson.loads(document)
+        agent_data["id"] = agent_data["agent_id"]
+        agent_data["version"] = format_version(seq_no, IN_MEMORY_PRIMARY_TERM)
+        return agent_data
+
+    @_counted("get_agent")
+    def get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        stored = self._agents.get(agent_id)
+        return self._agent_data(*stored) if stored else None
+
+    @_counted("get_agent_version")
+    def get_agent_version(self, agent_id: str) -> Optional[str]:
+        stored = self._agents.get(agent_id)
+        return format_version(stored[1], IN_MEMORY_PRIMARY_TERM) if stored else None
+
+    @_counted("get_all_agents")
+    def get_all_agents(self, partition: Optional[str] = None) -> List[Dict[str, Any]]:
+        agents = [self._agent_data(*stored) for stored in list(self._agents.values())]
+        if partition is not None:
+            agents = [data for data in agents if agent_partition(data["config"], data["role"]) == partition]
+        return agents
+
+    @_counted("save_rules")
+    def save_rules(self, rules: List[Rule], policy: Optional[WritePolicy] = None) -> bool:
+        with self._lock:
+            for rule in rules:
+                self._rules[rule.id] = rule.model_copy()
+        self._rule_scorers.clear()
+        return True
+
+    @_counted("find_relevant_rules")
+    def find_relevant_rules(self, query: str, context: Optional[str] = None, k: int = DEFAULT_RULE_RESULTS) -> List[Rule]:
+        def load_rules():
+            return [rule for rule in list(self._rules.values()) if not context or rule.context == context] # context filters, as in ES
+        return self._rule_scorers.get(context, load_rules).top_k(query, context=context, k=k)
+
+    @_counted("append_history")
+    def append_history(self, agent_id: str, session_id: str, start_seq: int, entries: List[Dict[str, Any]],
+                       policy: Optional[WritePolicy] = None) -> bool:
+        with self._lock:
+            history = self._history.setdefault(agent_id, {})
+            for offset, entry in enumerate(entries):
+                history.setdefault(start_seq + offset, dict(entry)) # Append-only, like the ES create op
+        return True
+
+    @_counted("get_history_page")
+    def get_history_page(self, agent_id: str, before_seq: Optional[int] = None, size: int = DEFAULT_HISTORY_PAGE_SIZE) -> List[Dict[str, Any]]:
+        history = self._history.get(agent_id, {})
+        seqs = sorted(seq for seq in history if before_seq is None or seq < before_seq)
+        return [history[seq] for seq in seqs[-size:]] if size > 0 else []
+
+    @_counted("append_task_events")
+    def append_task_events(self, events: List[TaskEvent], policy: Optional[WritePolicy] = None) -> bool:
+        with self._lock:
+            for event in events:
+                # Same create semantics as the ES bulk write: an existing (main_task_id, seq) is kept
+                self._task_events.setdefault(event.main_task_id, {}).setdefault(event.seq, event.model_copy())
+        return True
+
+    @_counted("get_task_events")
+    def get_task_events(self, main_task_id: str, after_seq: int = 0) -> List[TaskEvent]:
+        events = self._task_events.get(main_task_id, {})
+        return [events[seq] for seq in sorted(events) if seq > after_seq]
+
+    @_counted("get_task_events_version")
+    def get_task_events_version(self, main_task_id: str) -> Optional[Tuple[int, int]]:
+        events = self._task_events.get(main_task_id, {})
+        return (max(events, default=0), len(events))
+
+    @_counted("get_fleet_stats")
+    def get_fleet_stats(self, bucket_size: int = STATS_HISTORY_BUCKET_SIZE) -> Optional[FleetStats]:
+        agents = [orjson.loads(document) for document, _ in list(self._agents.values())]
+        # A task's status is the target of its latest task-level (not subtask) event
+        task_statuses = []
+        for events in list(self._task_events.values()):
+            task_events = [events[seq] for seq in sorted(events) if events[seq].subtask_id is None]
+            if task_events:
+                task_statuses.append(task_events[-1].to_status.value)
+        buckets = Counter(history_size(agent["stm"]) // bucket_size * bucket_size for agent in agents)
+        rules = list(self._rules.values())
+        return FleetStats(
+            agents_total=len(agents),
+            agents_by_role=dict(Counter(agent["role"] for agent in agents).most_common(STATS_TERMS_SIZE)),
+            tasks_by_status=dict(Counter(task_statuses).most_common()),
+            rules_total=len(rules),
+            rules_by_context=dict(Counter(rule.context for rule in rules).most_common(STATS_TERMS_SIZE)),
+            history_bucket_size=bucket_size,
+            history_sizes=[HistorySizeBucket(min_turns=size, agents=count) for size, count in sorted(buckets.items())],
+            generated_at=datetime.now(timezone.utc).isoformat(),
+        )
+
+    @_counted("index_messages")
+    def index_messages(self, messages: List[ChatMessage], policy: Optional[WritePolicy] = None) -> bool:
+        with self._lock:
+            for message in messages:
+                self._messages.setdefault(message.id, message.model_copy())
+        return True
+
+    @_counted("search_messages")
+    def search_messages(self, query: str, agent_id: Optional[str] = None, session_id: Optional[str] = None,
+                        size: int = DEFAULT_MESSAGE_PAGE_SIZE, cursor: Optional[str] = None) -> Optional[MessageSearchPage]:
+        # Scans every message: scored by how often the query's words occur, cursor is an offset
+        offset = int(decode_cursor(cursor)[0]) if cursor else 0
+        terms = set(re.findall(r"\w+", query.lower()))
+        if not terms:
+            return MessageSearchPage(total=0, hits=[])
+        pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in sorted(terms)) + r")\b", re.IGNORECASE)
+        scored = []
+        for message in list(self._messages.values()):
+            if (agent_id and message.agent_id != agent_id) or (session_id and message.session_id != session_id):
+                continue
+            matches = len(pattern.findall(message.content))
+            if matches:
+                scored.append((float(matches), message))
+        scored.sort(key=lambda item: item[1].id)
+        scored.sort(key=lambda item: item[1].timestamp, reverse=True)
+        scored.sort(key=lambda item: item[0], reverse=True) # Stable sorts: score, then newest, then id
+        page = scored[offset:offset + size]
+        hits = [MessageHit(message=message, score=score, highlights=[_highlight_html(pattern, message.content)])
+                for score, message in page]
+        return MessageSearchPage(total=len(scored), hits=hits,
+                                 next_cursor=encode_cursor([offset + size]) if offset + size < len(scored) else None)
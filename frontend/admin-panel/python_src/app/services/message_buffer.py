@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+from collections import deque
+from typing import Deque, List
+from app.models.message import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Conversation turns are indexed for search (GET /search/messages) unless this is false
+MESSAGE_INDEXING = os.getenv("MESSAGE_INDEXING", "true").lower() == "true"
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200")) # Buffered turns that trigger an inline bulk write
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "1")) # Seconds between background flushes in the API
+# While storage cannot take them, the oldest buffered turns are dropped beyond this many. The
+# search index is derived data: the turns themselves stay in the agents' history.
+MESSAGE_MAX_BUFFERED = int(os.getenv("MESSAGE_MAX_BUFFERED", "10000"))
+
+
+class MessageBuffer:
+    """Collects conversation turns in memory and writes them to the message index in bulk.
+
+    A flush takes the buffered turns out and hands them to the backend's index_messages in one
+    request; if that fails they are put back in front, to be retried with the next flush.
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, max_buffered: int = MESSAGE_MAX_BUFFERED):
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._messages: Deque[ChatMessage] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One flush at a time keeps the index in arrival order
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, *messages: ChatMessage) -> bool:
+        """Buffers the turns; True once a full batch is waiting."""
+        with self._lock:
+            self._messages.extend(messages)
+            self._trim()
+            return len(self._messages) >= self.batch_size
+
+    def _trim(self):
+        overflow = len(self._messages) - self.max_buffered
+        if overflow > 0:
+            for _ in range(overflow):
+                self._messages.popleft()
+            self.dropped += overflow
+            logger.warning("Message buffer full; dropped the %s oldest turn(s) from the search index.", overflow)
+
+    def flush(self, backend) -> int:
+        """Writes the buffered turns to the backend; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch: List[ChatMessage] = list(self._messages)
+                self._messages.clear()
+            if not batch:
+                return 0
+            if backend.index_messages(batch):
+                return len(batch)
+            with self._lock:
+                self._messages.extendleft(reversed(batch))
+                self._trim()
+            logger.warning("Indexing %s buffered message(s) failed; will retry.", len(batch))
+            return 0
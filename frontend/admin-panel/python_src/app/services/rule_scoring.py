@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from app.models.task import Rule
+
+# Rule scoring keeps every rule feature in NumPy arrays so a task can be scored
+# against the whole rule base in one vectorized pass instead of per-rule string checks.
+
+HASH_DIM = 256 # Width of the hashed token vectors
+RECENCY_HALF_LIFE_DAYS = 30.0
+UNVALIDATED_AGE_DAYS = 365.0 # Age assumed for rules that were never validated
+# Cached scorers are rebuilt after this many seconds even if their rules did not change, so recency stays current
+RULE_SCORER_MAX_AGE = float(os.getenv("RULE_SCORER_MAX_AGE", "3600"))
+RULE_SCORER_CACHE_SIZE = 16 # Rule sets (e.g. context filters) a RuleScorerCache keeps scorers for
+
+# Relative weight of each feature in the final score
+TEXT_WEIGHT = 1.0
+CONTEXT_WEIGHT = 0.5
+VALIDATION_WEIGHT = 0.3
+RECENCY_WEIGHT = 0.2
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _hash_tokens(text: str, dim: int = HASH_DIM) -> np.ndarray:
+    # crc32 rather than hash() so vectors are stable across processes
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        vector[zlib.crc32(token.encode()) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _age_in_days(timestamp: Optional[str], now: datetime) -> float:
+    if not timestamp:
+        return UNVALIDATED_AGE_DAYS
+    try:
+        validated_at = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return UNVALIDATED_AGE_DAYS
+    if validated_at.tzinfo is None:
+        validated_at = validated_at.replace(tzinfo=timezone.utc)
+    return max((now - validated_at).total_seconds() / 86400.0, 0.0)
+
+
+class RuleScorer:
+    def __init__(self, rules: List[Rule], dim: int = HASH_DIM, now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
+        self.rules = list(rules)
+        self.dim = dim
+
+        self.contexts = sorted({rule.context for rule in self.rules})
+        self._context_index = {context: i for i, context in enumerate(self.contexts)}
+
+        count = len(self.rules)
+        self.token_vectors = np.zeros((count, dim), dtype=np.float32)
+        self.context_one_hot = np.zeros((count, len(self.contexts)), dtype=np.float32)
+        self.validation_counts = np.zeros(count, dtype=np.float32)
+        self.ages = np.zeros(count, dtype=np.float32)
+        for i, rule in enumerate(self.rules):
+            self.token_vectors[i] = _hash_tokens(f"{rule.description} {rule.actionable_guideline}", dim)
+            self.context_one_hot[i, self._context_index[rule.context]] = 1.0
+            self.validation_counts[i] = rule.validation_count
+            self.ages[i] = _age_in_days(rule.last_validated_at, now)
+
+        # Query-independent part of the score, computed once
+        validation = np.log1p(self.validation_counts)
+        if count and validation.max() > 0:
+            validation /= validation.max()
+        recency = np.exp2(-self.ages / RECENCY_HALF_LIFE_DAYS)
+        self._prior = VALIDATION_WEIGHT * validation + RECENCY_WEIGHT * recency
+
+    def score(self, query: str, context: Optional[str] = None) -> np.ndarray:
+        """Score every rule against a task query (and optional context) in one pass."""
+        scores = TEXT_WEIGHT * (self.token_vectors @ _hash_tokens(query, self.dim)) + self._prior
+        if context in self._context_index:
+            scores += CONTEXT_WEIGHT * self.context_one_hot[:, self._context_index[context]]
+        return scores
+
+    def top_k(self, query: str, context: Optional[str] = None, k: int = 5) -> List[Rule]:
+        if not self.rules or k <= 0:
+            return []
+        scores = self.score(query, context)
+        k = min(k, len(self.rules))
+        # argpartition finds the k best in O(n); only those k are then fully sorted
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.rules[i] for i in ranked]
+
+
+class RuleScorerCache:
+    """RuleScorer per rule set, so repeated queries do not rebuild the feature arrays.
+
+    Entries are keyed by whatever identifies the rule set (a context filter, a fingerprint of the
+    rules). Owners call clear() when rules change; an entry is also rebuilt after max_age seconds.
+    """
+
+    def __init__(self, max_age: float = RULE_SCORER_MAX_AGE, max_entries: int = RULE_SCORER_CACHE_SIZE):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.builds = 0 # Scorers constructed, for tests and benchmarks
+        self._scorers: Dict[Hashable, Tuple[RuleScorer, float]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load_rules: Callable[[], List[Rule]]) -> RuleScorer:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._scorers.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+            generation = self._generation
+        scorer = RuleScorer(load_rules())
+        with self._lock:
+            self.builds += 1
+            if generation == self._generation: # Rules saved while building: do not cache the stale scorer
+                self._scorers.pop(key, None)
+                self._scorers[key] = (scorer, now + self.max_age)
+                while len(self._scorers) > self.max_entries:
+                    self._scorers.pop(next(iter(self._scorers))) # Oldest first
+        return scorer
+
+    def clear(self):
+        with self._lock:
+            self._scorers.clear()
+            self._generation += 1
@@ -0,0 +1,369 @@
+import html
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple, Union
+import orjson
+from app.models.task import Rule, TaskEvent
+from app.models.stats import FleetStats, HistorySizeBucket
+from app.models.message import ChatMessage, MessageHit, MessageSearchPage
+from app.services.storage import WritePolicy, VersionConflict, agent_partition, format_version, parse_version, encode_cursor, decode_cursor, DEFAULT_RULE_RESULTS, DEFAULT_HISTORY_PAGE_SIZE, DEFAULT_MESSAGE_PAGE_SIZE, STATS_HISTORY_BUCKET_SIZE, STATS_TERMS_SIZE
+from app.services.rule_scoring import RuleScorerCache
+from app.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PRIMARY_TERM = 1
+# Control characters highlight() puts around matched terms; replaced by <em> tags once the text is HTML-escaped
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id TEXT PRIMARY KEY,
+    seq_no INTEGER NOT NULL,
+    doc TEXT NOT NULL CHECK (json_valid(doc))
+);
+CREATE TABLE IF NOT EXISTS rules (
+    rule_id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL CHECK (json_valid(doc))
+);
+CREATE INDEX IF NOT EXISTS rules_context ON rules (json_extract(doc, '$.context'));
+CREATE TABLE IF NOT EXISTS history (
+    agent_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    session_id TEXT,
+    entry TEXT NOT NULL CHECK (json_valid(entry)),
+    PRIMARY KEY (agent_id, seq)
+);
+CREATE TABLE IF NOT EXISTS task_events (
+    main_task_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    doc TEXT NOT NULL CHECK (json_valid(doc)),
+    PRIMARY KEY (main_task_id, seq)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    agent_id TEXT NOT NULL,
+    session_id TEXT,
+    seq INTEGER,
+    role TEXT,
+    content TEXT NOT NULL,
+    timestamp TEXT
+);
+-- Full-text index over messages.content, kept in sync by the trigger (messages are never updated)
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+"""
+
+
+def _highlight_html(marked: str) -> str:
+    # Message content is user input: escape it, so the only markup in a highlight is the <em> tags
+    return html.escape(marked).replace(HIGHLIGHT_START, "<em>").replace(HIGHLIGHT_END, "</em>")
+
+
+class SQLiteStorageService:
+    """Single-node storage backend (STORAGE_BACKEND=sqlite) in one SQLite file.
+
+    Documents are stored as JSON text and queried with the JSON1 functions. WAL mode lets
+    readers proceed while a write is in progress; writes go through one connection and lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Scorers per context filter and data_version: cleared by save_rules here, and any commit
+        # from another process (which bumps data_version) keys a new entry
+        self._rule_scorers = RuleScorerCache()
+        try:
+            self.client = sqlite3.connect(path, check_same_thread=False)
+            self.client.execute("PRAGMA journal_mode=WAL")
+            self.client.execute("PRAGMA synchronous=NORMAL") # Durable at checkpoints; a crash loses at most the last commits
+            self.client.execute("PRAGMA busy_timeout=5000")
+            with self.client:
+                self.client.executescript(SCHEMA)
+            logger.info("SQLite storage ready at %s.", path)
+        except sqlite3.Error as e:
+            logger.error("Error opening SQLite storage at %s: %s", path, e)
+            self.client = None
+
+    def _agent_data(self, seq_no: int, doc: str) -> Dict[str, Any]:
+        agent_data = orjson.loads(doc)
+        agent_data["id"] = agent_data["agent_id"]
+        agent_data["version"] = format_version(seq_no, SQLITE_PRIMARY_TERM)
+        return agent_data
+
+    @traced("sqlite.save_agent")
+    def save_agent(self, agent_model, policy: Optional[WritePolicy] = None,
+                   expected_version: Optional[str] = None) -> Union[str, bool]:
+        if not self.client:
+            return False
+        doc = orjson.dumps({
+            "agent_id": agent_model.id,
+            "name": agent_model.name,
+            "role": agent_model.role,
+            "config": agent_model.config,
+            "stm": agent_model.stm.model_dump(mode="json"),
+            "ltm": agent_model.ltm.model_dump(mode="json"),
+        }).decode()
+        try:
+            with self._lock, self.client:
+                if expected_version is None:
+                    row = self.client.execute(
+                        "INSERT INTO agents (agent_id, seq_no, doc) VALUES (?, 1, ?) "
+                        "ON CONFLICT(agent_id) DO UPDATE SET doc = excluded.doc, seq_no = agents.seq_no + 1 "
+                        "RETURNING seq_no",
+                        (agent_model.id, doc)).fetchone()
+                else:
+                    # Compare-and-set in one statement, so writers in other processes are covered too
+                    seq_no, primary_term = parse_version(expected_version)
+                    row = self.client.execute(
+                        "UPDATE agents SET doc = ?, seq_no = seq_no + 1 WHERE agent_id = ? AND seq_no = ? RETURNING seq_no",
+                        (doc, agent_model.id, seq_no if primary_term == SQLITE_PRIMARY_TERM else -1)).fetchone()
+                    if row is None:
+                        current = self.client.execute("SELECT seq_no FROM agents WHERE agent_id = ?", (agent_model.id,)).fetchone()
+                        raise VersionConflict(agent_model.id, expected_version,
+                                              format_version(current[0], SQLITE_PRIMARY_TERM) if current else None)
+            return format_version(row[0], SQLITE_PRIMARY_TERM)
+        except sqlite3.Error as e:
+            logger.error("Error saving agent %s to SQLite: %s", agent_model.id, e)
+            return False
+
+    @traced("sqlite.get_agent")
+    def get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        if not self.client:
+            return None
+        try:
+            with self._lock:
+                row = self.client.execute("SELECT seq_no, doc FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving agent %s from SQLite: %s", agent_id, e)
+            return None
+        return self._agent_data(*row) if row else None
+
+    @traced("sqlite.get_agent_version")
+    def get_agent_version(self, agent_id: str) -> Optional[str]:
+        if not self.client:
+            return None
+        try:
+            with self._lock:
+                row = self.client.execute("SELECT seq_no FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving version of agent %s from SQLite: %s", agent_id, e)
+            return None
+        return format_version(row[0], SQLITE_PRIMARY_TERM) if row else None
+
+    @traced("sqlite.get_all_agents")
+    def get_all_agents(self, partition: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.client:
+            return []
+        try:
+            with self._lock:
+                rows = self.client.execute("SELECT seq_no, doc FROM agents ORDER BY agent_id").fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving all agents from SQLite: %s", e)
+            return []
+        agents = [self._agent_data(*row) for row in rows]
+        if partition is not None:
+            agents = [data for data in agents if agent_partition(data["config"], data["role"]) == partition]
+        return agents
+
+    @traced("sqlite.save_rules")
+    def save_rules(self, rules: List[Rule], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            return False
+        try:
+            with self._lock, self.client:
+                self.client.executemany(
+                    "INSERT INTO rules (rule_id, doc) VALUES (?, ?) ON CONFLICT(rule_id) DO UPDATE SET doc = excluded.doc",
+                    [(rule.id, rule.model_dump_json()) for rule in rules])
+            self._rule_scorers.clear()
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error saving rules to SQLite: %s", e)
+            return False
+
+    @traced("sqlite.find_relevant_rules")
+    def find_relevant_rules(self, query: str, context: Optional[str] = None, k: int = DEFAULT_RULE_RESULTS) -> List[Rule]:
+        if not self.client:
+            return []
+        def load_rules():
+            with self._lock:
+                if context:
+                    rows = self.client.execute("SELECT doc FROM rules WHERE json_extract(doc, '$.context') = ?", (context,)).fetchall()
+                else:
+                    rows = self.client.execute("SELECT doc FROM rules").fetchall()
+            return [Rule(**orjson.loads(row[0])) for row in rows]
+        try:
+            with self._lock:
+                data_version = self.client.execute("PRAGMA data_version").fetchone()[0]
+            # Ranked in-process with the same scorer as the local fallback
+            scorer = self._rule_scorers.get((context, data_version), load_rules)
+        except sqlite3.Error as e:
+            logger.error("Error searching rules in SQLite: %s", e)
+            return []
+        return scorer.top_k(query, context=context, k=k)
+
+    @traced("sqlite.append_history")
+    def append_history(self, agent_id: str, session_id: str, start_seq: int, entries: List[Dict[str, Any]],
+                       policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            return False
+        try:
+            with self._lock, self.client:
+                self.client.executemany(
+                    "INSERT OR IGNORE INTO history (agent_id, seq, session_id, entry) VALUES (?, ?, ?, ?)", # Append-only
+                    [(agent_id, start_seq + offset, session_id, orjson.dumps(entry).decode()) for offset, entry in enumerate(entries)])
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error appending history for agent %s to SQLite: %s", agent_id, e)
+            return False
+
+    @traced("sqlite.get_history_page")
+    def get_history_page(self, agent_id: str, before_seq: Optional[int] = None, size: int = DEFAULT_HISTORY_PAGE_SIZE) -> List[Dict[str, Any]]:
+        if not self.client:
+            return []
+        try:
+            with self._lock:
+                rows = self.client.execute(
+                    "SELECT entry FROM history WHERE agent_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                    (agent_id, before_seq if before_seq is not None else 2 ** 62, size)).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving history page for agent %s from SQLite: %s", agent_id, e)
+            return []
+        return [orjson.loads(row[0]) for row in reversed(rows)]
+
+    @traced("sqlite.append_task_events")
+    def append_task_events(self, events: List[TaskEvent], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            return False
+        try:
+            with self._lock, self.client:
+                self.client.executemany(
+                    "INSERT OR IGNORE INTO task_events (main_task_id, seq, doc) VALUES (?, ?, ?)",
+                    [(event.main_task_id, event.seq, event.model_dump_json()) for event in events])
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error appending task events to SQLite: %s", e)
+            return False
+
+    @traced("sqlite.get_task_events")
+    def get_task_events(self, main_task_id: str, after_seq: int = 0) -> List[TaskEvent]:
+        if not self.client:
+            return []
+        try:
+            with self._lock:
+                rows = self.client.execute(
+                    "SELECT doc FROM task_events WHERE main_task_id = ? AND seq > ? ORDER BY seq",
+                    (main_task_id, after_seq)).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving task events for %s from SQLite: %s", main_task_id, e)
+            return []
+        return [TaskEvent(**orjson.loads(row[0])) for row in rows]
+
+    @traced("sqlite.get_task_events_version")
+    def get_task_events_version(self, main_task_id: str) -> Optional[Tuple[int, int]]:
+        if not self.client:
+            return None
+        try:
+            with self._lock:
+                last_seq, count = self.client.execute(
+                    "SELECT COALESCE(MAX(seq), 0), COUNT(*) FROM task_events WHERE main_task_id = ?", (main_task_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Error retrieving task event version for %s from SQLite: %s", main_task_id, e)
+            return None
+        return (last_seq, count)
+
+    @traced("sqlite.get_fleet_stats")
+    def get_fleet_stats(self, bucket_size: int = STATS_HISTORY_BUCKET_SIZE) -> Optional[FleetStats]:
+        if not self.client:
+            return None
+        try:
+            with self._lock:
+                roles = self.client.execute(
+                    "SELECT json_extract(doc, '$.role') AS role, COUNT(*) FROM agents GROUP BY role ORDER BY COUNT(*) DESC LIMIT ?",
+                    (STATS_TERMS_SIZE,)).fetchall()
+                agents_total = self.client.execute("SELECT COUNT(*) FROM agents").fetchone()[0]
+                history_sizes = self.client.execute(
+                    "SELECT (json_extract(doc, '$.stm.history_spilled') + json_array_length(doc, '$.stm.history')) / ? * ? AS bucket, "
+                    "COUNT(*) FROM agents GROUP BY bucket ORDER BY bucket",
+                    (bucket_size, bucket_size)).fetchall()
+                # A task's status is the target of its latest task-level (not subtask) event
+                statuses = self.client.execute(
+                    "SELECT json_extract(doc, '$.to_status') AS status, COUNT(*) FROM ("
+                    "  SELECT doc, ROW_NUMBER() OVER (PARTITION BY main_task_id ORDER BY seq DESC) AS position"
+                    "  FROM task_events WHERE json_extract(doc, '$.subtask_id') IS NULL"
+                    ") WHERE position = 1 GROUP BY status ORDER BY COUNT(*) DESC").fetchall()
+                contexts = self.client.execute(
+                    "SELECT json_extract(doc, '$.context') AS context, COUNT(*) FROM rules GROUP BY context ORDER BY COUNT(*) DESC LIMIT ?",
+                    (STATS_TERMS_SIZE,)).fetchall()
+                rules_total = self.client.execute("SELECT COUNT(*) FROM rules").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("Error computing fleet statistics in SQLite: %s", e)
+            return None
+        return FleetStats(
+            agents_total=agents_total,
+            agents_by_role=dict(roles),
+            tasks_by_status=dict(statuses),
+            rules_total=rules_total,
+            rules_by_context=dict(contexts),
+            history_bucket_size=bucket_size,
+            history_sizes=[HistorySizeBucket(min_turns=bucket, agents=count) for bucket, count in history_sizes],
+            generated_at=datetime.now(timezone.utc).isoformat(),
+        )
+
+    @traced("sqlite.index_messages")
+    def index_messages(self, messages: List[ChatMessage], policy: Optional[WritePolicy] = None) -> bool:
+        if not self.client:
+            return False
+        try:
+            with self._lock, self.client:
+                self.client.executemany(
+                    "INSERT OR IGNORE INTO messages (message_id, agent_id, session_id, seq, role, content, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(m.id, m.agent_id, m.session_id, m.seq, m.role, m.content, m.timestamp) for m in messages])
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error indexing messages into SQLite: %s", e)
+            return False
+
+    @traced("sqlite.search_messages")
+    def search_messages(self, query: str, agent_id: Optional[str] = None, session_id: Optional[str] = None,
+                        size: int = DEFAULT_MESSAGE_PAGE_SIZE, cursor: Optional[str] = None) -> Optional[MessageSearchPage]:
+        if not self.client:
+            return None
+        offset = int(decode_cursor(cursor)[0]) if cursor else 0 # The cursor is an offset here
+        # Each word as a quoted FTS5 string, so query syntax in user input is matched literally
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return MessageSearchPage(total=0, hits=[])
+        conditions, params = ["messages_fts MATCH ?"], ['"' + '" OR "'.join(terms) + '"']
+        if agent_id:
+            conditions.append("m.agent_id = ?")
+            params.append(agent_id)
+        if session_id:
+            conditions.append("m.session_id = ?")
+            params.append(session_id)
+        where = " AND ".join(conditions)
+        try:
+            with self._lock:
+                total = self.client.execute(
+                    f"SELECT COUNT(*) FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid WHERE {where}", params).fetchone()[0]
+                rows = self.client.execute(
+                    "SELECT m.message_id, m.agent_id, m.session_id, m.seq, m.role, m.content, m.timestamp, "
+                    "bm25(messages_fts), highlight(messages_fts, 0, char(2), char(3)) "
+                    f"FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid WHERE {where} "
+                    "ORDER BY bm25(messages_fts), m.timestamp DESC, m.message_id LIMIT ? OFFSET ?",
+                    params + [size, offset]).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error searching messages in SQLite: %s", e)
+            return None
+        hits = [MessageHit(message=ChatMessage(id=row[0], agent_id=row[1], session_id=row[2], seq=row[3], role=row[4],
+                                               content=row[5], timestamp=row[6]),
+                           score=-row[7], highlights=[_highlight_html(row[8])]) # bm25 is lower for better matches
+                for row in rows]
+        return MessageSearchPage(total=total, hits=hits,
+                                 next_cursor=encode_cursor([offset + size]) if offset + size < total else None)
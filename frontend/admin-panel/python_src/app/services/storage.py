@@ -0,0 +1,172 @@
+import base64
+import os
+from typing import Any, Dict, List, Literal, Optional, Protocol, Tuple, Union, runtime_checkable
+import orjson
+from pydantic import BaseModel
+from app.models.task import Rule, TaskEvent
+from app.models.stats import FleetStats
+from app.models.message import ChatMessage, MessageSearchPage
+
+# elasticsearch (default) | memory | sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "elasticsearch").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "agents.db")
+DEFAULT_RULE_RESULTS = 5 # Top-k rules returned by find_relevant_rules
+DEFAULT_HISTORY_PAGE_SIZE = 20
+DEFAULT_MESSAGE_PAGE_SIZE = 20 # Hits per page of search_messages
+# Key that partitions the agent fleet: "tenant" (config["tenant"]) or "role". Elasticsearch can
+# route or index agents by it (ES_AGENT_SHARDING) and get_all_agents can be limited to one partition.
+AGENT_PARTITION_BY = os.getenv("AGENT_PARTITION_BY", "tenant").lower()
+DEFAULT_TENANT = "default" # Partition of agents without config["tenant"]
+# Width of the buckets of the history size histogram in get_fleet_stats, and how many roles
+# and rule contexts are reported (the most frequent ones)
+STATS_HISTORY_BUCKET_SIZE = int(os.getenv("STATS_HISTORY_BUCKET_SIZE", "50"))
+STATS_TERMS_SIZE = int(os.getenv("STATS_TERMS_SIZE", "50"))
+# Refresh behaviour of writes that do not ask for a specific WritePolicy
+ES_WRITE_REFRESH = os.getenv("ES_WRITE_REFRESH", "false")
+ES_WRITE_TIMEOUT = os.getenv("ES_WRITE_TIMEOUT") # e.g. "30s"; the cluster default when unset
+
+
+class WritePolicy(BaseModel):
+    """How a write is acknowledged.
+
+    refresh: "false" returns as soon as the write is durable, before it is searchable (cheapest);
+    "wait_for" blocks until the next scheduled refresh makes it visible to searches; "true" forces
+    a refresh (expensive, avoid on hot paths). routing sends the document to a specific shard and
+    must then be given on reads too. timeout bounds the wait for unavailable primary shards.
+    Backends without a refresh cycle (memory, sqlite) make every write visible immediately.
+    """
+    refresh: Literal["false", "wait_for", "true"] = ES_WRITE_REFRESH
+    routing: Optional[str] = None
+    timeout: Optional[str] = ES_WRITE_TIMEOUT
+
+    def request_params(self) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"refresh": self.refresh}
+        if self.routing:
+            params["routing"] = self.routing
+        if self.timeout:
+            params["timeout"] = self.timeout
+        return params
+
+
+# Intermediate state: throughput over visibility
+ASYNC_WRITE = WritePolicy(refresh="false")
+# Final state that is read back straight away (task completion, timelines)
+READ_YOUR_WRITES = WritePolicy(refresh="wait_for")
+
+
+def format_version(seq_no: Optional[int], primary_term: Optional[int]) -> Optional[str]:
+    # Document version from ES optimistic concurrency metadata, used as the ETag of an agent
+    if seq_no is None or primary_term is None:
+        return None
+    return f"{primary_term}-{seq_no}"
+
+
+def parse_version(version: str) -> Tuple[int, int]:
+    # Inverse of format_version: (seq_no, primary_term), as passed to if_seq_no/if_primary_term
+    primary_term, seq_no = version.split("-", 1)
+    return int(seq_no), int(primary_term)
+
+
+class VersionConflict(Exception):
+    """A conditional save_agent found the stored document at another version than expected."""
+
+    def __init__(self, agent_id: str, expected_version: str, current_version: Optional[str] = None):
+        super().__init__(f"Agent {agent_id} is no longer at version {expected_version} (now {current_version or 'unknown'})")
+        self.agent_id = agent_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+def agent_partition(config: Dict[str, Any], role: str) -> str:
+    if AGENT_PARTITION_BY == "role":
+        return role
+    return str(config.get("tenant") or DEFAULT_TENANT)
+
+
+def history_size(stm: Dict[str, Any]) -> int:
+    # Total turns of an agent's conversation: those still in STM plus those spilled to the history index
+    return stm.get("history_spilled", 0) + len(stm.get("history", []))
+
+
+def encode_cursor(position: List[Any]) -> str:
+    # Opaque page cursor; each backend decides what the position holds (sort values, an offset)
+    return base64.urlsafe_b64encode(orjson.dumps(position)).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Inverse of encode_cursor; raises ValueError for a cursor it did not produce."""
+    try:
+        position = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, orjson.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+    if not isinstance(position, list):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return position
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """Operations the agents and the API need from a store.
+
+    Agents: save_agent (put), get_agent / get_agent_version (get), get_all_agents (scan, optionally
+    of one partition, see agent_partition).
+    Tasks: append_task_events (bulk), get_task_events (scan) and get_task_events_version (the last
+    seq and number of events, None on failure; versions the append-only timeline cheaply). Rules and spilled history
+    follow the same pattern. get_fleet_stats counts agents, tasks and rules (None on failure).
+    Conversation turns are written with index_messages (bulk) and found with search_messages
+    (full text, highlighted, paged by cursor; None on failure).
+    `client` is falsy when the backend is unusable. Writes take an optional WritePolicy; None
+    means the backend's default.
+
+    save_agent returns the new version of the document (True when the backend cannot tell it)
+    or False on failure. Given expected_version, it only writes if the stored document is still
+    at that version and raises VersionConflict otherwise.
+    """
+
+    client: Any
+
+    def save_agent(self, agent_model, policy: Optional[WritePolicy] = None,
+                   expected_version: Optional[str] = None) -> Union[str, bool]: ...
+
+    def get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]: ...
+
+    def get_agent_version(self, agent_id: str) -> Optional[str]: ...
+
+    def get_all_agents(self, partition: Optional[str] = None) -> List[Dict[str, Any]]: ...
+
+    def save_rules(self, rules: List[Rule], policy: Optional[WritePolicy] = None) -> bool: ...
+
+    def find_relevant_rules(self, query: str, context: Optional[str] = None, k: int = ...) -> List[Rule]: ...
+
+    def append_history(self, agent_id: str, session_id: str, start_seq: int, entries: List[Dict[str, Any]],
+                       policy: Optional[WritePolicy] = None) -> bool: ...
+
+    def get_history_page(self, agent_id: str, before_seq: Optional[int] = None, size: int = ...) -> List[Dict[str, Any]]: ...
+
+    def append_task_events(self, events: List[TaskEvent], policy: Optional[WritePolicy] = None) -> bool: ...
+
+    def get_task_events(self, main_task_id: str, after_seq: int = 0) -> List[TaskEvent]: ...
+
+    def get_task_events_version(self, main_task_id: str) -> Optional[Tuple[int, int]]: ...
+
+    def get_fleet_stats(self, bucket_size: int = ...) -> Optional[FleetStats]: ...
+
+    def index_messages(self, messages: List[ChatMessage], policy: Optional[WritePolicy] = None) -> bool: ...
+
+    def search_messages(self, query: str, agent_id: Optional[str] = None, session_id: Optional[str] = None,
+                        size: int = ..., cursor: Optional[str] = None) -> Optional[MessageSearchPage]: ...
+
+
+def create_storage_backend(backend: str = STORAGE_BACKEND, connect: bool = True) -> StorageBackend:
+    # Imports are local so a deployment only loads the client library of the backend it uses.
+    # connect=False returns an Elasticsearch service whose connect() is called later (see app.main lifespan).
+    if backend == "memory":
+        from app.services.in_memory_service import InMemoryStorageService
+        return InMemoryStorageService()
+    if backend == "sqlite":
+        from app.services.sqlite_service import SQLiteStorageService
+        return SQLiteStorageService(SQLITE_PATH)
+    if backend == "elasticsearch":
+        from app.services.elasticsearch_service import ElasticsearchService
+        return ElasticsearchService(connect=connect)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Expected elasticsearch, memory or sqlite.")
@@ -0,0 +1,317 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import orjson
+from pydantic import ValidationError
+from app.models.agent import AbstractAgentPydantic
+from app.models.task import Rule
+from app.agents.merge import merge_agent_state
+from app.services.storage import VersionConflict
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# off: writes go straight to the backend (default)
+# fallback: writes the backend cannot take (unavailable, failed, or queued behind earlier ones) go to the log
+# group_commit: every agent/rule write goes to the log and is flushed to the backend in batches
+WAL_MODE = os.getenv("WAL_MODE", "off").lower()
+WAL_PATH = os.getenv("WAL_PATH", "agents.wal")
+# Appends are flushed to the OS immediately but fsynced at most this often, so a burst of
+# writes shares one fsync; the last append of a burst is fsynced by a timer once the interval
+# is up. A crash can lose the records of the last interval.
+WAL_FSYNC_INTERVAL = float(os.getenv("WAL_FSYNC_INTERVAL", "0.05"))
+WAL_FLUSH_INTERVAL = float(os.getenv("WAL_FLUSH_INTERVAL", "1")) # Seconds between background replays in the API
+WAL_MAX_PENDING = int(os.getenv("WAL_MAX_PENDING", "1000")) # group_commit flushes inline beyond this many records
+# Replays a document may fail (while other writes succeed, or always if it is invalid) before its
+# records are moved to the quarantine file next to the log instead of being retried
+WAL_MAX_REPLAY_ATTEMPTS = int(os.getenv("WAL_MAX_REPLAY_ATTEMPTS", "5"))
+# Agents whose last replayed version is remembered, so the next logged write of the same writer
+# can be saved conditionally on it; a forgotten one only costs a read of the stored document
+WAL_MAX_APPLIED_AGENTS = int(os.getenv("WAL_MAX_APPLIED_AGENTS", "10000"))
+
+FALLBACK = "fallback"
+GROUP_COMMIT = "group_commit"
+
+WAL_QUARANTINED = REGISTRY.counter(
+    "wal_documents_quarantined_total", "Documents moved out of the write-ahead log after failing replay repeatedly", ("op",))
+
+
+class WriteAheadLog:
+    """Append-only JSON-lines log of agent and rule writes, replayed to a storage backend in order.
+
+    Each record is {"lsn", "op", "data"}; agent records also carry the "base" the write started
+    from: the stored version and state it was loaded at, or the LSN of the writer's previous logged
+    write. Every record is a full-document write, so replay only applies the latest version of each
+    writer's chain of agent writes and of each rule (one bulk save_rules for the rules). Agent saves
+    are conditional on the base version and merged with the stored document on a conflict, like
+    AbstractAgent.save_state, so writers logging the same agent concurrently do not lose each
+    other's changes. Applied records are removed by rewriting the file with the ones still pending.
+    A document that keeps failing is quarantined (see WAL_MAX_REPLAY_ATTEMPTS) so it cannot hold
+    back the rest of the log.
+    """
+
+    def __init__(self, path: str = WAL_PATH, mode: str = FALLBACK, fsync_interval: float = WAL_FSYNC_INTERVAL,
+                 max_pending: int = WAL_MAX_PENDING, max_replay_attempts: int = WAL_MAX_REPLAY_ATTEMPTS,
+                 max_save_retries: int = 3, max_applied_agents: int = WAL_MAX_APPLIED_AGENTS):
+        self.path = path
+        self.quarantine_path = f"{path}.quarantine"
+        self.mode = mode
+        self.fsync_interval = fsync_interval
+        self.max_pending = max_pending
+        self.max_replay_attempts = max_replay_attempts
+        self.max_save_retries = max_save_retries # Merges of a conflicting agent save per replay
+        self.max_applied_agents = max_applied_agents
+        self._lock = threading.RLock()
+        self._replay_lock = threading.Lock() # One replay at a time, so no record is applied twice
+        self._records: List[Dict[str, Any]] = self._read_records()
+        self._lsn = self._records[-1]["lsn"] if self._records else 0
+        self._pending_agents: Dict[str, Dict[str, Any]] = {} # Agent id -> latest record
+        self._index_agents()
+        self._failed_replays: Dict[str, int] = {} # Document key -> replays it failed in a row
+        # Agent id -> (LSN, stored version) of its last replayed write, least recently applied first
+        self._applied_agents: "OrderedDict[str, Tuple[int, Optional[str]]]" = OrderedDict()
+        self._file = open(path, "ab")
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        self._sync_timer: Optional[threading.Timer] = None
+        if self._records:
+            logger.warning("Write-ahead log %s has %s record(s) waiting for replay.", path, len(self._records))
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "rb") as wal_file:
+            for line in wal_file:
+                try:
+                    records.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # A torn last line from a crash mid-append; everything before it is intact
+                    logger.warning("Skipping unreadable record in write-ahead log %s.", self.path)
+        return records
+
+    def _index_agents(self):
+        # Latest logged document per agent, so reads see writes that are not replayed yet
+        self._pending_agents = {record["data"]["id"]: record for record in self._records if record["op"] == "save_agent"}
+
+    def append(self, op: str, data: Any, base: Optional[Dict[str, Any]] = None) -> int:
+        with self._lock:
+            self._lsn += 1
+            record = {"lsn": self._lsn, "op": op, "data": data}
+            if base is not None:
+                record["base"] = base
+            self._file.write(orjson.dumps(record) + b"\n")
+            self._file.flush()
+            self._unsynced = True
+            since_fsync = time.monotonic() - self._last_fsync
+            if since_fsync >= self.fsync_interval:
+                self.sync()
+            elif self._sync_timer is None:
+                # No further append may come to fsync this one, so a timer does it when the interval is up
+                self._sync_timer = threading.Timer(self.fsync_interval - since_fsync, self._deferred_sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+            self._records.append(record)
+            if op == "save_agent":
+                self._pending_agents[data["id"]] = record
+            return self._lsn
+
+    def append_agent(self, agent_model, base_version: Optional[str] = None, base_lsn: Optional[int] = None,
+                     base_state: Optional[Dict[str, Any]] = None) -> int:
+        # base_state is the agent as of base_version, or as logged at base_lsn (its previous logged write)
+        base = {"version": base_version, "lsn": base_lsn, "state": base_state} if base_state is not None else None
+        return self.append("save_agent", agent_model.model_dump(mode="json", include=set(AbstractAgentPydantic.model_fields)), base)
+
+    def append_rules(self, rules: List[Rule]) -> int:
+        return self.append("save_rules", [rule.model_dump(mode="json") for rule in rules])
+
+    def sync(self):
+        with self._lock:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.monotonic()
+            self._unsynced = False
+
+    def _deferred_sync(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._unsynced and not self._file.closed:
+                self.sync()
+
+    def pending(self) -> int:
+        return len(self._records)
+
+    def over_capacity(self) -> bool:
+        return len(self._records) >= self.max_pending
+
+    def pending_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        # The latest logged document of the agent, with the "lsn" of its record
+        record = self._pending_agents.get(agent_id)
+        return dict(record["data"], lsn=record["lsn"]) if record else None
+
+    def replay(self, backend) -> int:
+        """Apply the pending records to the backend. Returns the number of records removed from
+        the log: applied, or quarantined.
+
+        A document whose write fails stays pending for the next replay, without holding back the
+        others. Once it has failed max_replay_attempts replays in a row, counting only replays in
+        which other writes succeeded (so a storage outage does not count) or in which it could not
+        be parsed at all, it is moved to the quarantine file and reported."""
+        with self._replay_lock:
+            with self._lock:
+                self.sync()
+                records = list(self._records)
+            if not records:
+                return 0
+            # Chains of agent writes, keyed "<agent id>@<LSN of their first pending record>": each
+            # record based on a pending record continues that one's chain and supersedes it
+            agents: Dict[str, Dict[str, Any]] = {}
+            chain_of: Dict[int, str] = {}
+            rules: Dict[str, Dict[str, Any]] = {}
+            for record in records: # Log order, so later versions of a document win
+                if record["op"] == "save_agent":
+                    base = record.get("base") or {}
+                    key = chain_of.get(base.get("lsn"), f"{record['data']['id']}@{record['lsn']}")
+                    agents[key] = {"data": record["data"], "lsn": record["lsn"], "base": agents[key]["base"] if key in agents else base}
+                    chain_of[record["lsn"]] = key
+                elif record["op"] == "save_rules":
+                    rules.update((rule["id"], rule) for rule in record["data"])
+                else:
+                    logger.error("Unknown write-ahead log operation '%s' at LSN %s; dropping it.", record["op"], record["lsn"])
+
+            failed: Dict[str, str] = {} # Document key -> error
+            invalid: Set[str] = set()
+            valid_rules = []
+            for rule_id, rule in rules.items():
+                try:
+                    valid_rules.append(Rule(**rule))
+                except ValidationError as e:
+                    failed[f"rule:{rule_id}"] = str(e)
+                    invalid.add(f"rule:{rule_id}")
+            if valid_rules and not self._apply(backend.save_rules, valid_rules):
+                logger.warning("Write-ahead log replay failed saving %s rule(s).", len(valid_rules))
+                failed.update((f"rule:{rule.id}", "save_rules failed") for rule in valid_rules)
+            for chain, write in agents.items():
+                try:
+                    agent_model = AbstractAgentPydantic(**write["data"])
+                except ValidationError as e:
+                    failed[f"agent:{chain}"] = str(e)
+                    invalid.add(f"agent:{chain}")
+                    continue
+                if not self._apply(self._save_agent, backend, agent_model, write["base"], write["lsn"]):
+                    logger.warning("Write-ahead log replay failed saving agent %s.", agent_model.id)
+                    failed[f"agent:{chain}"] = "save_agent failed"
+
+            progressed = len(failed) < len(agents) + len(rules)
+            kept: Set[str] = set()
+            for key, error in failed.items():
+                attempts = self._failed_replays.get(key, 0) + (1 if progressed or key in invalid else 0)
+                self._failed_replays[key] = attempts
+                if attempts >= self.max_replay_attempts:
+                    if key.startswith("agent:"):
+                        self._quarantine(key.rsplit("@", 1)[0], agents[key[len("agent:"):]]["data"], error, attempts)
+                    else:
+                        self._quarantine(key, rules[key[len("rule:"):]], error, attempts)
+                else:
+                    kept.add(key)
+            for key in list(self._failed_replays):
+                if key not in kept:
+                    del self._failed_replays[key] # Applied or quarantined: a later failure starts over
+
+            done = [record for record in records if not kept.intersection(self._record_keys(record, chain_of))]
+            if done:
+                self._truncate({record["lsn"] for record in done})
+                logger.info("Replayed %s write-ahead log record(s) to storage; %s document(s) still pending.", len(done), len(kept))
+            return len(done)
+
+    def _save_agent(self, backend, agent_model: AbstractAgentPydantic, base: Dict[str, Any], lsn: int):
+        # Conditional on the version the chain of writes started from; on a conflict the stored
+        # document is merged in (see merge_agent_state) and the save retried
+        document, base_state, expected_version = agent_model.model_dump(mode="json"), base.get("state"), base.get("version")
+        if base.get("lsn") is not None:
+            # Based on the writer's previous write, which an earlier replay stored: at the version
+            # remembered for it, unless another write of the agent was replayed since
+            applied_lsn, applied_version = self._applied_agents.get(agent_model.id, (None, None))
+            expected_version = applied_version if applied_lsn == base["lsn"] else None
+        # Without a known version of the base, the stored document is merged in before saving
+        merge = expected_version is None and base_state is not None
+        for attempt in range(self.max_save_retries + 1):
+            if merge:
+                stored = backend.get_agent(agent_model.id)
+                if stored and base_state is not None:
+                    theirs = AbstractAgentPydantic(**stored).model_dump(mode="json")
+                    document, conflicts = merge_agent_state(base_state, document, theirs)
+                    if conflicts:
+                        logger.warning("Agent %s was changed concurrently; keeping the logged %s.", agent_model.id, ", ".join(conflicts))
+                    base_state, expected_version = theirs, stored.get("version")
+                else:
+                    base_state, expected_version = None, None # Deleted meanwhile: the retry is a plain write
+            kwargs = {"expected_version": expected_version} if expected_version else {}
+            try:
+                saved = backend.save_agent(AbstractAgentPydantic(**document), **kwargs)
+            except VersionConflict:
+                if attempt == self.max_save_retries:
+                    raise
+                merge = True
+                continue
+            if saved:
+                with self._lock:
+                    self._applied_agents[agent_model.id] = (lsn, saved if isinstance(saved, str) else None)
+                    self._applied_agents.move_to_end(agent_model.id)
+                    while len(self._applied_agents) > self.max_applied_agents:
+                        self._applied_agents.popitem(last=False)
+            return saved
+
+    @staticmethod
+    def _apply(write, *args) -> bool:
+        try:
+            return bool(write(*args))
+        except Exception:
+            logger.exception("Write-ahead log replay write raised.")
+            return False
+
+    @staticmethod
+    def _record_keys(record: Dict[str, Any], chain_of: Dict[int, str]) -> List[str]:
+        if record["op"] == "save_agent":
+            return [f"agent:{chain_of[record['lsn']]}"]
+        if record["op"] == "save_rules":
+            return [f"rule:{rule['id']}" for rule in record["data"]]
+        return []
+
+    def _quarantine(self, key: str, data: Dict[str, Any], error: str, attempts: int):
+        entry = {"key": key, "data": data, "error": error, "attempts": attempts,
+                 "quarantined_at": datetime.now(timezone.utc).isoformat()}
+        with open(self.quarantine_path, "ab") as quarantine_file:
+            quarantine_file.write(orjson.dumps(entry) + b"\n")
+            quarantine_file.flush()
+            os.fsync(quarantine_file.fileno())
+        WAL_QUARANTINED.inc(op=key.split(":", 1)[0])
+        logger.error("Write-ahead log replay failed %s time(s) for %s; moved it to %s: %s", attempts, key, self.quarantine_path, error)
+
+    def _truncate(self, applied: Set[int]):
+        # Rewrites the file with the records that are still pending (usually none)
+        with self._lock:
+            self._records = [record for record in self._records if record["lsn"] not in applied]
+            self._file.close()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as tmp_file:
+                for record in self._records:
+                    tmp_file.write(orjson.dumps(record) + b"\n")
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "ab")
+            self._index_agents()
+
+    def close(self):
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._file.closed:
+                return
+            self.sync()
+            self._file.close()
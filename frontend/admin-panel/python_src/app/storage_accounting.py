@@ -0,0 +1,166 @@
+import logging
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+import orjson
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+# What happens when a workflow exceeds its storage budget: off | warn (log a warning) | raise (StorageBudgetExceeded)
+STORAGE_BUDGET_MODE = os.getenv("STORAGE_BUDGET_MODE", "warn").lower()
+# Per-workflow limits; unset means unlimited
+WORKFLOW_STORAGE_MAX_CALLS = _env_int("WORKFLOW_STORAGE_MAX_CALLS")
+WORKFLOW_STORAGE_MAX_BYTES = _env_int("WORKFLOW_STORAGE_MAX_BYTES")
+WORKFLOW_STORAGE_MAX_REPEATS = _env_int("WORKFLOW_STORAGE_MAX_REPEATS") # Calls of one operation on one document
+# The same operation on the same key more often than this within one scope is reported as a likely N+1
+STORAGE_REPEAT_THRESHOLD = int(os.getenv("STORAGE_REPEAT_THRESHOLD", "10"))
+# Sizing written payloads serializes them a second time; disable to count calls only
+STORAGE_ACCOUNT_BYTES = os.getenv("STORAGE_ACCOUNT_BYTES", "true").lower() == "true"
+
+# StorageBackend methods that are counted; writes also have their payload sized
+READ_OPERATIONS = ("get_agent", "get_agent_version", "get_all_agents", "find_relevant_rules", "get_history_page", "get_task_events",
+                   "get_task_events_version", "get_fleet_stats", "search_messages")
+WRITE_OPERATIONS = ("save_agent", "save_rules", "append_history", "append_task_events", "index_messages")
+
+
+class StorageBudgetExceeded(RuntimeError):
+    def __init__(self, usage: "StorageUsage", violations: List[str]):
+        super().__init__(f"Storage budget exceeded for {usage.scope}: {'; '.join(violations)}")
+        self.usage = usage
+        self.violations = violations
+
+
+class StorageUsage:
+    """Storage calls and written bytes, by operation, made within one request or workflow."""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.calls: Counter = Counter()
+        self.bytes: Counter = Counter()
+        self.keyed_calls: Counter = Counter() # (operation, key) -> calls
+
+    def record(self, operation: str, key: Optional[str] = None, nbytes: int = 0):
+        self.calls[operation] += 1
+        self.bytes[operation] += nbytes
+        if key is not None:
+            self.keyed_calls[(operation, key)] += 1
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.bytes.values())
+
+    def repeated(self, threshold: int = STORAGE_REPEAT_THRESHOLD) -> List[Dict[str, Any]]:
+        # Operations issued over and over for the same document, e.g. saving the manager after every subtask
+        return [{"operation": operation, "key": key, "calls": calls}
+                for (operation, key), calls in self.keyed_calls.most_common() if calls > threshold]
+
+    def violations(self, max_calls: Optional[int] = None, max_bytes: Optional[int] = None,
+                   max_repeats: Optional[int] = None) -> List[str]:
+        violations = []
+        if max_calls is not None and self.total_calls > max_calls:
+            violations.append(f"{self.total_calls} calls > {max_calls}")
+        if max_bytes is not None and self.total_bytes > max_bytes:
+            violations.append(f"{self.total_bytes} bytes written > {max_bytes}")
+        if max_repeats is not None:
+            violations.extend(f"{entry['operation']}({entry['key']}) called {entry['calls']} times > {max_repeats}"
+                              for entry in self.repeated(max_repeats))
+        return violations
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.total_calls,
+            "bytes_written": self.total_bytes,
+            "by_operation": {operation: {"calls": calls, "bytes_written": self.bytes[operation]}
+                             for operation, calls in sorted(self.calls.items())},
+            "repeated": self.repeated(),
+        }
+
+
+# Usages of the enclosing scopes (request, workflow); every call is recorded in each of them
+_active_usages: ContextVar[Tuple[StorageUsage, ...]] = ContextVar("storage_usages", default=())
+
+
+@contextmanager
+def storage_accounting(scope: str, max_calls: Optional[int] = None, max_bytes: Optional[int] = None,
+                       max_repeats: Optional[int] = None, mode: Optional[str] = None):
+    """Count storage calls made through accounted() services inside the block and check them against a budget.
+
+    The budget is checked when the block exits normally; depending on mode it is ignored, logged
+    or raised as StorageBudgetExceeded.
+    """
+    usage = StorageUsage(scope)
+    token = _active_usages.set(_active_usages.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        _active_usages.reset(token)
+    mode = (mode or STORAGE_BUDGET_MODE).lower()
+    if mode == "off":
+        return
+    violations = usage.violations(max_calls, max_bytes, max_repeats)
+    if not violations:
+        return
+    if mode == "raise":
+        raise StorageBudgetExceeded(usage, violations)
+    logger.warning("Storage budget exceeded for %s: %s", scope, "; ".join(violations), extra={"storage_ops": usage.to_dict()})
+
+
+def _payload_bytes(value: Any) -> int:
+    if isinstance(value, BaseModel):
+        return len(value.model_dump_json())
+    if isinstance(value, (list, tuple)):
+        return sum(_payload_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return len(orjson.dumps(value, default=str))
+    return 0 # Ids, sequence numbers and other scalars
+
+
+def _operation_key(args: tuple) -> Optional[str]:
+    # The document an operation targets: an id argument or the id of the model being written
+    if not args:
+        return None
+    if isinstance(args[0], str):
+        return args[0]
+    key = getattr(args[0], "id", None)
+    return key if isinstance(key, str) else None
+
+
+class AccountedStorage:
+    # Wraps a StorageBackend and records its read and write operations in the active usages
+    __slots__ = ("_service",)
+
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._service, name)
+        if name not in READ_OPERATIONS and name not in WRITE_OPERATIONS:
+            return attribute
+
+        def accounted_operation(*args, **kwargs):
+            nbytes = 0
+            if STORAGE_ACCOUNT_BYTES and name in WRITE_OPERATIONS:
+                nbytes = sum(_payload_bytes(arg) for arg in args)
+            key = _operation_key(args)
+            for usage in _active_usages.get():
+                usage.record(name, key, nbytes)
+            return attribute(*args, **kwargs)
+        return accounted_operation
+
+
+def accounted(service):
+    """The service wrapped for accounting, or unchanged when no accounting scope is active."""
+    if service is None or not _active_usages.get():
+        return service
+    return AccountedStorage(service)
@@ -0,0 +1,167 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional
+import orjson
+
+# Set TRACING_ENABLED=false to make every span a no-op
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Finished traces kept in memory for the trace endpoint; the oldest trace is dropped first
+TRACE_BUFFER_TRACES = int(os.getenv("TRACE_BUFFER_TRACES", "200"))
+# Optional JSON-lines file receiving every finished span, for offline analysis
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+
+
+class Span:
+    """A timed operation, following the OpenTelemetry span data model."""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes",
+                 "start_time_unix_nano", "end_time_unix_nano", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time_unix_nano = time.time_ns()
+        self.end_time_unix_nano: Optional[int] = None
+        self.status = "UNSET"
+        self.status_message: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status = "ERROR"
+        self.status_message = message
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time_unix_nano is None:
+            return None
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_unix_nano,
+            "end_time_unix_nano": self.end_time_unix_nano,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes,
+        }
+
+
+class InMemorySpanExporter:
+    # Keeps finished spans grouped by trace, and which trace ran each main task
+    def __init__(self, max_traces: int = TRACE_BUFFER_TRACES, export_path: Optional[str] = TRACE_EXPORT_PATH):
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self._traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._main_tasks: Dict[str, str] = {} # main_task_id -> trace_id
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    evicted_trace_id, _ = self._traces.popitem(last=False)
+                    for main_task_id in [k for k, v in self._main_tasks.items() if v == evicted_trace_id]:
+                        del self._main_tasks[main_task_id]
+            spans.append(span)
+            main_task_id = span.attributes.get("main_task_id")
+            if main_task_id:
+                self._main_tasks[main_task_id] = span.trace_id
+        if self.export_path:
+            with open(self.export_path, "ab") as export_file:
+                export_file.write(orjson.dumps(span.to_dict(), default=str) + b"\n")
+
+    def get_trace(self, trace_id: str) -> List[Span]:
+        with self._lock:
+            return list(self._traces.get(trace_id, ()))
+
+    def trace_id_for_main_task(self, main_task_id: str) -> Optional[str]:
+        return self._main_tasks.get(main_task_id)
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+            self._main_tasks.clear()
+
+
+EXPORTER = InMemorySpanExporter()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(name: str, **attributes: Any):
+    """Open a child of the current span (or a new trace) for the duration of the block."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent = _current_span.get()
+    span = Span(name, parent.trace_id if parent else secrets.token_hex(16),
+                parent.span_id if parent else None, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time_unix_nano = time.time_ns()
+        if span.status == "UNSET":
+            span.status = "OK"
+        EXPORTER.export(span)
+
+
+def traced(name: str):
+    """Decorator opening a span around each call of the wrapped function."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with start_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceContextFilter(logging.Filter):
+    # Adds trace_id / span_id to log records so log lines can be matched to spans
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span else "-"
+        record.span_id = span.span_id if span else "-"
+        return True
+
+
+def build_trace_tree(spans: List[Span]) -> List[Dict[str, Any]]:
+    """Nest spans under their parents. Returns the root spans, children ordered by start time."""
+    nodes = {span.span_id: dict(span.to_dict(), children=[]) for span in spans}
+    roots = []
+    for span in sorted(spans, key=lambda s: s.start_time_unix_nano):
+        node = nodes[span.span_id]
+        parent = nodes.get(span.parent_span_id)
+        (parent["children"] if parent else roots).append(node)
+    return roots
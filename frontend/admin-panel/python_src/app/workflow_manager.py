@@ -1,131 +1,170 @@
 # backend/app/workflow_manager.py
+import logging
 import time
 import uuid
 from typing import List
 from app.agents.manager import ManagerAgent
+from app.agents.base import get_write_ahead_log, flush_write_ahead_log
+from app.services.write_ahead_log import GROUP_COMMIT
+from contextlib import contextmanager
 from app.models.task import TaskStatus, SubTask
+from app.metrics import WORKFLOW_PHASE_SECONDS, WORKFLOW_SAVES
+from app.storage_accounting import storage_accounting, WORKFLOW_STORAGE_MAX_CALLS, WORKFLOW_STORAGE_MAX_BYTES, WORKFLOW_STORAGE_MAX_REPEATS
+from app.tracing import start_span, current_span
+
+logger = logging.getLogger(__name__)
+
+# One subtask group runs per iteration, so larger plans need a higher limit
+DEFAULT_MAX_ITERATIONS = 10
 
 class WorkflowManager:
-    def __init__(self, manager_agent: ManagerAgent):
+    def __init__(self, manager_agent: ManagerAgent, max_iterations: int = DEFAULT_MAX_ITERATIONS):
         self.manager = manager_agent
+        self.max_iterations = max_iterations
 
     def run_main_task_loop(self, user_query: str, designated_agent_ids: List[str], overall_goal_desc: str) -> dict:
-        print(f"--- Starting New Main Task Loop for Query: '{user_query}' ---")
+        # Storage calls of this run are counted against the workflow budget; each phase below is timed and traced separately
+        with storage_accounting("workflow", max_calls=WORKFLOW_STORAGE_MAX_CALLS, max_bytes=WORKFLOW_STORAGE_MAX_BYTES,
+                                max_repeats=WORKFLOW_STORAGE_MAX_REPEATS) as storage_usage:
+            with start_span("workflow.run", user_query=user_query):
+                result = self._run_main_task_loop(user_query, designated_agent_ids, overall_goal_desc)
+            wal = get_write_ahead_log()
+            if wal and wal.mode == GROUP_COMMIT:
+                flush_write_ahead_log() # The run's agent saves reach storage as one batch
+            WORKFLOW_SAVES.observe(storage_usage.calls["save_agent"])
+            result["storage_ops"] = storage_usage.to_dict()
+            logger.info("Workflow storage usage: %s calls, %s bytes written.", storage_usage.total_calls, storage_usage.total_bytes,
+                        extra={"main_task_id": result["main_task_id"], "storage_ops": result["storage_ops"]})
+        return result
+
+    @contextmanager
+    def _phase(self, phase: str):
+        with WORKFLOW_PHASE_SECONDS.time(phase=phase), start_span(f"workflow.{phase}", phase=phase):
+            yield
+
+    def _run_main_task_loop(self, user_query: str, designated_agent_ids: List[str], overall_goal_desc: str) -> dict:
+        logger.info("--- Starting New Main Task Loop for Query: '%s' ---", user_query)
         
         # 1. Initiate Main Task
-        main_task = self.manager.initiate_main_task(
-            user_query=user_query,
-            designated_agent_ids=designated_agent_ids,
-            overall_goal_desc=overall_goal_desc
-        )
-        print(f"MainTask '{main_task.id}' initiated by {self.manager.name} (ID: {self.manager.id}).")
-
-        max_iterations = 10 # Safeguard against infinite loops
+        with self._phase("initiate"):
+            main_task = self.manager.initiate_main_task(
+                user_query=user_query,
+                designated_agent_ids=designated_agent_ids,
+                overall_goal_desc=overall_goal_desc
+            )
+        logger.info("MainTask '%s' initiated by %s (ID: %s).", main_task.id, self.manager.name, self.manager.id)
+        workflow_span = current_span()
+        if workflow_span:
+            workflow_span.set_attribute("main_task_id", main_task.id) # Indexes the trace for GET /tasks/{main_task_id}/trace
+
+        max_iterations = self.max_iterations # Safeguard against infinite loops
         current_iteration = 0
 
         while main_task.status not in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED] and current_iteration < max_iterations:
             current_iteration += 1
-            print(f"--- Iteration {current_iteration} for MainTask {main_task.id} ---")
-
-            # 2. Plan/Re-plan Subtasks
-            if not main_task.sub_tasks or current_iteration > 1: 
-                print("Planning/Re-planning subtasks...")
-                self.manager.plan_subtasks() 
-                main_task = self.manager._get_main_task() 
-                if not main_task or not main_task.sub_tasks:
-                    print("Planning failed or produced no subtasks. Ending loop.")
-                    # Ensure main_task is not None before accessing status
-                    if main_task: 
-                        main_task.status = TaskStatus.FAILED
-                        self.manager._save_main_task(main_task)
+            with start_span("workflow.iteration", iteration=current_iteration):
+                logger.info("--- Iteration %s for MainTask %s ---", current_iteration, main_task.id)
+
+                # 2. Plan Subtasks (re-planning every iteration would discard completed subtasks)
+                if not main_task.sub_tasks: 
+                    logger.info("Planning subtasks...")
+                    with self._phase("plan"):
+                        self.manager.plan_subtasks()
+                    main_task = self.manager._get_main_task() 
+                    if not main_task or not main_task.sub_tasks:
+                        logger.warning("Planning failed or produced no subtasks. Ending loop.")
+                        # Ensure main_task is not None before accessing status
+                        if main_task: 
+                            self.manager._set_main_task_status(main_task, TaskStatus.FAILED)
+                        else:
+                            # This case should ideally not be reached if plan_subtasks guarantees a main_task or handles its absence.
+                            # However, as a safeguard:
+                            logger.error("Main task became None after planning attempt.")
+                            # We cannot save the main_task if it's None, so we break.
+                            # The status of the original main_task (if it existed before planning) might remain as is,
+                            # or we might need a more robust way to fetch/update it.
+                            # For now, the loop will break.
+                            break 
+                        break
+            
+                # 3. Get Next Synchronous Group of Subtasks
+                with self._phase("select_group"):
+                    executable_group = self.manager.get_next_executable_group()
+                main_task = self.manager._get_main_task() # Re-fetch main_task
+            
+                # Ensure main_task is not None after _get_main_task()
+                if not main_task:
+                    logger.error("Main task is None after trying to get the next executable group. Ending loop.")
+                    break
+
+
+                if not executable_group:
+                    all_done = all(st.status == TaskStatus.COMPLETED for st in main_task.sub_tasks)
+                    if all_done:
+                        logger.info("All subtasks completed. Main task loop finishing.")
+                        self.manager._set_main_task_status(main_task, TaskStatus.COMPLETED)
+                        break 
                     else:
-                        # This case should ideally not be reached if plan_subtasks guarantees a main_task or handles its absence.
-                        # However, as a safeguard:
-                        print("Error: Main task became None after planning attempt.")
-                        # We cannot save the main_task if it's None, so we break.
-                        # The status of the original main_task (if it existed before planning) might remain as is,
-                        # or we might need a more robust way to fetch/update it.
-                        # For now, the loop will break.
+                        logger.warning("No executable group found, but not all tasks are completed. Waiting or ending.")
+                        if any(st.status == TaskStatus.IN_PROGRESS for st in main_task.sub_tasks):
+                                logger.info("Some tasks still in progress. This state should be brief in sync mock.")
+                        else: 
+                                logger.warning("No executable tasks and nothing in progress, but not all tasks complete. Possible deadlock or planning issue.")
+                                self.manager._set_main_task_status(main_task, TaskStatus.FAILED)
                         break 
+
+                logger.info("Next executable group: %s", [st.name for st in executable_group])
+
+                # 4. Execute Subtask Group
+                with self._phase("execute"):
+                    self.manager.execute_subtask_group(executable_group)
+                main_task = self.manager._get_main_task() # Re-fetch after execution
+                if not main_task: # Safeguard
+                    logger.error("Main task became None after executing subtask group. Ending loop.")
                     break
-            
-            # 3. Get Next Synchronous Group of Subtasks
-            executable_group = self.manager.get_next_executable_group()
-            main_task = self.manager._get_main_task() # Re-fetch main_task
-            
-            # Ensure main_task is not None after _get_main_task()
-            if not main_task:
-                print("Error: Main task is None after trying to get the next executable group. Ending loop.")
-                break
-
-
-            if not executable_group:
-                all_done = all(st.status == TaskStatus.COMPLETED for st in main_task.sub_tasks)
-                if all_done:
-                    print("All subtasks completed. Main task loop finishing.")
-                    main_task.status = TaskStatus.COMPLETED
-                    self.manager._save_main_task(main_task)
-                    break 
-                else:
-                    print("No executable group found, but not all tasks are completed. Waiting or ending.")
-                    if any(st.status == TaskStatus.IN_PROGRESS for st in main_task.sub_tasks):
-                            print("Some tasks still in progress. This state should be brief in sync mock.")
-                    else: 
-                            print("No executable tasks and nothing in progress, but not all tasks complete. Possible deadlock or planning issue.")
-                            main_task.status = TaskStatus.FAILED 
-                            self.manager._save_main_task(main_task)
-                    break 
-
-            print(f"Next executable group: {[st.name for st in executable_group]}")
-
-            # 4. Execute Subtask Group
-            self.manager.execute_subtask_group(executable_group)
-            main_task = self.manager._get_main_task() # Re-fetch after execution
-            if not main_task: # Safeguard
-                print("Error: Main task became None after executing subtask group. Ending loop.")
-                break
-
-            # The subtask_group list contains copies of subtasks.
-            # We need to check status from the re-fetched main_task's subtasks.
-            completed_group_ids = []
-            for executed_st_data in executable_group: # executable_group contains Pydantic models
-                # Find the corresponding subtask in the main_task (which is fresh from _get_main_task)
-                # to check its actual status after execution.
-                updated_subtask = next((st for st in main_task.sub_tasks if st.id == executed_st_data.id), None)
-                if updated_subtask and updated_subtask.status == TaskStatus.COMPLETED:
-                    completed_group_ids.append(updated_subtask.id)
+
+                # The subtask_group list contains copies of subtasks.
+                # We need to check status from the re-fetched main_task's subtasks.
+                completed_group_ids = []
+                for executed_st_data in executable_group: # executable_group contains Pydantic models
+                    # Find the corresponding subtask in the main_task (which is fresh from _get_main_task)
+                    # to check its actual status after execution.
+                    updated_subtask = next((st for st in main_task.sub_tasks if st.id == executed_st_data.id), None)
+                    if updated_subtask and updated_subtask.status == TaskStatus.COMPLETED:
+                        completed_group_ids.append(updated_subtask.id)
             
 
-            # 5. Retrospection (after each group)
-            if completed_group_ids:
-                print("Performing retrospection...")
-                self.manager.retrospect(completed_group_ids)
-                main_task = self.manager._get_main_task() # Re-fetch after retrospection
+                # 5. Retrospection (after each group)
+                if completed_group_ids:
+                    logger.info("Performing retrospection...")
+                    with self._phase("retrospect"):
+                        self.manager.retrospect(completed_group_ids)
+                    main_task = self.manager._get_main_task() # Re-fetch after retrospection
+                    if not main_task: # Safeguard
+                        logger.error("Main task became None after retrospection. Ending loop.")
+                        break
+            
+                # 6. Rule Revalidation
+                logger.info("Revalidating rules...")
+                with self._phase("revalidate"):
+                    self.manager.revalidate_rules()
+                main_task = self.manager._get_main_task() # Re-fetch after rule revalidation
                 if not main_task: # Safeguard
-                    print("Error: Main task became None after retrospection. Ending loop.")
+                    logger.error("Main task became None after rule revalidation. Ending loop.")
+                    break
+
+                if main_task.status == TaskStatus.COMPLETED:
+                    logger.info("MainTask %s marked as COMPLETED during iteration.", main_task.id)
                     break
-            
-            # 6. Rule Revalidation
-            print("Revalidating rules...")
-            self.manager.revalidate_rules()
-            main_task = self.manager._get_main_task() # Re-fetch after rule revalidation
-            if not main_task: # Safeguard
-                print("Error: Main task became None after rule revalidation. Ending loop.")
-                break
-
-            if main_task.status == TaskStatus.COMPLETED:
-                print(f"MainTask {main_task.id} marked as COMPLETED during iteration.")
-                break
         
         if main_task and current_iteration >= max_iterations: # Ensure main_task is not None
-            print(f"Reached max iterations ({max_iterations}). Ending loop for MainTask {main_task.id}.")
+            logger.warning("Reached max iterations (%s). Ending loop for MainTask %s.", max_iterations, main_task.id)
             if main_task.status not in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
-                main_task.status = TaskStatus.FAILED 
-                self.manager._save_main_task(main_task)
+                self.manager._set_main_task_status(main_task, TaskStatus.FAILED)
         
         # Ensure main_task is not None before accessing its attributes for the final result
         if not main_task:
-            print("--- Main Task Loop Finished for Query: '{user_query}'. Error: Main task became None. ---")
+            logger.error("--- Main Task Loop Finished for Query: '%s'. Error: Main task became None. ---", user_query)
             return {
                 "main_task_id": "N/A - Main task lost",
                 "status": TaskStatus.FAILED,
@@ -136,7 +175,8 @@ class WorkflowManager:
             }
 
         final_status = main_task.status
-        print(f"--- Main Task Loop Finished for Query: '{user_query}'. Final Status: {final_status} ---")
+        logger.info("--- Main Task Loop Finished for Query: '%s'. Final Status: %s ---", user_query, final_status,
+                    extra={"main_task_id": main_task.id, "iterations": current_iteration})
         return {
             "main_task_id": main_task.id,
             "status": final_status,
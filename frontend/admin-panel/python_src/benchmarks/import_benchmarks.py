@@ -0,0 +1,93 @@
+"""Cold-start import time of the API module.
+
+Each repeat imports the module in a fresh interpreter with -X importtime, so results
+include everything a worker pays before it can serve its first request.
+
+    python -m benchmarks.import_benchmarks --max-ms 800
+    python -m benchmarks.import_benchmarks --module app.agents.manager --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MODULE = "app.main"
+DEFAULT_REPEATS = 5
+DEFAULT_TOP = 15
+# Cold-start target for app.main in milliseconds (median of the repeats)
+IMPORT_TIME_TARGET_MS = float(os.getenv("IMPORT_TIME_TARGET_MS", "1000"))
+# Loaded on first use only; importing app.main must not pull them in
+LAZY_MODULES = ("elasticsearch", "elasticsearch_dsl", "numpy", "redis")
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_once(module: str) -> Dict[str, Any]:
+    # Prints which lazy modules ended up loaded; -X importtime writes the timings to stderr
+    code = f"import sys, {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=_PROJECT_ROOT,
+                               capture_output=True, text=True, check=True)
+    cumulative_us: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            cumulative_us[name.strip()] = int(cumulative)
+    loaded = completed.stdout.strip()
+    return {"total_ms": cumulative_us[module] / 1000, "cumulative_us": cumulative_us,
+            "lazy_modules_loaded": loaded.split(",") if loaded else []}
+
+
+def bench_import(module: str = DEFAULT_MODULE, repeats: int = DEFAULT_REPEATS, top: int = DEFAULT_TOP) -> Dict[str, Any]:
+    runs = [_import_once(module) for _ in range(repeats)]
+    last = runs[-1]["cumulative_us"]
+    # Top-level packages only, so nested imports are not counted twice
+    top_level = sorted(((name, us) for name, us in last.items() if "." not in name and name != module),
+                       key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "repeats": repeats,
+        "median_ms": statistics.median(run["total_ms"] for run in runs),
+        "min_ms": min(run["total_ms"] for run in runs),
+        "lazy_modules_loaded": sorted({name for run in runs for name in run["lazy_modules_loaded"]}),
+        "slowest_packages": [{"package": name, "cumulative_ms": us / 1000} for name, us in top_level],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP)
+    parser.add_argument("--max-ms", type=float, default=IMPORT_TIME_TARGET_MS, help="Fail when the median exceeds this")
+    parser.add_argument("--output", help="Write results as JSON to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    result = bench_import(args.module, args.repeats, args.top)
+    result["timestamp"] = datetime.now(timezone.utc).isoformat()
+    result["environment"] = {"python": platform.python_version(), "platform": platform.platform()}
+    result["target_ms"] = args.max_ms
+    if args.output == "-":
+        json.dump(result, sys.stdout, indent=2)
+    else:
+        print(f"{result['module']}: median {result['median_ms']:.1f} ms, min {result['min_ms']:.1f} ms "
+              f"(target {args.max_ms:.0f} ms, {args.repeats} runs)")
+        for package in result["slowest_packages"]:
+            print(f"{package['package']:>30} {package['cumulative_ms']:>9.1f} ms")
+        if result["lazy_modules_loaded"]:
+            print(f"Lazily imported modules loaded at import time: {', '.join(result['lazy_modules_loaded'])}")
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(result, output_file, indent=2)
+    if result["median_ms"] > args.max_ms or result["lazy_modules_loaded"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Throughput benchmarks for the workflow engine, agent CRUD and rule search paths.
+
+Runs against InMemoryStorageService, so results measure the application code
+(planning, scheduling, serialization, rule scoring) rather than network latency.
+
+    python -m benchmarks.workflow_benchmarks --output results.json
+    python -m benchmarks.workflow_benchmarks --widths 1 8 --depths 4 --rules 0 500 --history 1000
+"""
+import argparse
+import itertools
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import app.agents.base as agents_base
+from app.agents.base import AbstractAgent
+from app.agents.manager import ManagerAgent
+from app.models.task import Rule, SubTask, TaskStatus
+from app.services.in_memory_service import InMemoryStorageService
+from app.workflow_manager import WorkflowManager
+
+DEFAULT_WIDTHS = (1, 4)
+DEFAULT_DEPTHS = (3, 8)
+DEFAULT_RULE_COUNTS = (0, 200)
+DEFAULT_HISTORY_SIZES = (0, 500)
+DEFAULT_REPEATS = 3
+DEFAULT_CRUD_AGENTS = 50
+
+
+class BenchmarkManagerAgent(ManagerAgent):
+    # Plans a layered DAG: `plan_depth` layers of `plan_width` subtasks, each depending on the whole previous layer
+    plan_width: int = 1
+    plan_depth: int = 3
+
+    def plan_subtasks(self) -> Optional[List[SubTask]]:
+        main_task = self._get_main_task()
+        if not main_task:
+            return None
+        previous_layer: List[str] = []
+        for depth in range(self.plan_depth):
+            layer = [SubTask(name=f"Step {depth}.{i}", description=f"Benchmark step {depth}.{i}",
+                             dependencies=list(previous_layer)) for i in range(self.plan_width)]
+            main_task.sub_tasks.extend(layer)
+            previous_layer = [subtask.id for subtask in layer]
+        main_task.applied_rules = self.find_relevant_rules(main_task.user_query)
+        main_task.status = TaskStatus.IN_PROGRESS
+        self._save_main_task(main_task)
+        return main_task.sub_tasks
+
+
+@contextmanager
+def in_memory_storage():
+    service = InMemoryStorageService()
+    previous = agents_base._es_service_instance
+    agents_base._es_service_instance = service # get_es_service() now returns the stand-in
+    try:
+        yield service
+    finally:
+        agents_base._es_service_instance = previous
+
+
+def _rules(count: int) -> List[Rule]:
+    return [Rule(description=f"Rule {i} for report step {i % 17}", actionable_guideline=f"Apply guideline {i}",
+                 context=f"context_{i % 5}", source="benchmark", validation_count=i % 7) for i in range(count)]
+
+
+def _history(size: int) -> List[Dict[str, Any]]:
+    return [{"role": "user" if i % 2 else "agent", "content": f"Turn {i} of the benchmark conversation"} for i in range(size)]
+
+
+def _measure(func: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    # Timed runs first, then one run under tracemalloc for peak memory (tracing slows execution)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": elapsed, "ops_per_sec": repeats / elapsed if elapsed else float("inf"), "peak_memory_bytes": peak}
+
+
+def bench_workflow(width: int, depth: int, rule_count: int, history_size: int, repeats: int) -> Dict[str, Any]:
+    with in_memory_storage() as service:
+        manager = BenchmarkManagerAgent(id="benchmark_manager", plan_width=width, plan_depth=depth,
+                                        config={"history_window": max(history_size, 1)})
+        manager.ltm.learned_rules = _rules(rule_count)
+        manager.stm.history = _history(history_size)
+        service.save_rules(manager.ltm.learned_rules)
+        manager.save_state()
+        runner = WorkflowManager(manager_agent=manager, max_iterations=width * depth + 2)
+
+        completed = []
+        def run_once():
+            result = runner.run_main_task_loop("Generate the benchmark report", [], "Benchmark report")
+            completed.append(result["status"] == TaskStatus.COMPLETED)
+
+        service.calls.clear()
+        measured = _measure(run_once, repeats)
+        runs = repeats + 1
+        return dict(
+            measured,
+            scenario="workflow", width=width, depth=depth, subtasks=width * depth,
+            rules=rule_count, history=history_size, repeats=repeats,
+            completed=all(completed),
+            es_calls_per_workflow=sum(service.calls.values()) / runs,
+            es_calls_by_operation={operation: count / runs for operation, count in sorted(service.calls.items())},
+        )
+
+
+def bench_agent_crud(agent_count: int, rule_count: int, history_size: int, repeats: int) -> List[Dict[str, Any]]:
+    with in_memory_storage() as service:
+        agents = []
+        for i in range(agent_count):
+            agent = AbstractAgent(id=f"benchmark_agent_{i}", name=f"Agent {i}", config={"history_window": max(history_size, 1)})
+            agent.ltm.learned_rules = _rules(rule_count)
+            agent.stm.history = _history(history_size)
+            agents.append(agent)
+
+        operations = {
+            "save_state": lambda: [agent.save_state() for agent in agents],
+            "load_state": lambda: [AbstractAgent(id=agent.id).load_state() for agent in agents],
+            "get_all_agents": lambda: service.get_all_agents(),
+        }
+        results = []
+        for operation, func in operations.items():
+            measured = _measure(func, repeats)
+            per_call = agent_count if operation != "get_all_agents" else 1
+            results.append(dict(
+                measured,
+                scenario="agent_crud", operation=operation, agents=agent_count, rules=rule_count,
+                history=history_size, repeats=repeats,
+                ops_per_sec=measured["ops_per_sec"] * per_call,
+            ))
+        return results
+
+
+def bench_rule_search(rule_count: int, repeats: int) -> List[Dict[str, Any]]:
+    # find_relevant_rules as the planner calls it: through the storage backend, and the agent's local fallback
+    with in_memory_storage() as service:
+        rules = _rules(rule_count)
+        service.save_rules(rules)
+        agent = AbstractAgent(id="benchmark_rules_agent")
+        agent.ltm.learned_rules = rules
+        unavailable = InMemoryStorageService()
+        unavailable.client = None
+
+        def local_fallback():
+            agents_base._es_service_instance = unavailable
+            try:
+                agent.find_relevant_rules("Generate the benchmark report")
+            finally:
+                agents_base._es_service_instance = service
+
+        operations = {
+            "backend": lambda: service.find_relevant_rules("Generate the benchmark report"),
+            "local_fallback": local_fallback,
+        }
+        return [dict(_measure(func, repeats), scenario="rule_search", operation=operation, rules=rule_count, repeats=repeats)
+                for operation, func in operations.items()]
+
+
+def run_suite(widths=DEFAULT_WIDTHS, depths=DEFAULT_DEPTHS, rule_counts=DEFAULT_RULE_COUNTS,
+              history_sizes=DEFAULT_HISTORY_SIZES, repeats: int = DEFAULT_REPEATS,
+              crud_agents: int = DEFAULT_CRUD_AGENTS) -> Dict[str, Any]:
+    workflow_results = [bench_workflow(width, depth, rules, history, repeats)
+                        for width, depth, rules, history in itertools.product(widths, depths, rule_counts, history_sizes)]
+    crud_results = [result for rules, history in itertools.product(rule_counts, history_sizes)
+                    for result in bench_agent_crud(crud_agents, rules, history, repeats)]
+    rule_search_results = [result for rules in rule_counts for result in bench_rule_search(rules, repeats)]
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "workflow": workflow_results,
+        "agent_crud": crud_results,
+        "rule_search": rule_search_results,
+    }
+
+
+def _print_summary(results: Dict[str, Any]):
+    print(f"{'width':>5} {'depth':>5} {'rules':>6} {'history':>7} {'wf/s':>9} {'es calls/wf':>12} {'peak KiB':>9}")
+    for r in results["workflow"]:
+        print(f"{r['width']:>5} {r['depth']:>5} {r['rules']:>6} {r['history']:>7} {r['ops_per_sec']:>9.2f} "
+              f"{r['es_calls_per_workflow']:>12.1f} {r['peak_memory_bytes'] / 1024:>9.0f}")
+    print(f"\n{'operation':>15} {'rules':>6} {'history':>7} {'ops/s':>10} {'peak KiB':>9}")
+    for r in results["agent_crud"]:
+        print(f"{r['operation']:>15} {r['rules']:>6} {r['history']:>7} {r['ops_per_sec']:>10.1f} {r['peak_memory_bytes'] / 1024:>9.0f}")
+    print(f"\n{'rule search':>15} {'rules':>6} {'ops/s':>10} {'peak KiB':>9}")
+    for r in results["rule_search"]:
+        print(f"{r['operation']:>15} {r['rules']:>6} {r['ops_per_sec']:>10.1f} {r['peak_memory_bytes'] / 1024:>9.0f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+    parser.add_argument("--depths", type=int, nargs="+", default=DEFAULT_DEPTHS)
+    parser.add_argument("--rules", type=int, nargs="+", default=DEFAULT_RULE_COUNTS)
+    parser.add_argument("--history", type=int, nargs="+", default=DEFAULT_HISTORY_SIZES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--crud-agents", type=int, default=DEFAULT_CRUD_AGENTS)
+    parser.add_argument("--output", help="Write results as JSON to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("app").setLevel(logging.ERROR) # Keep per-workflow log lines out of the measurements
+    results = run_suite(args.widths, args.depths, args.rules, args.history, args.repeats, args.crud_agents)
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        _print_summary(results)
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
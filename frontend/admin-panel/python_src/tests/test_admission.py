@@ -0,0 +1,144 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+class TestAdmissionController(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertGreater(bucket.try_acquire(), 0.0)
+
+    def test_tenant_rate_limit_is_per_tenant(self):
+        async def scenario():
+            controller = AdmissionController(tenant_rate=0.01, tenant_burst=1)
+            async with controller.admit("tenant_a"):
+                pass
+            with self.assertRaises(AdmissionRejected) as ctx:
+                await controller.acquire("tenant_a")
+            self.assertGreater(ctx.exception.retry_after, 1)
+            async with controller.admit("tenant_b"):
+                pass
+            return controller.metrics()
+
+        metrics = asyncio.run(scenario())
+        self.assertEqual(metrics["admitted"], 2)
+        self.assertEqual(metrics["rejected"], 1)
+
+    def test_tenant_buckets_are_bounded(self):
+        async def scenario():
+            controller = AdmissionController(tenant_rate=0.01, tenant_burst=1, max_tenants=3)
+            for i in range(100): # One request each from many distinct X-Tenant-ID values
+                async with controller.admit(f"tenant_{i}"):
+                    pass
+            return controller
+        controller = asyncio.run(scenario())
+        self.assertEqual(list(controller._buckets), ["tenant_97", "tenant_98", "tenant_99"])
+
+    def test_refilled_tenant_buckets_are_dropped(self):
+        async def scenario():
+            controller = AdmissionController(tenant_rate=1000, tenant_burst=1)
+            async with controller.admit("tenant_a"):
+                pass
+            await asyncio.sleep(0.01) # tenant_a refills
+            async with controller.admit("tenant_b"):
+                pass
+            return controller
+        controller = asyncio.run(scenario())
+        self.assertEqual(list(controller._buckets), ["tenant_b"])
+
+    def test_bounded_concurrency_and_queue(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5, tenant_burst=10)
+            release_first = asyncio.Event()
+            observed = {}
+
+            async def first():
+                async with controller.admit():
+                    await release_first.wait()
+
+            async def second():
+                async with controller.admit():
+                    observed["second_ran"] = True
+
+            first_task = asyncio.create_task(first())
+            await asyncio.sleep(0.01)
+            second_task = asyncio.create_task(second())
+            await asyncio.sleep(0.01)
+            observed["queue_depth"] = controller.metrics()["queue_depth"]
+            with self.assertRaises(AdmissionRejected) as ctx:
+                await controller.acquire() # Queue already holds one waiter
+            observed["reason"] = ctx.exception.reason
+
+            release_first.set()
+            await asyncio.gather(first_task, second_task)
+            observed["metrics"] = controller.metrics()
+            return observed
+
+        observed = asyncio.run(scenario())
+        self.assertEqual(observed["queue_depth"], 1)
+        self.assertEqual(observed["reason"], "Workflow queue is full")
+        self.assertTrue(observed["second_ran"])
+        self.assertEqual(observed["metrics"]["in_flight"], 0)
+        self.assertEqual(observed["metrics"]["admitted"], 2)
+        self.assertGreater(observed["metrics"]["max_wait_seconds"], 0)
+
+    def test_queued_request_times_out(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=5, max_wait=0.05, tenant_burst=10)
+            controller.avg_service_time = 0.01
+            await controller.acquire()
+            with self.assertRaises(AdmissionRejected) as ctx:
+                await controller.acquire()
+            controller.release()
+            return ctx.exception, controller.metrics()
+
+        rejection, metrics = asyncio.run(scenario())
+        self.assertEqual(rejection.reason, "Timed out waiting for a workflow slot")
+        self.assertEqual(metrics["queue_depth"], 0)
+
+    def test_expected_wait_beyond_deadline_rejected_upfront(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=5, max_wait=1, tenant_burst=10)
+            controller.avg_service_time = 10
+            await controller.acquire()
+            with self.assertRaises(AdmissionRejected) as ctx:
+                await controller.acquire()
+            return ctx.exception
+
+        self.assertEqual(asyncio.run(scenario()).reason, "Expected queue wait exceeds the deadline")
+
+    def test_rejected_requests_do_not_use_up_the_tenant_tokens(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=0, max_wait=0.05, tenant_rate=0.01, tenant_burst=2)
+            controller.avg_service_time = 0.01
+            await controller.acquire("tenant_a")
+            with self.assertRaises(AdmissionRejected) as full:
+                await controller.acquire("tenant_a")
+            controller.max_queue = 1
+            with self.assertRaises(AdmissionRejected) as timed_out:
+                await controller.acquire("tenant_a")
+            controller.release()
+            await controller.acquire("tenant_a") # The second token, still there
+            return full.exception, timed_out.exception
+
+        full, timed_out = asyncio.run(scenario())
+        self.assertEqual(full.reason, "Workflow queue is full")
+        self.assertEqual(timed_out.reason, "Timed out waiting for a workflow slot")
+
+    def test_workflow_endpoint_returns_429_with_retry_after(self):
+        controller = AdmissionController(tenant_rate=0.01, tenant_burst=0)
+        with patch.object(main_module, 'workflow_admission', controller):
+            response = TestClient(main_module.app).post(
+                "/workflow/run_main_task",
+                json={"user_query": "Report", "overall_goal_desc": "Report"},
+                headers={"X-Tenant-ID": "busy_tenant"}
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers["retry-after"]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
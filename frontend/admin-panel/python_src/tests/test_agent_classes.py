@@ -1,9 +1,12 @@
 import unittest
+import json
 from unittest.mock import MagicMock, patch # Added patch
 from app.agents.base import AbstractAgent
 from app.agents.manager import ManagerAgent
 from app.models.memory import ShortTermMemory, LongTermMemory
 from app.models.task import MainTask, Goal, SubTask, TaskStatus, Rule # Add these imports
+from app.services.storage import ASYNC_WRITE, READ_YOUR_WRITES, VersionConflict
+from app.agents.merge import merge_agent_state
 
 class TestAgentClasses(unittest.TestCase):
     def test_abstract_agent_creation(self):
@@ -23,6 +26,80 @@ class TestAgentClasses(unittest.TestCase):
         self.assertIsNone(manager.current_main_task_id)
 
 
+    def test_process_message_spills_history_beyond_window(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            mock_service_instance.append_history.return_value = True
+            mock_get_es_service.return_value = mock_service_instance
+
+            agent = AbstractAgent(name="WindowedAgent", config={"history_window": 4, "compact_spilled_history": True})
+            for i in range(5):
+                agent.process_message(f"message {i}")
+
+            self.assertEqual(len(agent.stm.history), 4)
+            self.assertEqual(agent.stm.history_spilled, 6)
+            self.assertEqual(agent.stm.history[0]["content"], "message 3")
+            spilled_seqs = [c.args[2] for c in mock_service_instance.append_history.call_args_list]
+            self.assertEqual(spilled_seqs, [0, 2, 4])
+            self.assertEqual(len(agent.ltm.past_project_iterations), 1) # Spills fold into one rolling entry
+            compaction = agent.ltm.past_project_iterations[0]
+            self.assertEqual((compaction["from_seq"], compaction["to_seq"], compaction["turns"]), (0, 5, 6))
+            self.assertTrue(compaction["summary"].startswith("message 0 | "))
+
+            agent.get_history_page(size=10)
+            mock_service_instance.get_history_page.assert_called_with(agent.id, before_seq=6, size=10)
+
+    def test_compacted_history_keeps_document_size_constant(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            mock_service_instance.append_history.return_value = True
+            mock_get_es_service.return_value = mock_service_instance
+
+            agent = AbstractAgent(name="WindowedAgent", config={"history_window": 4, "compact_spilled_history": True})
+            sizes = []
+            for i in range(400):
+                agent.process_message("message")
+                if i >= 100: # seq numbers have three digits from here on
+                    sizes.append(len(json.dumps(agent._document())))
+            self.assertEqual(len(set(sizes)), 1)
+            self.assertEqual(len(agent.ltm.past_project_iterations), 1)
+
+    def test_merge_keeps_turns_spilled_by_this_writer_out_of_stm(self):
+        def document(turns, spilled, scratchpad=None):
+            agent = AbstractAgent(id="agent_1", config={"history_window": 4})
+            agent.stm.history = [{"role": "user", "content": f"turn {seq}"} for seq in turns]
+            agent.stm.history_spilled = spilled
+            agent.stm.session_id = "session_1"
+            agent.stm.scratchpad = scratchpad or {}
+            return agent._document()
+        base = document(range(4), 0)
+        ours = document(range(2, 6), 2) # Added two turns and spilled the two oldest
+        theirs = document(range(4), 0, scratchpad={"note": "theirs"})
+
+        merged, conflicts = merge_agent_state(base, ours, theirs)
+        self.assertEqual(conflicts, [])
+        self.assertEqual(merged["stm"]["history_spilled"], 2)
+        self.assertEqual([turn["content"] for turn in merged["stm"]["history"]], [f"turn {seq}" for seq in range(2, 6)])
+        self.assertEqual(merged["stm"]["scratchpad"], {"note": "theirs"})
+
+    def test_history_kept_when_spill_fails(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.append_history.return_value = False
+            mock_get_es_service.return_value = mock_service_instance
+
+            agent = AbstractAgent(name="WindowedAgent", config={"history_window": 2})
+            agent.process_message("first")
+            agent.process_message("second")
+
+            self.assertEqual(len(agent.stm.history), 4)
+            self.assertEqual(agent.stm.history_spilled, 0)
+
     # test_manager_planning_mock is outdated as plan_task was removed.
     # New tests for new methods will be added below.
 
@@ -44,7 +121,7 @@ class TestAgentClasses(unittest.TestCase):
             self.assertEqual(manager.current_main_task_id, main_task.id)
             self.assertIn('active_main_task', manager.stm.current_task_data)
             # Check if save_state was called (which in turn calls the mocked service)
-            mock_service_instance.save_agent.assert_called_with(manager)
+            mock_service_instance.save_agent.assert_called_with(manager, policy=ASYNC_WRITE)
 
 
     def test_manager_plan_subtasks(self):
@@ -67,6 +144,45 @@ class TestAgentClasses(unittest.TestCase):
             # Subtasks in STM are dicts after model_dump(), so access as dicts
             self.assertTrue(len(main_task_data_dict.get('sub_tasks', [])) > 0)
 
+    def test_manager_plan_subtasks_attaches_relevant_rules(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            relevant_rule = Rule(description="Design reviews catch issues early", context="planning", actionable_guideline="Review designs", source="test")
+            mock_service_instance.find_relevant_rules.return_value = [relevant_rule]
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent(id="planner_rules_manager_test")
+            manager.initiate_main_task("Develop feature x", [], "Goal for feature x")
+            manager.plan_subtasks()
+            manager.plan_subtasks() # Re-planning must not attach the same rule twice
+
+            main_task = manager._get_main_task()
+            self.assertEqual([rule.id for rule in main_task.applied_rules], [relevant_rule.id])
+            mock_service_instance.find_relevant_rules.assert_called_with("Develop feature x", context=None, k=5)
+
+    def test_find_relevant_rules_scores_locally_without_es(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = None # Elasticsearch unavailable
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent(id="local_rules_manager_test")
+            report_rule = Rule(description="Validate report data", context="planning", actionable_guideline="Check inputs", source="test")
+            other_rule = Rule(description="Unrelated guidance", context="planning", actionable_guideline="Something else", source="test")
+            manager.ltm.learned_rules = [other_rule, report_rule]
+
+            self.assertEqual(manager.find_relevant_rules("Write the report", k=1), [report_rule])
+            mock_service_instance.find_relevant_rules.assert_not_called()
+
+            manager.find_relevant_rules("Write the report")
+            self.assertEqual(manager._rule_scorers.builds, 1) # Unchanged rules reuse the scorer
+            report_rule.validation_count += 1 # Revalidated in place
+            manager.ltm.learned_rules.append(Rule(description="Report layout", context="planning", actionable_guideline="Tables", source="test"))
+            self.assertEqual(len(manager.find_relevant_rules("Write the report")), 3)
+            self.assertEqual(manager._rule_scorers.builds, 2)
+
     def test_manager_get_next_executable_group_simple(self):
         with patch('app.agents.base.get_es_service') as mock_get_es_service:
             mock_service_instance = MagicMock()
@@ -147,6 +263,43 @@ class TestAgentClasses(unittest.TestCase):
             self.assertIsNotNone(manager.ltm.learned_rules[0].last_validated_at)
             mock_service_instance.save_agent.assert_called_with(manager)
 
+    def test_final_task_state_is_written_read_your_writes(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent(id="policy_manager")
+            main_task = manager.initiate_main_task("Test query", [], "Test goal")
+            mock_service_instance.save_agent.assert_called_with(manager, policy=ASYNC_WRITE) # In progress
+            manager._append_task_event(main_task, None, TaskStatus.IN_PROGRESS)
+            self.assertIs(mock_service_instance.append_task_events.call_args.kwargs["policy"], ASYNC_WRITE)
+            main_task.status = TaskStatus.COMPLETED
+            manager._save_main_task(main_task)
+            mock_service_instance.save_agent.assert_called_with(manager, policy=READ_YOUR_WRITES)
+            manager._append_task_event(main_task, None, TaskStatus.COMPLETED)
+            self.assertIs(mock_service_instance.append_task_events.call_args.kwargs["policy"], READ_YOUR_WRITES)
+
+    def test_save_state_is_conditional_and_gives_up_after_retries(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service, \
+             patch('app.agents.base.AGENT_SAVE_MAX_RETRIES', 1):
+            mock_service_instance = MagicMock()
+            mock_get_es_service.return_value = mock_service_instance
+            agent = AbstractAgent(id="contended", name="Mine")
+            mock_service_instance.save_agent.return_value = "1-1"
+            self.assertTrue(agent.save_state())
+            mock_service_instance.save_agent.assert_called_with(agent) # Nothing loaded yet: plain write
+            self.assertEqual(agent.version, "1-1")
+
+            mock_service_instance.save_agent.side_effect = VersionConflict("contended", "1-1", "1-2")
+            mock_service_instance.get_agent.return_value = {**agent.model_dump(mode="json"), "name": "Theirs", "version": "1-2"}
+            agent.name = "Renamed"
+            with self.assertLogs('app.agents.base', level='WARNING') as logs:
+                self.assertFalse(agent.save_state())
+        self.assertEqual([call.kwargs["expected_version"] for call in mock_service_instance.save_agent.call_args_list[1:]], ["1-1", "1-2"])
+        self.assertIn("keeping this writer's name", logs.output[0])
+        self.assertEqual(agent.name, "Renamed")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+import json
+from benchmarks.workflow_benchmarks import in_memory_storage, run_suite
+from benchmarks.import_benchmarks import bench_import
+
+class TestWorkflowBenchmarks(unittest.TestCase):
+    def test_suite_reports_throughput_and_storage_calls(self):
+        results = run_suite(widths=(2,), depths=(2,), rule_counts=(5,), history_sizes=(10,), repeats=1, crud_agents=2)
+        json.dumps(results) # Must be serializable for regression tracking
+
+        workflow = results["workflow"][0]
+        self.assertTrue(workflow["completed"])
+        self.assertEqual(workflow["subtasks"], 4)
+        self.assertGreater(workflow["ops_per_sec"], 0)
+        self.assertGreater(workflow["es_calls_per_workflow"], 0)
+        self.assertGreater(workflow["peak_memory_bytes"], 0)
+        self.assertEqual({r["operation"] for r in results["agent_crud"]}, {"save_state", "load_state", "get_all_agents"})
+        self.assertEqual({r["operation"] for r in results["rule_search"]}, {"backend", "local_fallback"})
+
+    def test_storage_stand_in_is_restored(self):
+        import app.agents.base as agents_base
+        previous = agents_base._es_service_instance
+        with in_memory_storage() as service:
+            self.assertIs(agents_base.get_es_service(), service)
+        self.assertIs(agents_base._es_service_instance, previous)
+
+class TestImportBenchmarks(unittest.TestCase):
+    def test_api_import_defers_heavy_dependencies(self):
+        result = bench_import("app.main", repeats=1)
+        self.assertGreater(result["median_ms"], 0)
+        self.assertEqual(result["lazy_modules_loaded"], [])
+        self.assertTrue(result["slowest_packages"])
+
+if __name__ == '__main__':
+    unittest.main()
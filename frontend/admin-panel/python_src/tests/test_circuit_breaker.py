@@ -0,0 +1,79 @@
+import unittest
+import time
+from unittest.mock import MagicMock, patch
+from elasticsearch import ConnectionError as ESConnectionError, NotFoundError
+from app.services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from app.services.elasticsearch_service import ElasticsearchService
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_consecutive_failures_and_recovers_after_timeout(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.record_success() # Resets the consecutive count
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow()) # One trial call at a time
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker._state, OPEN)
+
+    def test_health_probes_open_and_half_open(self):
+        breaker = CircuitBreaker("test", reset_timeout=60)
+        breaker.record_probe(False)
+        self.assertEqual(breaker.state, OPEN)
+        breaker.record_probe(True)
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+class TestElasticsearchCircuit(unittest.TestCase):
+    def setUp(self):
+        self.service = ElasticsearchService(connect=False)
+        self.service.client = MagicMock()
+        self.service.breaker = CircuitBreaker("elasticsearch", failure_threshold=2, reset_timeout=60)
+
+    def test_transport_errors_open_the_circuit_and_fail_fast(self):
+        with patch('app.services.elasticsearch_service.AgentDocument.get', side_effect=ESConnectionError("down")) as mock_get:
+            self.assertIsNone(self.service.get_agent("agent_1"))
+            self.assertIsNone(self.service.get_agent("agent_1"))
+            self.assertEqual(self.service.breaker.state, OPEN)
+            self.assertIsNone(self.service.get_agent("agent_1"))
+        self.assertEqual(mock_get.call_count, 2) # The third call never reached Elasticsearch
+        self.assertFalse(self.service.available)
+        self.assertEqual(self.service.get_task_events("task_1"), [])
+
+    def test_missing_documents_do_not_count_as_failures(self):
+        not_found = NotFoundError("not found", MagicMock(status=404), {})
+        with patch('app.services.elasticsearch_service.AgentDocument.get', side_effect=not_found):
+            for _ in range(3):
+                self.service.get_agent("missing")
+        self.assertEqual(self.service.breaker.state, CLOSED)
+
+    def test_health_check_reopens_traffic(self):
+        self.service.breaker.record_probe(False)
+        self.service.client.options.return_value.ping.return_value = True
+        self.assertTrue(self.service.check_health())
+        self.assertEqual(self.service.breaker.state, HALF_OPEN)
+        self.service.client.get.return_value = {"_seq_no": 3, "_primary_term": 1}
+        self.assertEqual(self.service.get_agent_version("agent_1"), "1-3")
+        self.assertEqual(self.service.breaker.state, CLOSED)
+
+    def test_health_check_connects_when_never_connected(self):
+        service = ElasticsearchService(connect=False)
+        with patch.object(service, 'connect', return_value=True) as mock_connect:
+            self.assertTrue(service.check_health())
+        mock_connect.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
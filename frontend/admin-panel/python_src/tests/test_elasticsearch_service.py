@@ -1,6 +1,13 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from app.services.elasticsearch_service import ElasticsearchService, AgentDocument, STMDocument, LTMDocument, AGENT_INDEX_NAME
+from contextlib import ExitStack
+from elasticsearch import ConflictError
+from elasticsearch_dsl.response import Response
+from app.services.circuit_breaker import CLOSED
+from app.services.elasticsearch_service import ElasticsearchService, index_settings, agent_location, AgentDocument, STMDocument, LTMDocument, RuleDocument, HistoryDocument, MANAGED_DOCUMENTS, AGENT_INDEX_NAME, RULE_INDEX_NAME, HISTORY_INDEX_NAME, MESSAGE_INDEX_NAME
+from app.models.task import Rule
+from app.services.storage import WritePolicy, VersionConflict, READ_YOUR_WRITES, encode_cursor, decode_cursor
+from app.models.message import ChatMessage
 from app.models.memory import ShortTermMemory, LongTermMemory
 # Using the actual AbstractAgent for test data, but will need to create a concrete version for Pydantic model
 from pydantic import BaseModel, Field # Import Field for default_factory
@@ -55,7 +62,9 @@ class TestElasticsearchService(unittest.TestCase):
         mock_elasticsearch_constructor.assert_called_with("http://mock-es:9200", timeout=30, max_retries=3, retry_on_timeout=True)
         mock_es_client.ping.assert_called_once()
         mock_connections.create_connection.assert_called_with(alias='default', hosts=['http://mock-es:9200'])
-        mock_es_client.indices.exists.assert_called_with(index=AGENT_INDEX_NAME)
+        mock_es_client.indices.exists.assert_any_call(index=AGENT_INDEX_NAME)
+        for document_class in MANAGED_DOCUMENTS:
+            mock_es_client.indices.exists.assert_any_call(index=document_class.Index.name)
 
     @patch('app.services.elasticsearch_service.Elasticsearch')
     def test_service_initialization_ping_fails(self, mock_elasticsearch_constructor):
@@ -63,28 +72,27 @@ class TestElasticsearchService(unittest.TestCase):
         mock_es_client.ping.return_value = False # Simulate ping failure
         mock_elasticsearch_constructor.return_value = mock_es_client
         
-        # Capture print statements by redirecting stdout or using logging assertions
-        # The subtask uses self.assertLogs, which requires actual logging calls in the tested code.
-        # The provided ElasticsearchService uses print(). To test print(), we patch builtins.print.
-        # If ElasticsearchService used logging.error(), then assertLogs would be appropriate.
-        
-        # Let's assume the intent is to check for an error message being printed.
-        with patch('builtins.print') as mock_print:
+        with self.assertLogs('app.services.elasticsearch_service', level='ERROR') as logs:
             service = ElasticsearchService(host="http://mock-es:9200")
-            self.assertIsNone(service.client)
-            # Check if "Failed to connect to Elasticsearch" or similar was printed
-            error_message_printed = False
-            for call_arg in mock_print.call_args_list:
-                if "Elasticsearch connection error" in call_arg[0][0] or "Failed to connect to Elasticsearch" in call_arg[0][0]:
-                    error_message_printed = True
-                    break
-            self.assertTrue(error_message_printed, "Connection failure message was not printed.")
+        self.assertIsNone(service.client)
+        self.assertTrue(any("Failed to connect to Elasticsearch" in line for line in logs.output),
+                        "Connection failure message was not logged.")
+
+
+    @patch('app.services.elasticsearch_service.Elasticsearch')
+    @patch('app.services.elasticsearch_service.connections')
+    def test_deferred_connection(self, mock_connections, mock_elasticsearch_constructor):
+        service = ElasticsearchService(host="http://mock-es:9200", connect=False)
+        self.assertIsNone(service.client)
+        mock_elasticsearch_constructor.assert_not_called()
 
+        mock_elasticsearch_constructor.return_value.ping.return_value = True
+        self.assertTrue(service.connect())
+        self.assertIs(service.client, mock_elasticsearch_constructor.return_value)
 
-    @patch.object(AgentDocument, 'init')
     @patch('app.services.elasticsearch_service.Elasticsearch')
     @patch('app.services.elasticsearch_service.connections')
-    def test_ensure_index_creates_if_not_exists(self, mock_connections, mock_elasticsearch_constructor, mock_agent_doc_init):
+    def test_ensure_index_creates_if_not_exists(self, mock_connections, mock_elasticsearch_constructor):
         mock_es_client = MagicMock()
         mock_es_client.ping.return_value = True
         mock_elasticsearch_constructor.return_value = mock_es_client
@@ -93,11 +101,14 @@ class TestElasticsearchService(unittest.TestCase):
         mock_es_client.indices = mock_indices_client
         mock_indices_client.exists.return_value = False
 
-
-        service = ElasticsearchService(host="http://mock-es:9200")
+        with ExitStack() as stack:
+            mock_inits = [stack.enter_context(patch.object(document_class, 'init')) for document_class in MANAGED_DOCUMENTS]
+            service = ElasticsearchService(host="http://mock-es:9200")
         
         self.assertIsNotNone(service.client)
-        mock_agent_doc_init.assert_called_once() 
+        self.assertIn(AgentDocument, MANAGED_DOCUMENTS)
+        for mock_init in mock_inits:
+            mock_init.assert_called_once()
 
     def test_stm_document_conversion(self):
         pydantic_stm = ShortTermMemory(session_id="test_session", history=[{"msg": "hi"}])
@@ -117,6 +128,209 @@ class TestElasticsearchService(unittest.TestCase):
         pydantic_ltm_converted = dsl_ltm.to_pydantic()
         self.assertEqual(pydantic_ltm_converted.knowledge_base, {"fact": "true"})
         
+    def test_rule_document_conversion(self):
+        rule = Rule(description="Check mocks", context="planning", actionable_guideline="Remove mock flags", source="test", validation_count=3)
+        dsl_rule = RuleDocument.from_pydantic(rule)
+        self.assertEqual(dsl_rule.meta.id, rule.id)
+        self.assertEqual(dsl_rule.rule_id, rule.id)
+        self.assertEqual(dsl_rule.validation_count, 3)
+
+        rule_converted = dsl_rule.to_pydantic()
+        self.assertEqual(rule_converted, rule)
+
+    @patch('app.services.elasticsearch_service.bulk')
+    def test_save_rules_uses_bulk(self, mock_bulk):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        rules = [Rule(description=f"Rule {i}", context="planning", actionable_guideline="g", source="test") for i in range(3)]
+
+        self.assertTrue(service.save_rules(rules))
+        mock_bulk.assert_called_once()
+        actions = list(mock_bulk.call_args[0][1])
+        self.assertEqual([action['_id'] for action in actions], [rule.id for rule in rules])
+        self.assertTrue(all(action['_index'] == RULE_INDEX_NAME for action in actions))
+
+    @patch('app.services.elasticsearch_service.bulk')
+    def test_write_policies_are_passed_to_elasticsearch(self, mock_bulk):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        rule = Rule(description="Rule", context="planning", actionable_guideline="g", source="test")
+
+        service.save_rules([rule])
+        self.assertEqual(mock_bulk.call_args.kwargs, {"refresh": "false"})
+        service.save_rules([rule], policy=WritePolicy(refresh="wait_for", routing="tenant_a", timeout="5s"))
+        self.assertEqual(mock_bulk.call_args.kwargs, {"refresh": "wait_for", "routing": "tenant_a", "timeout": "5s"})
+
+        agent = TestAgentModel(name="Agent")
+        with patch.object(AgentDocument, 'save') as mock_save:
+            self.assertTrue(service.save_agent(agent, policy=READ_YOUR_WRITES))
+        mock_save.assert_called_once_with(refresh="wait_for")
+
+    def test_conditional_save_uses_seq_no_and_primary_term(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        agent = TestAgentModel(name="Agent")
+        with patch.object(AgentDocument, 'save') as mock_save:
+            service.save_agent(agent, expected_version="2-7")
+        mock_save.assert_called_once_with(refresh="false", if_seq_no=7, if_primary_term=2)
+
+        conflict = ConflictError("version_conflict_engine_exception", MagicMock(status=409), {})
+        with patch.object(AgentDocument, 'save', side_effect=conflict), self.assertRaises(VersionConflict):
+            service.save_agent(agent, expected_version="2-7")
+        self.assertEqual(service.breaker.state, CLOSED) # A conflict is not a cluster failure
+
+    def test_routing_by_partition(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        agent = TestAgentModel(id="agent_1", config={"tenant": "acme"})
+        with patch('app.services.elasticsearch_service.ES_AGENT_SHARDING', "routing"):
+            hit = AgentDocument(agent_id="agent_1", name="Found", role="Tester", config={})
+            hit.meta.index, hit.meta.seq_no, hit.meta.primary_term = AGENT_INDEX_NAME, 4, 1
+            with patch.object(AgentDocument, 'search') as mock_search:
+                mock_search.return_value.filter.return_value.params.return_value.__getitem__.return_value.execute.return_value = [hit]
+                self.assertEqual(service.get_agent("agent_1")["version"], "1-4")
+            mock_search.assert_called_once_with(index="agents") # Unknown partition: looked up over the alias
+            self.assertEqual(service._agent_locations["agent_1"], (AGENT_INDEX_NAME, None))
+
+            with patch.object(AgentDocument, 'save') as mock_save:
+                service.save_agent(agent, expected_version="1-4")
+            # Stored unrouted before: written routed, and the old copy removed only if still at its version
+            mock_save.assert_called_once_with(refresh="false", index=AGENT_INDEX_NAME, routing="acme")
+            service.client.options.return_value.delete.assert_called_once_with(id="agent_1", if_seq_no=4, if_primary_term=1, index=AGENT_INDEX_NAME)
+
+            with patch.object(AgentDocument, 'get', return_value=None) as mock_get:
+                service.get_agent("agent_1")
+            mock_get.assert_called_once_with(id="agent_1", index=AGENT_INDEX_NAME, routing="acme")
+
+    def test_index_per_partition(self):
+        with patch('app.services.elasticsearch_service.ES_AGENT_SHARDING', "index"):
+            self.assertEqual(agent_location("Acme Corp"), ("agents_index-acme_corp", None))
+            client = MagicMock()
+            client.indices.exists.return_value = True
+            ElasticsearchService(connect=False)._ensure_index_exists(client)
+            template = client.indices.put_index_template.call_args.kwargs
+            self.assertEqual(template["index_patterns"], ["agents_index-*"])
+            self.assertEqual(template["template"]["aliases"], {"agents": {}})
+            self.assertIn("partition", template["template"]["mappings"]["properties"])
+            client.indices.put_alias.assert_called_once_with(index=AGENT_INDEX_NAME, name="agents")
+
+            service = ElasticsearchService(connect=False)
+            service.client = MagicMock()
+            with patch.object(AgentDocument, 'search') as mock_search:
+                service.get_all_agents(partition="acme")
+            mock_search.assert_called_once_with(index="agents_index-acme")
+
+    def test_fleet_stats_from_one_multi_search(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        def counts(total=0, **aggregations):
+            buckets = {name: {"buckets": [{"key": key, "doc_count": count} for key, count in values.items()]}
+                       for name, values in aggregations.items()}
+            return Response(AgentDocument.search(), {"hits": {"total": {"value": total}, "hits": []}, "aggregations": buckets})
+        responses = [counts(3, by_role={"Generic Agent": 2, "Manager": 1}, history_sizes={0.0: 2, 50.0: 1}),
+                     counts(2, by_context={"planning": 2}),
+                     counts(entered={"in_progress": 2, "completed": 1}, left={"pending": 2, "in_progress": 1})]
+        with patch('app.services.elasticsearch_service.MultiSearch.execute', return_value=responses) as mock_execute:
+            stats = service.get_fleet_stats(bucket_size=50)
+        mock_execute.assert_called_once()
+        self.assertEqual(stats.agents_by_role, {"Generic Agent": 2, "Manager": 1})
+        self.assertEqual(stats.tasks_by_status, {"in_progress": 1, "completed": 1}) # Entered minus left
+        self.assertEqual(stats.rules_total, 2)
+        self.assertEqual([(bucket.min_turns, bucket.agents) for bucket in stats.history_sizes], [(0, 2), (50, 1)])
+
+    def test_task_events_version_from_one_aggregation(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        raw = {"hits": {"total": {"value": 4, "relation": "eq"}, "hits": []}, "aggregations": {"last_seq": {"value": 7.0}}}
+        with patch('elasticsearch_dsl.Search.execute', autospec=True,
+                   side_effect=lambda search: Response(search, raw)) as mock_execute:
+            self.assertEqual(service.get_task_events_version("maintask_1"), (7, 4))
+        body = mock_execute.call_args.args[0].to_dict()
+        self.assertEqual(body["size"], 0)
+        self.assertEqual(body["query"]["bool"]["filter"], [{"term": {"main_task_id": "maintask_1"}}])
+
+    @patch('app.services.elasticsearch_service.bulk', return_value=(1, [{"create": {"_id": "msg_1", "status": 409}}]))
+    def test_index_messages_creates_documents_in_bulk(self, mock_bulk):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        message = ChatMessage(id="msg_1", agent_id="agent_1", session_id="s1", seq=4, role="user", content="hi",
+                              timestamp="2024-01-01T00:00:00+00:00")
+        self.assertTrue(service.index_messages([message])) # Already indexed (409) counts as done
+        action = mock_bulk.call_args.args[1][0]
+        self.assertEqual((action["_op_type"], action["_index"], action["_id"]), ("create", MESSAGE_INDEX_NAME, "msg_1"))
+        self.assertEqual(action["_source"]["message_id"], "msg_1")
+        self.assertNotIn("id", action["_source"])
+
+    def test_search_messages_highlights_and_continues_after_cursor(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        raw = {"hits": {"total": {"value": 12000, "relation": "gte"}, "hits": [{
+            "_index": MESSAGE_INDEX_NAME, "_id": "msg_1", "_score": 2.5, "sort": [2.5, 1704067200000, "msg_1"],
+            "_source": {"message_id": "msg_1", "agent_id": "agent_1", "session_id": "s1", "seq": 4, "role": "user",
+                        "content": "Deploy billing", "timestamp": "2024-01-01T00:00:00+00:00"},
+            "highlight": {"content": ["Deploy <em>billing</em>"]}}]}}
+        with patch('elasticsearch_dsl.Search.execute', autospec=True,
+                   side_effect=lambda search: Response(search, raw)) as mock_execute:
+            page = service.search_messages("billing", agent_id="agent_1", size=1, cursor=encode_cursor([3.0, 1704067300000, "msg_0"]))
+        body = mock_execute.call_args.args[0].to_dict()
+        self.assertEqual(body["search_after"], [3.0, 1704067300000, "msg_0"])
+        self.assertEqual(body["query"]["bool"]["filter"], [{"term": {"agent_id": "agent_1"}}])
+        self.assertEqual(body["highlight"]["fields"]["content"]["encoder"], "html") # Message content is escaped
+        self.assertEqual((page.total, page.total_relation), (12000, "gte"))
+        self.assertEqual(page.hits[0].highlights, ["Deploy <em>billing</em>"])
+        self.assertEqual(page.hits[0].message.id, "msg_1")
+        self.assertEqual(decode_cursor(page.next_cursor), [2.5, 1704067200000, "msg_1"])
+
+    def test_index_settings_are_configurable(self):
+        self.assertEqual(index_settings(AGENT_INDEX_NAME), {"number_of_shards": 1, "number_of_replicas": 0, "refresh_interval": "1s"})
+        self.assertEqual(AgentDocument._index._settings["refresh_interval"], "1s")
+        with patch('app.services.elasticsearch_service.ES_INDEX_SETTINGS', {HISTORY_INDEX_NAME: {"refresh_interval": "30s", "number_of_replicas": 1}}):
+            self.assertEqual(index_settings(HISTORY_INDEX_NAME)["refresh_interval"], "30s")
+            client = MagicMock()
+            client.indices.exists.return_value = True
+            ElasticsearchService(connect=False)._ensure_index_exists(client)
+        client.indices.put_settings.assert_any_call(index=HISTORY_INDEX_NAME, settings={"number_of_replicas": 1, "refresh_interval": "30s"})
+        client.indices.put_settings.assert_any_call(index=AGENT_INDEX_NAME, settings={"number_of_replicas": 0, "refresh_interval": "1s"})
+
+    @patch.object(RuleDocument, 'search')
+    def test_find_relevant_rules_query(self, mock_search):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        rule = Rule(description="Check mocks", context="planning", actionable_guideline="Remove mock flags", source="test")
+        mock_query = mock_search.return_value.query.return_value
+        mock_query.__getitem__.return_value.execute.return_value = [RuleDocument.from_pydantic(rule)]
+
+        results = service.find_relevant_rules("mock flags", context="planning", k=3)
+
+        self.assertEqual(results, [rule])
+        mock_query.__getitem__.assert_called_with(slice(None, 3, None))
+        query_dict = mock_search.return_value.query.call_args[0][0].to_dict()['function_score']
+        self.assertEqual(query_dict['query']['bool']['filter'], [{'term': {'context': 'planning'}}])
+        self.assertEqual(query_dict['functions'][0]['field_value_factor']['field'], 'validation_count')
+
+    @patch('app.services.elasticsearch_service.bulk', return_value=(2, []))
+    def test_append_history_is_append_only(self, mock_bulk):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        entries = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+        self.assertTrue(service.append_history("agent_1", "session_1", 10, entries))
+        actions = mock_bulk.call_args[0][1]
+        self.assertEqual([action['_id'] for action in actions], ["agent_1:10", "agent_1:11"])
+        self.assertTrue(all(action['_op_type'] == 'create' for action in actions))
+        self.assertEqual(actions[1]['_source']['entry'], entries[1])
+
+    @patch('app.services.elasticsearch_service.bulk')
+    def test_append_history_treats_existing_turns_as_spilled(self, mock_bulk):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        entries = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        mock_bulk.return_value = (1, [{"create": {"_id": "agent_1:10", "status": 409}}])
+        self.assertTrue(service.append_history("agent_1", "session_1", 10, entries)) # Spilled again after a failed save
+        self.assertFalse(mock_bulk.call_args.kwargs["raise_on_error"])
+        mock_bulk.return_value = (1, [{"create": {"_id": "agent_1:11", "status": 400}}])
+        self.assertFalse(service.append_history("agent_1", "session_1", 10, entries))
+
     # This test is for AbstractAgent's save_state method, not ElasticsearchService directly.
     # It requires an instance of AbstractAgent or a mock that behaves like it.
     # The subtask description suggests using 'from app.agents.base import AbstractAgent'
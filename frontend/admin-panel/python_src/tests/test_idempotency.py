@@ -0,0 +1,91 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.idempotency import IdempotencyCache, IdempotencyConflict, InMemoryIdempotencyStore, request_fingerprint
+
+class TestIdempotencyCache(unittest.TestCase):
+    def test_concurrent_callers_share_one_execution(self):
+        async def scenario():
+            cache = IdempotencyCache(InMemoryIdempotencyStore(), ttl=60)
+            calls = []
+
+            async def compute():
+                calls.append(1)
+                await asyncio.sleep(0.05)
+                return {"status": "completed"}
+
+            results = await asyncio.gather(*[cache.run("key", "fp", compute) for _ in range(5)])
+            later = await cache.run("key", "fp", compute)
+            return calls, results, later
+
+        calls, results, later = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result == {"status": "completed"} for result in results))
+        self.assertEqual(later, {"status": "completed"})
+
+    def test_failures_are_not_cached(self):
+        async def scenario():
+            cache = IdempotencyCache(InMemoryIdempotencyStore(), ttl=60)
+            attempts = []
+
+            async def flaky():
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise RuntimeError("boom")
+                return {"ok": True}
+
+            with self.assertRaises(RuntimeError):
+                await cache.run("key", "fp", flaky)
+            return await cache.run("key", "fp", flaky), attempts
+
+        result, attempts = asyncio.run(scenario())
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(len(attempts), 2)
+
+    def test_key_reuse_with_different_request_conflicts(self):
+        async def scenario():
+            cache = IdempotencyCache(InMemoryIdempotencyStore(), ttl=60)
+
+            async def compute():
+                return {"ok": True}
+
+            await cache.run("key", request_fingerprint({"q": "a"}), compute)
+            await cache.run("key", request_fingerprint({"q": "b"}), compute)
+
+        with self.assertRaises(IdempotencyConflict):
+            asyncio.run(scenario())
+
+    def test_waits_for_claim_held_elsewhere(self):
+        async def scenario():
+            store = InMemoryIdempotencyStore()
+            cache = IdempotencyCache(store, ttl=60, wait_seconds=0.3)
+            await store.claim("key", 60) # Another process is running this key
+
+            async def compute():
+                raise AssertionError("must not run while another process holds the key")
+
+            with self.assertRaises(IdempotencyConflict):
+                await cache.run("key", "fp", compute)
+
+        asyncio.run(scenario())
+
+    def test_workflow_endpoint_replays_cached_result(self):
+        cache = IdempotencyCache(InMemoryIdempotencyStore(), ttl=60)
+        workflow_result = {"main_task_id": "maintask_1", "status": "completed"}
+        with patch.object(main_module, 'workflow_idempotency', cache), \
+             patch.object(main_module, '_run_workflow', return_value=workflow_result) as mock_run:
+            client = TestClient(main_module.app)
+            body = {"user_query": "Report", "overall_goal_desc": "Report"}
+            first = client.post("/workflow/run_main_task", json=body, headers={"Idempotency-Key": "abc"})
+            retry = client.post("/workflow/run_main_task", json=body, headers={"Idempotency-Key": "abc"})
+            conflict = client.post("/workflow/run_main_task", json=dict(body, user_query="Other"), headers={"Idempotency-Key": "abc"})
+
+        self.assertEqual(first.json(), workflow_result)
+        self.assertEqual(retry.json(), workflow_result)
+        self.assertEqual(conflict.status_code, 409)
+        mock_run.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
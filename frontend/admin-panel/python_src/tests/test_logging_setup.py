@@ -0,0 +1,46 @@
+import unittest
+import json
+import logging
+from app.logging_setup import JsonFormatter, log_sampled
+from app.tracing import TraceContextFilter, start_span
+
+class _CountingArg:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "arg"
+
+class TestLoggingSetup(unittest.TestCase):
+    def test_json_formatter_emits_extra_fields_and_trace_ids(self):
+        record = logging.LogRecord("app.test", logging.INFO, __file__, 1, "Agent %s saved", ("agent_1",), None)
+        record.agent_id = "agent_1"
+        with start_span("request") as span:
+            TraceContextFilter().filter(record)
+
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Agent agent_1 saved")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["agent_id"], "agent_1")
+        self.assertEqual(entry["trace_id"], span.trace_id)
+
+    def test_disabled_levels_do_not_format_arguments(self):
+        logger = logging.getLogger("app.test.lazy")
+        logger.setLevel(logging.INFO)
+        arg = _CountingArg()
+        logger.debug("Rule %s revalidated", arg)
+        log_sampled(logger, logging.DEBUG, "lazy", "Rule %s revalidated", arg, every=1)
+        self.assertEqual(arg.formatted, 0)
+
+    def test_log_sampled_emits_one_in_n(self):
+        logger = logging.getLogger("app.test.sampled")
+        with self.assertLogs(logger, level="DEBUG") as logs:
+            for i in range(25):
+                log_sampled(logger, logging.DEBUG, "sampled_test", "event %s", i, every=10)
+
+        self.assertEqual([record.getMessage() for record in logs.records], ["event 0", "event 10", "event 20"])
+        self.assertTrue(all(record.sample_every == 10 for record in logs.records))
+
+if __name__ == '__main__':
+    unittest.main()
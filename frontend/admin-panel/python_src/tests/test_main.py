@@ -0,0 +1,143 @@
+import unittest
+import time
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.models.task import TaskEvent, TaskStatus
+from app.models.stats import FleetStats
+from app.models.message import MessageSearchPage
+from app.services.elasticsearch_service import ElasticsearchService
+from app.models.memory import ShortTermMemory, LongTermMemory
+
+class TestAgentApi(unittest.TestCase):
+    def setUp(self):
+        self.mock_service_instance = MagicMock()
+        self.mock_service_instance.client = MagicMock()
+        self.mock_service_instance.get_agent.return_value = {
+            "id": "agent_1", "name": "Polled Agent", "role": "Tester", "config": {},
+            "stm": {}, "ltm": {}, "version": "1-5"
+        }
+        self.mock_service_instance.get_agent_version.return_value = "1-5"
+        for target in ('app.agents.base.get_es_service', 'app.main.get_es_service'):
+            patcher = patch(target, return_value=self.mock_service_instance)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(main_module, 'es_service_instance', self.mock_service_instance)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(main_module.app)
+
+    def test_get_agent_returns_etag(self):
+        response = self.client.get("/agents/agent_1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], '"1-5"')
+        self.assertEqual(response.json()["name"], "Polled Agent")
+
+    def test_get_agent_not_modified(self):
+        response = self.client.get("/agents/agent_1", headers={"If-None-Match": '"1-5"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], '"1-5"')
+        self.mock_service_instance.get_agent.assert_not_called()
+
+    def test_get_agent_stale_etag_reloads(self):
+        response = self.client.get("/agents/agent_1", headers={"If-None-Match": 'W/"1-4"'})
+        self.assertEqual(response.status_code, 200)
+        self.mock_service_instance.get_agent.assert_called_once_with("agent_1")
+
+    def test_list_agents_fast_json_path(self):
+        agent_data = dict(self.mock_service_instance.get_agent.return_value, agent_id="agent_1",
+                          stm=ShortTermMemory(session_id="s1").model_dump(), ltm=LongTermMemory().model_dump())
+        self.mock_service_instance.get_all_agents.return_value = [agent_data] * 20
+        default_body = self.client.get("/agents/").json()
+        with patch.object(main_module, 'FAST_JSON_RESPONSES', True):
+            response = self.client.get("/agents/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.json(), default_body)
+
+    def test_stats_are_cached(self):
+        stats = FleetStats(agents_total=1, agents_by_role={"Tester": 1}, tasks_by_status={}, rules_total=0, rules_by_context={},
+                           history_bucket_size=50, history_sizes=[], generated_at="2024-01-01T00:00:00+00:00")
+        self.mock_service_instance.get_fleet_stats.return_value = stats
+        with patch.object(main_module, '_stats_cache', None), patch.object(main_module, 'STATS_CACHE_TTL', 30):
+            first = self.client.get("/stats")
+            second = self.client.get("/stats")
+        self.assertEqual(first.json()["agents_by_role"], {"Tester": 1})
+        self.assertEqual(second.json(), first.json())
+        self.assertIn(second.headers["cache-control"], ("max-age=29", "max-age=30"))
+        self.mock_service_instance.get_fleet_stats.assert_called_once_with()
+
+    def test_search_messages(self):
+        self.mock_service_instance.search_messages.return_value = MessageSearchPage(total=0, hits=[])
+        response = self.client.get("/search/messages", params={"q": "billing", "agent_id": "agent_1", "size": 5})
+        self.assertEqual(response.json(), {"total": 0, "total_relation": "eq", "hits": [], "next_cursor": None})
+        self.mock_service_instance.search_messages.assert_called_once_with("billing", agent_id="agent_1", session_id=None, size=5, cursor=None)
+
+        self.mock_service_instance.search_messages.side_effect = ValueError("Invalid cursor 'x'")
+        self.assertEqual(self.client.get("/search/messages", params={"q": "billing", "cursor": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/search/messages", params={"q": ""}).status_code, 422)
+
+    def test_list_agents_of_one_partition(self):
+        self.mock_service_instance.get_all_agents.return_value = []
+        self.assertEqual(self.client.get("/agents/?partition=acme").json(), [])
+        self.mock_service_instance.get_all_agents.assert_called_once_with(partition="acme")
+
+    def test_task_events_etag(self):
+        event = TaskEvent(main_task_id="maintask_1", seq=3, to_status=TaskStatus.COMPLETED, timestamp="2024-01-01T00:00:00+00:00")
+        self.mock_service_instance.get_task_events.return_value = [event]
+        self.mock_service_instance.get_task_events_version.return_value = (3, 1)
+
+        first = self.client.get("/tasks/maintask_1/events")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()[0]["seq"], 3)
+        second = self.client.get("/tasks/maintask_1/events", headers={"If-None-Match": first.headers["etag"]})
+        self.assertEqual(second.status_code, 304)
+        self.mock_service_instance.get_task_events.assert_called_once() # Revalidation only reads the version
+
+        self.mock_service_instance.get_task_events_version.return_value = (4, 2)
+        third = self.client.get("/tasks/maintask_1/events", headers={"If-None-Match": first.headers["etag"]})
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers["etag"], first.headers["etag"])
+
+class FlakyStorage:
+    # Reachable on the second connection attempt
+    def __init__(self):
+        self.client = None
+        self.attempts = 0
+
+    def connect(self):
+        self.attempts += 1
+        if self.attempts >= 2:
+            self.client = MagicMock()
+        return self.client is not None
+
+class TestHealthEndpoints(unittest.TestCase):
+    def test_readiness_waits_for_storage(self):
+        with patch.object(main_module, 'es_service_instance', FlakyStorage()):
+            client = TestClient(main_module.app)
+            self.assertEqual(client.get("/health/live").status_code, 200)
+            self.assertEqual(client.get("/health/ready").status_code, 503)
+
+    def test_readiness_reports_open_circuit(self):
+        service = ElasticsearchService(connect=False)
+        service.client = MagicMock()
+        service.breaker.record_probe(False)
+        with patch.object(main_module, 'es_service_instance', service):
+            response = TestClient(main_module.app).get("/health/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["circuit"], "open")
+
+    def test_startup_connects_in_background(self):
+        storage = FlakyStorage()
+        with patch('app.main.get_es_service', return_value=storage), \
+             patch.object(main_module, 'es_service_instance', None), \
+             patch.object(main_module, 'STORAGE_CONNECT_RETRY_SECONDS', 0.01):
+            with TestClient(main_module.app) as client:
+                self.assertEqual(client.get("/health/live").json(), {"status": "alive"})
+                deadline = time.monotonic() + 5
+                while client.get("/health/ready").status_code != 200 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(client.get("/health/ready").json()["status"], "ready")
+        self.assertEqual(storage.attempts, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from app.agents.base import AbstractAgent
+from app.models.message import ChatMessage
+from app.services.in_memory_service import InMemoryStorageService
+from app.services.message_buffer import MessageBuffer
+
+def make_message(seq: int) -> ChatMessage:
+    return ChatMessage(agent_id="agent_1", session_id="s1", seq=seq, role="user", content=f"turn {seq}",
+                       timestamp="2024-01-01T00:00:00+00:00")
+
+class TestMessageBuffer(unittest.TestCase):
+    def test_flushes_in_one_bulk_write_and_keeps_failed_batches(self):
+        buffer = MessageBuffer(batch_size=3, max_buffered=10)
+        self.assertFalse(buffer.add(make_message(0), make_message(1)))
+        self.assertTrue(buffer.add(make_message(2)))
+
+        failing = MagicMock()
+        failing.index_messages.return_value = False
+        with self.assertLogs('app.services.message_buffer', level='WARNING'):
+            self.assertEqual(buffer.flush(failing), 0)
+        self.assertEqual(len(buffer), 3)
+
+        backend = InMemoryStorageService()
+        self.assertEqual(buffer.flush(backend), 3)
+        self.assertEqual(backend.calls["index_messages"], 1)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.flush(backend), 0)
+
+    def test_drops_oldest_beyond_capacity(self):
+        buffer = MessageBuffer(batch_size=100, max_buffered=2)
+        with self.assertLogs('app.services.message_buffer', level='WARNING'):
+            buffer.add(make_message(0), make_message(1), make_message(2))
+        self.assertEqual(buffer.dropped, 1)
+        backend = InMemoryStorageService()
+        buffer.flush(backend)
+        self.assertEqual(sorted(hit.message.seq for hit in backend.search_messages("turn").hits), [1, 2])
+
+    def test_process_message_buffers_turns_with_their_history_position(self):
+        backend = InMemoryStorageService()
+        buffer = MessageBuffer(batch_size=4)
+        with patch('app.agents.base.get_es_service', return_value=backend), \
+             patch('app.agents.base.get_message_buffer', return_value=buffer):
+            agent = AbstractAgent(id="chatty", config={"history_window": 2})
+            agent.process_message("first question")
+            self.assertEqual(len(buffer), 2)
+            self.assertEqual(backend.calls["index_messages"], 0) # Batch not full yet
+            agent.process_message("second question") # Fills the batch: written in one bulk call
+
+        self.assertEqual(backend.calls["index_messages"], 1)
+        page = backend.search_messages("second", agent_id="chatty")
+        self.assertEqual(sorted((hit.message.seq, hit.message.role) for hit in page.hits), [(2, "user"), (3, "assistant")])
+        self.assertEqual(page.hits[0].message.session_id, agent.stm.session_id)
+
+if __name__ == '__main__':
+    unittest.main()
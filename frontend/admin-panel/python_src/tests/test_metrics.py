@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+import app.metrics as metrics
+from app.agents.manager import ManagerAgent
+from app.workflow_manager import WorkflowManager
+from app.services.elasticsearch_service import ElasticsearchService
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.MetricsRegistry()
+        histogram = registry.histogram("test_seconds", "Test latency", ("phase",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, phase="plan")
+        histogram.observe(0.5, phase="plan")
+        histogram.observe(5, phase="plan")
+
+        text = registry.render_prometheus()
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertIn('test_seconds_bucket{phase="plan",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{phase="plan",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{phase="plan",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_count{phase="plan"} 3', text)
+
+    def test_disabled_metrics_record_nothing(self):
+        registry = metrics.MetricsRegistry()
+        histogram = registry.histogram("disabled_seconds", "Unused")
+        counter = registry.counter("disabled_total", "Unused")
+        size_fn = MagicMock(return_value=10)
+        with patch.object(metrics, 'METRICS_ENABLED', False):
+            histogram.observe(1.0)
+            with histogram.time():
+                pass
+            counter.inc()
+            metrics.record_es_payload("save_agent", size_fn)
+
+        self.assertEqual(histogram.count(), 0)
+        self.assertEqual(counter.value(), 0)
+        size_fn.assert_not_called()
+
+    def test_es_operation_errors_are_counted(self):
+        service = ElasticsearchService(connect=False)
+        service._agent_versions = {}
+        service.client = MagicMock()
+        before_calls = metrics.ES_OPERATION_SECONDS.count(operation="get_history_page")
+        before_errors = metrics.ES_ERRORS.value(operation="get_history_page")
+        with patch('app.services.elasticsearch_service.HistoryDocument.search', side_effect=RuntimeError("down")):
+            self.assertEqual(service.get_history_page("agent_1"), [])
+
+        self.assertEqual(metrics.ES_OPERATION_SECONDS.count(operation="get_history_page"), before_calls + 1)
+        self.assertEqual(metrics.ES_ERRORS.value(operation="get_history_page"), before_errors + 1)
+
+class TestWorkflowMetrics(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('app.agents.base.get_es_service')
+        mock_get_es_service = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_service_instance = MagicMock()
+        mock_service_instance.client = MagicMock()
+        mock_service_instance.save_agent.return_value = True
+        mock_service_instance.find_relevant_rules.return_value = []
+        mock_get_es_service.return_value = mock_service_instance
+
+    def test_workflow_phases_and_saves_are_recorded(self):
+        phases = ("initiate", "plan", "select_group", "execute", "retrospect", "revalidate")
+        before = {phase: metrics.WORKFLOW_PHASE_SECONDS.count(phase=phase) for phase in phases}
+        before_runs = metrics.WORKFLOW_SAVES.count()
+
+        WorkflowManager(manager_agent=ManagerAgent(id="metrics_test")).run_main_task_loop("Build x", [], "Build x")
+
+        for phase in phases:
+            self.assertGreater(metrics.WORKFLOW_PHASE_SECONDS.count(phase=phase), before[phase], phase)
+        self.assertEqual(metrics.WORKFLOW_SAVES.count(), before_runs + 1)
+        self.assertGreater(metrics.WORKFLOW_SAVES._values[()][1], 0) # Sum of saves across runs
+
+    def test_metrics_endpoint(self):
+        response = TestClient(main_module.app).get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn("# TYPE workflow_phase_seconds histogram", response.text)
+        self.assertIn("workflow_admission_queue_depth 0", response.text)
+
+if __name__ == '__main__':
+    unittest.main()
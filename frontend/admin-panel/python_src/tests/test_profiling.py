@@ -0,0 +1,92 @@
+import unittest
+import time
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.profiling import ProfileSession, ProfileStore
+
+def _busy_work(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+class TestProfileSession(unittest.TestCase):
+    def test_sampler_builds_collapsed_stacks(self):
+        session = ProfileSession("sample", "POST", "/workflow/run_main_task")
+        with session.collect():
+            _busy_work(0.1)
+        profile = session.finish(200)
+
+        self.assertGreater(profile["samples"], 0)
+        self.assertIn("_busy_work", profile["collapsed"])
+        stack, count = profile["collapsed"].splitlines()[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn(";", stack)
+
+    def test_store_keeps_latest_profiles_and_consumes_armed_slots(self):
+        store = ProfileStore(max_profiles=2)
+        for i in range(3):
+            store.add({"id": str(i), "top": [], "collapsed": ""})
+        self.assertEqual([profile["id"] for profile in store.summaries()], ["2", "1"])
+
+        store.arm("cprofile", "/workflow/", count=1)
+        self.assertIsNone(store.take_armed("/agents/"))
+        self.assertEqual(store.take_armed("/workflow/run_main_task"), "cprofile")
+        self.assertIsNone(store.take_armed("/workflow/run_main_task"))
+
+class TestProfilingEndpoints(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('app.agents.base.get_es_service')
+        mock_get_es_service = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_service_instance = MagicMock()
+        mock_service_instance.client = MagicMock()
+        mock_service_instance.get_agent.return_value = None
+        mock_service_instance.save_agent.return_value = True
+        mock_service_instance.find_relevant_rules.return_value = []
+        mock_get_es_service.return_value = mock_service_instance
+        open_patcher = patch.object(main_module, 'PROFILING_OPEN', True) # Local development setup
+        open_patcher.start()
+        self.addCleanup(open_patcher.stop)
+        self.client = TestClient(main_module.app)
+
+    def test_cprofile_header_profiles_workflow_in_threadpool(self):
+        response = self.client.post("/workflow/run_main_task", json={"user_query": "Report", "overall_goal_desc": "Report"},
+                                    headers={"X-Profile": "cprofile"})
+        self.assertEqual(response.status_code, 200)
+        profile = self.client.get(f"/admin/profiles/{response.headers['x-profile-id']}").json()
+
+        self.assertEqual(profile["mode"], "cprofile")
+        self.assertTrue(any("run_main_task_loop" in row["function"] for row in profile["top"]))
+        self.assertIn(profile["id"], [summary["id"] for summary in self.client.get("/admin/profiles").json()])
+
+    def test_armed_profiling_applies_to_next_matching_request(self):
+        armed = self.client.post("/admin/profiling", json={"mode": "sample", "path_prefix": "/workflow/admission", "count": 1})
+        self.assertEqual(armed.status_code, 202)
+
+        first = self.client.get("/workflow/admission")
+        second = self.client.get("/workflow/admission")
+        self.assertIn("x-profile-id", first.headers)
+        self.assertNotIn("x-profile-id", second.headers)
+        collapsed = self.client.get(f"/admin/profiles/{first.headers['x-profile-id']}/collapsed")
+        self.assertEqual(collapsed.status_code, 200)
+        self.assertEqual(self.client.post("/admin/profiling", json={"mode": "trace"}).status_code, 422)
+
+    def test_profiling_closed_by_default_without_admin_token(self):
+        with patch.object(main_module, 'PROFILING_OPEN', False), patch.object(main_module, 'ADMIN_TOKEN', None):
+            self.assertEqual(self.client.get("/admin/profiles").status_code, 403)
+            self.assertEqual(self.client.post("/admin/profiling", json={"mode": "sample"}).status_code, 403)
+            unprofiled = self.client.get("/workflow/admission", headers={"X-Profile": "cprofile"})
+        self.assertNotIn("x-profile-id", unprofiled.headers)
+
+    def test_admin_token_required_when_configured(self):
+        with patch.object(main_module, 'ADMIN_TOKEN', "secret"):
+            self.assertEqual(self.client.get("/admin/profiles").status_code, 403)
+            self.assertEqual(self.client.get("/admin/profiles", headers={"X-Admin-Token": "secret"}).status_code, 200)
+            unprofiled = self.client.get("/workflow/admission", headers={"X-Profile": "cprofile"})
+        self.assertNotIn("x-profile-id", unprofiled.headers)
+
+if __name__ == '__main__':
+    unittest.main()
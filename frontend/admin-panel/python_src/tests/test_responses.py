@@ -0,0 +1,77 @@
+import unittest
+import gzip
+import json
+import time
+from typing import List
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from app.responses import FastJSONResponse, COMPRESSION_MIN_SIZE
+from app.services.elasticsearch_service import AbstractAgentPydantic
+from app.models.memory import ShortTermMemory, LongTermMemory
+from app.models.task import SubTask, TaskStatus
+
+def _agents_data(count=1000):
+    return [{
+        "id": f"agent_{i}", "name": f"Agent {i}", "role": "Worker", "config": {"tier": i % 3},
+        "stm": ShortTermMemory(history=[{"role": "user", "content": f"message {i}"}]).model_dump(),
+        "ltm": LongTermMemory().model_dump()
+    } for i in range(count)]
+
+def _workflow_result(count=1000):
+    sub_tasks = [SubTask(name=f"Step {i}", description="Benchmark step", status=TaskStatus.COMPLETED,
+                         results={"mock_output": f"output {i}"}) for i in range(count)]
+    return {"main_task_id": "maintask_bench", "status": TaskStatus.COMPLETED, "iterations": count,
+            "results": {"summary": "done"}, "subtasks": [st.model_dump() for st in sub_tasks], "learned_rules_count": 1}
+
+def _default_path(content, adapter=None):
+    # What FastAPI does without the fast path: response_model validation, jsonable_encoder, json.dumps
+    if adapter is not None:
+        content = adapter.dump_python(adapter.validate_python(content))
+    return json.dumps(jsonable_encoder(content)).encode()
+
+def _time(fn, iterations=3):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+class TestFastJSONResponse(unittest.TestCase):
+    def test_renders_models_and_enums(self):
+        response = FastJSONResponse({"status": TaskStatus.COMPLETED, "subtask": SubTask(id="st", name="n", description="d")})
+        body = orjson.loads(response.body)
+        self.assertEqual(body["status"], "completed")
+        self.assertEqual(body["subtask"]["id"], "st")
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_compression_negotiation(self):
+        content = _workflow_result(50)
+        plain = FastJSONResponse(content)
+        gzipped = FastJSONResponse(content, accept_encoding="deflate, gzip;q=0.8")
+        refused = FastJSONResponse(content, accept_encoding="gzip;q=0")
+        small = FastJSONResponse({"ok": True}, accept_encoding="gzip")
+
+        self.assertGreater(len(plain.body), COMPRESSION_MIN_SIZE)
+        self.assertEqual(gzipped.headers["content-encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gzipped.body), plain.body)
+        self.assertEqual(int(gzipped.headers["content-length"]), len(gzipped.body))
+        self.assertNotIn("content-encoding", refused.headers)
+        self.assertNotIn("content-encoding", small.headers)
+
+    def test_benchmark_1k_agents_and_1k_subtasks(self):
+        agents = _agents_data()
+        adapter = TypeAdapter(List[AbstractAgentPydantic])
+        result = _workflow_result()
+        self.assertEqual(orjson.loads(FastJSONResponse(agents).body), json.loads(_default_path(agents, adapter)))
+
+        for label, default_fn, fast_fn in (
+            ("1k agents", lambda: _default_path(agents, adapter), lambda: FastJSONResponse(agents).body),
+            ("1k subtasks", lambda: _default_path(result), lambda: FastJSONResponse(result).body),
+        ):
+            default_time, fast_time = _time(default_fn), _time(fast_fn)
+            print(f"\n{label}: default {default_time * 1000:.1f} ms, FastJSONResponse {fast_time * 1000:.1f} ms")
+            self.assertLess(fast_time, default_time)
+
+if __name__ == '__main__':
+    unittest.main()
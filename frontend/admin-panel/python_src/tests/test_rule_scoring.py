@@ -0,0 +1,94 @@
+import unittest
+import time
+from datetime import datetime, timedelta, timezone
+from app.models.task import Rule
+from app.services.rule_scoring import RuleScorer, RuleScorerCache
+from app.services.in_memory_service import InMemoryStorageService
+
+class TestRuleScoring(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.report_rule = Rule(description="Validate data sources before writing a report", context="planning", actionable_guideline="Check report inputs", source="test")
+        self.feature_rule = Rule(description="Design reviews for every new feature", context="planning", actionable_guideline="Review feature designs", source="test")
+        self.mock_rule = Rule(description="Review outcomes of mock execution", context="task_review", actionable_guideline="Remove mock flags", source="test")
+        self.rules = [self.report_rule, self.feature_rule, self.mock_rule]
+
+    def test_feature_arrays_shape(self):
+        scorer = RuleScorer(self.rules, now=self.now)
+        self.assertEqual(scorer.token_vectors.shape, (3, 256))
+        self.assertEqual(scorer.context_one_hot.shape, (3, 2))
+        self.assertEqual(scorer.score("anything").shape, (3,))
+
+    def test_top_k_ranks_by_text_match(self):
+        scorer = RuleScorer(self.rules, now=self.now)
+        self.assertEqual(scorer.top_k("Generate the quarterly report", k=1), [self.report_rule])
+        self.assertEqual(scorer.top_k("Develop feature x", k=1), [self.feature_rule])
+
+    def test_context_and_validation_break_ties(self):
+        validated = Rule(description="Same text", context="planning", actionable_guideline="g", source="test",
+                         validation_count=10, last_validated_at=(self.now - timedelta(days=1)).isoformat())
+        unvalidated = Rule(description="Same text", context="planning", actionable_guideline="g", source="test")
+        other_context = Rule(description="Same text", context="efficiency", actionable_guideline="g", source="test")
+        scorer = RuleScorer([unvalidated, other_context, validated], now=self.now)
+
+        self.assertEqual(scorer.top_k("same text", k=3)[0], validated)
+        self.assertEqual(scorer.top_k("same text", context="efficiency", k=1), [other_context])
+
+    def test_top_k_bounds(self):
+        self.assertEqual(RuleScorer([]).top_k("query"), [])
+        self.assertEqual(len(RuleScorer(self.rules).top_k("query", k=10)), 3)
+
+    def test_find_relevant_rules_scores_thousands_of_rules_from_cache(self):
+        rules = [Rule(description=f"Rule number {i} about topic {i % 50}", context=f"context_{i % 7}",
+                      actionable_guideline=f"Guideline {i}", source="bench", validation_count=i % 13) for i in range(5000)]
+        service = InMemoryStorageService()
+        service.save_rules(rules)
+
+        start = time.perf_counter()
+        service.find_relevant_rules("guideline about topic 7", k=10) # Builds the scorer
+        first_query = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(10):
+            top = service.find_relevant_rules("guideline about topic 7", k=10)
+        cached_query = (time.perf_counter() - start) / 10
+
+        self.assertEqual(len(top), 10)
+        self.assertEqual(service._rule_scorers.builds, 1)
+        self.assertLess(cached_query, first_query) # Relative cost: no rebuild per call
+
+class TestRuleScorerCache(unittest.TestCase):
+    def setUp(self):
+        self.rules = [Rule(description="Cache report data", context="report", actionable_guideline="g", source="test")]
+
+    def test_builds_once_per_key_until_cleared(self):
+        cache = RuleScorerCache()
+        first = cache.get("report", lambda: self.rules)
+        self.assertIs(cache.get("report", lambda: self.rules), first)
+        cache.get("other", lambda: [])
+        self.assertEqual(cache.builds, 2)
+        cache.clear()
+        self.assertIsNot(cache.get("report", lambda: self.rules), first)
+        self.assertEqual(cache.builds, 3)
+
+    def test_entries_expire_and_are_bounded(self):
+        cache = RuleScorerCache(max_age=0)
+        cache.get("report", lambda: self.rules)
+        cache.get("report", lambda: self.rules)
+        self.assertEqual(cache.builds, 2)
+        cache = RuleScorerCache(max_entries=1)
+        cache.get("report", lambda: self.rules)
+        cache.get("other", lambda: [])
+        cache.get("report", lambda: self.rules)
+        self.assertEqual(cache.builds, 3)
+
+    def test_scorer_built_while_rules_change_is_not_cached(self):
+        cache = RuleScorerCache()
+        def load_rules():
+            cache.clear() # save_rules runs meanwhile
+            return self.rules
+        cache.get("report", load_rules)
+        cache.get("report", lambda: self.rules)
+        self.assertEqual(cache.builds, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.agents.base import AbstractAgent
+from app.agents.manager import ManagerAgent
+from app.services.in_memory_service import InMemoryStorageService
+from app.storage_accounting import StorageBudgetExceeded, accounted, storage_accounting
+from app.workflow_manager import WorkflowManager
+
+# Storage calls of one "Generate the weekly report" run (3 subtasks). Raise these only when a change
+# needs the extra round-trips; lower them when a change removes some.
+WORKFLOW_CALL_BUDGET = 30
+WORKFLOW_MANAGER_SAVE_BUDGET = 17
+
+class TestStorageAccounting(unittest.TestCase):
+    def test_counts_calls_keys_and_written_bytes(self):
+        service = MagicMock()
+        self.assertIs(accounted(service), service) # No scope active: no wrapping
+        agent = AbstractAgent(id="agent_1")
+        with storage_accounting("outer", mode="off") as outer, storage_accounting("inner", mode="off") as inner:
+            storage = accounted(service)
+            storage.save_agent(agent)
+            storage.get_agent("agent_1")
+            self.assertIs(storage.client, service.client)
+
+        service.save_agent.assert_called_once_with(agent)
+        for usage in (outer, inner):
+            self.assertEqual(usage.total_calls, 2)
+            self.assertEqual(usage.bytes["save_agent"], len(agent.model_dump_json()))
+            self.assertEqual(usage.bytes["get_agent"], 0)
+            self.assertEqual(usage.keyed_calls[("get_agent", "agent_1")], 1)
+
+    def test_budget_modes(self):
+        service = MagicMock()
+        with self.assertRaises(StorageBudgetExceeded) as raised:
+            with storage_accounting("workflow", max_calls=2, max_repeats=1, mode="raise"):
+                for _ in range(3):
+                    accounted(service).save_agent(AbstractAgent(id="manager"))
+        self.assertEqual(raised.exception.usage.total_calls, 3)
+        self.assertEqual(len(raised.exception.violations), 2)
+
+        with self.assertLogs("app.storage_accounting", level="WARNING"):
+            with storage_accounting("workflow", max_calls=0, mode="warn"):
+                accounted(service).get_all_agents()
+
+    def test_workflow_reports_usage_within_budget(self):
+        backend = InMemoryStorageService()
+        with patch('app.agents.base.get_es_service', return_value=backend), \
+             storage_accounting("test", max_calls=WORKFLOW_CALL_BUDGET, max_repeats=WORKFLOW_MANAGER_SAVE_BUDGET, mode="raise"):
+            result = WorkflowManager(manager_agent=ManagerAgent(id="budget_manager")).run_main_task_loop(
+                "Generate the weekly report", [], "Report")
+
+        storage_ops = result["storage_ops"]
+        self.assertEqual(storage_ops["calls"], sum(backend.calls.values()))
+        self.assertEqual(storage_ops["by_operation"]["save_agent"]["calls"], backend.calls["save_agent"])
+        self.assertGreater(storage_ops["bytes_written"], 0)
+        self.assertEqual(storage_ops["repeated"][0]["key"], "budget_manager")
+
+    def test_request_storage_calls_header(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_get_es_service.return_value.get_agent.return_value = None
+            response = TestClient(main_module.app).get("/agents/unknown")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.headers["x-storage-calls"], "1")
+
+if __name__ == '__main__':
+    unittest.main()
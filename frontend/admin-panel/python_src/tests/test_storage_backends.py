@@ -0,0 +1,275 @@
+import unittest
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+from app.agents.base import AbstractAgent
+from app.agents.manager import ManagerAgent
+from app.models.task import Rule, TaskEvent, TaskStatus
+from app.models.message import ChatMessage
+from app.services.in_memory_service import InMemoryStorageService
+from app.services.sqlite_service import SQLiteStorageService
+from app.services.storage import StorageBackend, VersionConflict, create_storage_backend
+from app.workflow_manager import WorkflowManager
+
+class StorageBackendContract:
+    # Behaviour every backend must share; subclasses provide make_backend()
+    def make_backend(self) -> StorageBackend:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def test_implements_protocol(self):
+        self.assertIsInstance(self.backend, StorageBackend)
+        self.assertTrue(self.backend.client)
+
+    def test_agent_round_trip_and_versions(self):
+        agent = AbstractAgent(id="agent_1", name="Agent 1")
+        agent.stm.history.append({"role": "user", "content": "hi"})
+        self.assertTrue(self.backend.save_agent(agent))
+        first_version = self.backend.get_agent_version("agent_1")
+        self.backend.save_agent(agent)
+
+        agent_data = self.backend.get_agent("agent_1")
+        self.assertEqual(agent_data["id"], "agent_1")
+        self.assertEqual(agent_data["stm"]["history"], [{"role": "user", "content": "hi"}])
+        self.assertEqual(agent_data["version"], self.backend.get_agent_version("agent_1"))
+        self.assertNotEqual(agent_data["version"], first_version)
+        self.assertIsNone(self.backend.get_agent("missing"))
+        self.assertEqual([data["id"] for data in self.backend.get_all_agents()], ["agent_1"])
+
+        loaded = AbstractAgent(id="agent_1")
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            self.assertTrue(loaded.load_state())
+        self.assertEqual(loaded.name, "Agent 1")
+
+    def test_conditional_save_detects_concurrent_writes(self):
+        agent = AbstractAgent(id="agent_1")
+        first_version = self.backend.save_agent(agent)
+        self.assertEqual(first_version, self.backend.get_agent_version("agent_1"))
+        second_version = self.backend.save_agent(agent, expected_version=first_version)
+        self.assertEqual(second_version, self.backend.get_agent_version("agent_1"))
+        with self.assertRaises(VersionConflict) as raised:
+            self.backend.save_agent(agent, expected_version=first_version)
+        self.assertEqual(raised.exception.current_version, second_version)
+        with self.assertRaises(VersionConflict):
+            self.backend.save_agent(AbstractAgent(id="missing"), expected_version=first_version)
+
+    def test_concurrent_agents_merge_appends_instead_of_overwriting(self):
+        self.backend.save_agent(AbstractAgent(id="shared", name="Shared"))
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            first, second = AbstractAgent(id="shared"), AbstractAgent(id="shared")
+            first.load_state()
+            second.load_state()
+            first.process_message("from first")
+            first.ltm.learned_rules.append(Rule(id="rule_first", description="d", actionable_guideline="g", context="c", source="test"))
+            first.stm.current_task_data["step"] = "first"
+            self.assertTrue(first.save_state())
+            second.ltm.learned_rules.append(Rule(id="rule_second", description="d", actionable_guideline="g", context="c", source="test"))
+            second.stm.scratchpad["note"] = "second"
+            second.process_message("from second") # Its save conflicts, merges and retries
+
+            stored = AbstractAgent(id="shared")
+            stored.load_state()
+        self.assertEqual([turn["content"] for turn in stored.stm.history if turn["role"] == "user"], ["from first", "from second"])
+        self.assertEqual([rule.id for rule in stored.ltm.learned_rules], ["rule_first", "rule_second"])
+        self.assertEqual(stored.stm.current_task_data, {"step": "first"})
+        self.assertEqual(stored.stm.scratchpad, {"note": "second"})
+        self.assertEqual(second.version, stored.version)
+        self.assertEqual(second.stm.history, stored.stm.history)
+
+    def test_concurrent_merge_keeps_spilled_turns_out_of_stm(self):
+        self.backend.save_agent(AbstractAgent(id="shared", config={"history_window": 4}))
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            first, second = AbstractAgent(id="shared"), AbstractAgent(id="shared")
+            first.load_state()
+            second.load_state()
+            first.stm.scratchpad["note"] = "first"
+            first.save_state()
+            second.append_history(*[{"role": "user", "content": f"message {i}"} for i in range(6)]) # Spills two turns
+            self.assertTrue(second.save_state()) # Conflicts with the first save and merges
+            stored = AbstractAgent(id="shared")
+            stored.load_state()
+        self.assertEqual(stored.stm.history_spilled, 2)
+        self.assertEqual(len(stored.stm.history), 4)
+        self.assertEqual(stored.stm.history[0]["content"], "message 2")
+        self.assertEqual(stored.stm.scratchpad, {"note": "first"})
+
+    def test_concurrent_managers_keep_their_own_main_task(self):
+        self.backend.save_agent(ManagerAgent(id="shared_manager"))
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            first, second = ManagerAgent(id="shared_manager"), ManagerAgent(id="shared_manager")
+            first.load_state()
+            second.load_state()
+            first_task = first.initiate_main_task("Generate the weekly report", [], "Report")
+            second_task = second.initiate_main_task("Build feature X", [], "Feature") # Conflicts and merges
+            first.revalidate_rules()
+            first.save_state() # Conflicts with the second manager's task
+        self.assertEqual(first._get_main_task().id, first_task.id)
+        self.assertEqual(second._get_main_task().id, second_task.id)
+
+    def test_concurrent_workflows_on_one_manager(self):
+        self.backend.save_agent(ManagerAgent(id="shared_manager"))
+        results = []
+        def run(query):
+            manager = ManagerAgent(id="shared_manager")
+            manager.load_state()
+            results.append(WorkflowManager(manager_agent=manager).run_main_task_loop(query, [], "Goal"))
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            for _ in range(5):
+                threads = [threading.Thread(target=run, args=(query,)) for query in ("Generate the weekly report", "Build feature X")]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        self.assertEqual([result["status"] for result in results], [TaskStatus.COMPLETED] * 10)
+
+    def test_get_all_agents_of_one_partition(self):
+        self.backend.save_agent(AbstractAgent(id="acme_agent", config={"tenant": "acme"}))
+        self.backend.save_agent(AbstractAgent(id="default_agent"))
+        self.assertEqual([data["id"] for data in self.backend.get_all_agents(partition="acme")], ["acme_agent"])
+        self.assertEqual([data["id"] for data in self.backend.get_all_agents(partition="default")], ["default_agent"])
+        with patch('app.services.storage.AGENT_PARTITION_BY', "role"):
+            self.assertEqual(len(self.backend.get_all_agents(partition="Generic Agent")), 2)
+
+    def test_fleet_stats(self):
+        manager = ManagerAgent(id="manager_1")
+        manager.stm.history = [{"role": "user", "content": "hi"}] * 3
+        manager.stm.history_spilled = 60
+        for agent in (manager, AbstractAgent(id="worker_1"), AbstractAgent(id="worker_2")):
+            self.backend.save_agent(agent)
+        self.backend.save_rules([Rule(description="d", actionable_guideline="g", context=context, source="test")
+                                 for context in ("planning", "planning", "report")])
+        transitions = [("task_1", 1, None, TaskStatus.PENDING, TaskStatus.IN_PROGRESS),
+                       ("task_1", 2, "subtask_1", TaskStatus.PENDING, TaskStatus.FAILED), # Subtask events do not count
+                       ("task_1", 3, None, TaskStatus.IN_PROGRESS, TaskStatus.COMPLETED),
+                       ("task_2", 1, None, TaskStatus.PENDING, TaskStatus.IN_PROGRESS)]
+        self.backend.append_task_events([TaskEvent(main_task_id=task_id, seq=seq, subtask_id=subtask_id, from_status=from_status,
+                                                   to_status=to_status, timestamp="2024-01-01T00:00:00+00:00")
+                                         for task_id, seq, subtask_id, from_status, to_status in transitions])
+
+        stats = self.backend.get_fleet_stats(bucket_size=50)
+        self.assertEqual(stats.agents_total, 3)
+        self.assertEqual(stats.agents_by_role, {"Generic Agent": 2, "Manager": 1})
+        self.assertEqual(stats.tasks_by_status, {"completed": 1, "in_progress": 1})
+        self.assertEqual((stats.rules_total, stats.rules_by_context), (3, {"planning": 2, "report": 1}))
+        self.assertEqual([(bucket.min_turns, bucket.agents) for bucket in stats.history_sizes], [(0, 2), (50, 1)])
+
+    def test_fleet_stats_count_workflow_outcomes(self):
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            manager = ManagerAgent(id="stats_manager")
+            WorkflowManager(manager_agent=manager).run_main_task_loop("Generate the weekly report", [], "Report")
+            failed = WorkflowManager(manager_agent=manager, max_iterations=1).run_main_task_loop("Generate the monthly report", [], "Report")
+            manager.initiate_main_task("Build feature X", [], "Feature")
+            manager.plan_subtasks()
+        self.assertEqual(failed["status"], TaskStatus.FAILED)
+        stats = self.backend.get_fleet_stats(bucket_size=50)
+        self.assertEqual(stats.tasks_by_status, {"completed": 1, "failed": 1, "in_progress": 1})
+
+    def test_message_search_highlights_and_pages(self):
+        messages = [ChatMessage(id=f"msg_{i}", agent_id="agent_1" if i < 3 else "agent_2", session_id="s1", seq=i, role="user",
+                                content=f"Deploy the billing service, attempt {i}", timestamp=f"2024-01-01T00:00:0{i}+00:00")
+                    for i in range(4)]
+        messages.append(ChatMessage(id="msg_other", agent_id="agent_1", session_id="s1", seq=9, role="assistant",
+                                    content="Unrelated answer", timestamp="2024-01-01T00:00:09+00:00"))
+        self.assertTrue(self.backend.index_messages(messages))
+        self.assertTrue(self.backend.index_messages(messages[:1])) # Re-sent turns are not duplicated
+
+        first = self.backend.search_messages("billing", size=3)
+        self.assertEqual(first.total, 4)
+        self.assertIn("<em>billing</em>", first.hits[0].highlights[0])
+        second = self.backend.search_messages("billing", size=3, cursor=first.next_cursor)
+        self.assertIsNone(second.next_cursor)
+        self.assertEqual(sorted(hit.message.id for hit in first.hits + second.hits), ["msg_0", "msg_1", "msg_2", "msg_3"])
+        self.assertEqual(self.backend.search_messages("billing", agent_id="agent_2").hits[0].message.id, "msg_3")
+        self.assertEqual(self.backend.search_messages("nothing").total, 0)
+        with self.assertRaises(ValueError):
+            self.backend.search_messages("billing", cursor="not-a-cursor")
+
+    def test_message_search_highlights_are_escaped(self):
+        self.backend.index_messages([ChatMessage(id="msg_xss", agent_id="agent_1", session_id="s1", seq=0, role="user",
+                                                 content="<script>alert('billing')</script> & billing", timestamp="2024-01-01T00:00:00+00:00")])
+        highlight = self.backend.search_messages("billing").hits[0].highlights[0]
+        self.assertNotIn("<script>", highlight)
+        self.assertEqual(highlight, "&lt;script&gt;alert(&#x27;<em>billing</em>&#x27;)&lt;/script&gt; &amp; <em>billing</em>")
+
+    def test_rules(self):
+        self.backend.save_rules([
+            Rule(id="rule_1", description="Cache report data", actionable_guideline="Reuse data", context="report", source="test"),
+            Rule(id="rule_2", description="Unrelated rule", actionable_guideline="Other", context="deploy", source="test")])
+        self.backend.save_rules([Rule(id="rule_1", description="Cache report data", actionable_guideline="Reuse data",
+                                      context="report", source="test", validation_count=3)])
+        top = self.backend.find_relevant_rules("report data", k=1)
+        self.assertEqual([(rule.id, rule.validation_count) for rule in top], [("rule_1", 3)])
+        self.assertEqual([rule.id for rule in self.backend.find_relevant_rules("rule", context="deploy")], ["rule_2"])
+
+    def test_rule_scorer_is_reused_until_rules_are_saved(self):
+        self.backend.save_rules([Rule(id="rule_1", description="Cache report data", actionable_guideline="Reuse data", context="report", source="test")])
+        for _ in range(3):
+            self.backend.find_relevant_rules("report data")
+        self.assertEqual(self.backend._rule_scorers.builds, 1)
+        self.backend.save_rules([Rule(id="rule_2", description="Report layout", actionable_guideline="Use tables", context="report", source="test")])
+        self.assertEqual(len(self.backend.find_relevant_rules("report data")), 2)
+        self.assertEqual(self.backend._rule_scorers.builds, 2)
+
+    def test_history_pages_and_is_append_only(self):
+        self.backend.append_history("agent_1", "session", 0, [{"content": f"turn {i}"} for i in range(5)])
+        self.assertTrue(self.backend.append_history("agent_1", "session", 4, [{"content": "overwrite"}])) # Already spilled: kept
+        self.assertEqual(self.backend.get_history_page("agent_1", before_seq=4, size=2), [{"content": "turn 2"}, {"content": "turn 3"}])
+        self.assertEqual(self.backend.get_history_page("agent_1", size=1), [{"content": "turn 4"}])
+
+    def test_task_events(self):
+        events = [TaskEvent(main_task_id="task_1", seq=seq, to_status=TaskStatus.COMPLETED,
+                            timestamp="2024-01-01T00:00:00+00:00") for seq in (2, 1, 3)]
+        self.assertTrue(self.backend.append_task_events(events))
+        self.assertEqual([event.seq for event in self.backend.get_task_events("task_1", after_seq=1)], [2, 3])
+        self.assertEqual(self.backend.get_task_events("other"), [])
+        self.assertEqual(self.backend.get_task_events_version("task_1"), (3, 3))
+        self.assertEqual(self.backend.get_task_events_version("other"), (0, 0))
+
+    def test_workflow_runs_on_backend(self):
+        with patch('app.agents.base.get_es_service', return_value=self.backend):
+            manager = ManagerAgent(id="backend_manager")
+            result = WorkflowManager(manager_agent=manager).run_main_task_loop("Generate the weekly report", [], "Report")
+            reloaded = ManagerAgent(id="backend_manager")
+            self.assertTrue(reloaded.load_state())
+            timeline = reloaded.get_task_timeline(result["main_task_id"])
+
+        self.assertEqual(result["status"], TaskStatus.COMPLETED)
+        self.assertEqual(timeline[-1].to_status, TaskStatus.COMPLETED)
+
+class TestInMemoryStorageService(StorageBackendContract, unittest.TestCase):
+    def make_backend(self):
+        return InMemoryStorageService()
+
+class TestSQLiteStorageService(StorageBackendContract, unittest.TestCase):
+    def make_backend(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        backend = SQLiteStorageService(os.path.join(tmp_dir.name, "agents.db"))
+        self.addCleanup(backend.client.close)
+        return backend
+
+    def test_uses_wal_journal(self):
+        self.assertEqual(self.backend.client.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_data_survives_reopen(self):
+        self.backend.save_agent(AbstractAgent(id="durable", name="Durable"))
+        reopened = SQLiteStorageService(self.backend.path)
+        self.assertEqual(reopened.get_agent("durable")["name"], "Durable")
+        reopened.client.close()
+
+class TestCreateStorageBackend(unittest.TestCase):
+    def test_selects_backend_by_name(self):
+        self.assertIsInstance(create_storage_backend("memory"), InMemoryStorageService)
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+             patch('app.services.storage.SQLITE_PATH', os.path.join(tmp_dir, "agents.db")):
+            backend = create_storage_backend("sqlite")
+            self.assertIsInstance(backend, SQLiteStorageService)
+            backend.client.close()
+        with self.assertRaises(ValueError):
+            create_storage_backend("cassandra")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from app.agents.manager import ManagerAgent
+from app.agents.task_events import record_transition, project_main_task
+from app.models.task import MainTask, Goal, SubTask, TaskStatus
+
+class TestTaskEvents(unittest.TestCase):
+    def _main_task(self):
+        st1 = SubTask(name="Step 1", description="First")
+        st2 = SubTask(name="Step 2", description="Second", dependencies=[st1.id])
+        return MainTask(user_query="Events", overall_goal=Goal(description="Events"), sub_tasks=[st1, st2])
+
+    def test_record_transition(self):
+        main_task = self._main_task()
+        subtask = main_task.sub_tasks[0]
+        event = record_transition(main_task, subtask, TaskStatus.COMPLETED, {"out": 1})
+
+        self.assertEqual(event.seq, 1)
+        self.assertEqual(event.from_status, TaskStatus.PENDING)
+        self.assertEqual(event.to_status, TaskStatus.COMPLETED)
+        self.assertEqual(subtask.status, TaskStatus.COMPLETED)
+        self.assertEqual(subtask.results, {"out": 1})
+        self.assertEqual(main_task.event_seq, 1)
+
+    def test_project_main_task_from_snapshot_and_events(self):
+        live = self._main_task()
+        snapshot = MainTask(**live.model_dump())
+        events = [
+            record_transition(live, live.sub_tasks[0], TaskStatus.IN_PROGRESS),
+            record_transition(live, live.sub_tasks[0], TaskStatus.COMPLETED, {"out": 1}),
+            record_transition(live, live.sub_tasks[1], TaskStatus.IN_PROGRESS),
+            record_transition(live, live.sub_tasks[1], TaskStatus.COMPLETED, {"out": 2}),
+            record_transition(live, None, TaskStatus.COMPLETED)
+        ]
+
+        projected = project_main_task(snapshot, list(reversed(events)))
+        self.assertEqual(projected.model_dump(), live.model_dump())
+        # Events already contained in a snapshot are ignored
+        self.assertEqual(project_main_task(MainTask(**live.model_dump()), events).model_dump(), live.model_dump())
+
+    def test_execute_subtask_group_appends_events_instead_of_saving(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            mock_service_instance.append_task_events.return_value = True
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent(id="event_log_manager_test")
+            main_task = manager.initiate_main_task("Event test", [], "Goal")
+            main_task.sub_tasks = [SubTask(name=f"Step {i}", description="Parallel step") for i in range(3)]
+            manager._save_main_task(main_task)
+            mock_service_instance.save_agent.reset_mock()
+
+            manager.execute_subtask_group(main_task.sub_tasks)
+
+            # 3 subtasks x 2 transitions + main task completion, one snapshot at the end
+            self.assertEqual(mock_service_instance.append_task_events.call_count, 7)
+            self.assertEqual(mock_service_instance.save_agent.call_count, 1)
+            updated = manager._get_main_task()
+            self.assertEqual(updated.status, TaskStatus.COMPLETED)
+            self.assertEqual(updated.event_seq, 7)
+
+    def test_snapshot_interval_and_fallback(self):
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.save_agent.return_value = True
+            mock_service_instance.append_task_events.return_value = True
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent(id="snapshot_interval_test", config={"task_snapshot_interval": 2})
+            main_task = manager.initiate_main_task("Event test", [], "Goal")
+            main_task.sub_tasks = [SubTask(name=f"Step {i}", description="Parallel step") for i in range(3)]
+            manager._save_main_task(main_task)
+            mock_service_instance.save_agent.reset_mock()
+            manager.execute_subtask_group(main_task.sub_tasks)
+            self.assertEqual(mock_service_instance.save_agent.call_count, 4) # One per subtask plus the final one
+
+            # When the event log is unavailable every transition falls back to a full save
+            mock_service_instance.append_task_events.return_value = False
+            mock_service_instance.save_agent.reset_mock()
+            manager.config = {}
+            main_task = manager.initiate_main_task("Event test", [], "Goal")
+            main_task.sub_tasks = [SubTask(name="Only step", description="Step")]
+            manager._save_main_task(main_task)
+            mock_service_instance.save_agent.reset_mock()
+            manager.execute_subtask_group(main_task.sub_tasks)
+            self.assertEqual(mock_service_instance.save_agent.call_count, 4)
+
+    def test_load_state_replays_events(self):
+        live = self._main_task()
+        snapshot_data = live.model_dump()
+        events = [record_transition(live, live.sub_tasks[0], TaskStatus.COMPLETED, {"out": 1})]
+        with patch('app.agents.base.get_es_service') as mock_get_es_service:
+            mock_service_instance = MagicMock()
+            mock_service_instance.client = MagicMock()
+            mock_service_instance.get_agent.return_value = {
+                "id": "replay_manager_test", "name": "Replay", "role": "Manager", "config": {},
+                "stm": {"current_task_data": {"active_main_task": snapshot_data}}, "ltm": {}
+            }
+            mock_service_instance.get_task_events.return_value = events
+            mock_get_es_service.return_value = mock_service_instance
+
+            manager = ManagerAgent()
+            self.assertTrue(manager.load_state("replay_manager_test"))
+            mock_service_instance.get_task_events.assert_called_with(live.id, after_seq=0)
+            replayed = manager.stm.current_task_data['active_main_task']
+            self.assertEqual(replayed['sub_tasks'][0]['status'], TaskStatus.COMPLETED)
+            self.assertEqual(replayed['event_seq'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
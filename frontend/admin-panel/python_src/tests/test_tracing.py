@@ -0,0 +1,96 @@
+import unittest
+import json
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+import app.main as main_module
+from app.services.elasticsearch_service import ElasticsearchService
+from app.tracing import EXPORTER, InMemorySpanExporter, TraceContextFilter, build_trace_tree, start_span
+
+def _walk(nodes):
+    for node in nodes:
+        yield node
+        yield from _walk(node["children"])
+
+class TestSpans(unittest.TestCase):
+    def setUp(self):
+        EXPORTER.clear()
+
+    def test_child_spans_share_trace_and_nest(self):
+        with start_span("parent", main_task_id="maintask_nest") as parent:
+            with start_span("child") as child:
+                pass
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_span_id, parent.span_id)
+
+        roots = build_trace_tree(EXPORTER.get_trace(EXPORTER.trace_id_for_main_task("maintask_nest")))
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(roots[0]["name"], "parent")
+        self.assertEqual([node["name"] for node in roots[0]["children"]], ["child"])
+
+    def test_exception_marks_span_as_error(self):
+        with self.assertRaises(ValueError):
+            with start_span("failing") as span:
+                raise ValueError("bad input")
+        self.assertEqual(span.status, "ERROR")
+        self.assertIn("bad input", span.status_message)
+
+    def test_es_operations_open_spans(self):
+        service = ElasticsearchService(connect=False)
+        service._agent_versions = {}
+        service.client = None
+        with start_span("caller") as caller:
+            service.get_task_events("maintask_es")
+        names = [span.name for span in EXPORTER.get_trace(caller.trace_id)]
+        self.assertIn("es.get_task_events", names)
+
+    def test_json_exporter_and_log_filter(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "spans.jsonl")
+            exporter = InMemorySpanExporter(max_traces=1, export_path=path)
+            with patch('app.tracing.EXPORTER', exporter):
+                with start_span("first", main_task_id="maintask_old"):
+                    record = MagicMock()
+                    TraceContextFilter().filter(record)
+                with start_span("second"):
+                    pass
+            with open(path) as export_file:
+                exported = [json.loads(line) for line in export_file]
+
+        self.assertEqual([span["name"] for span in exported], ["first", "second"])
+        self.assertEqual(record.trace_id, exported[0]["trace_id"])
+        self.assertIsNone(exporter.trace_id_for_main_task("maintask_old")) # Evicted with its trace
+
+class TestWorkflowTrace(unittest.TestCase):
+    def setUp(self):
+        EXPORTER.clear()
+        patcher = patch('app.agents.base.get_es_service')
+        mock_get_es_service = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_service_instance = MagicMock()
+        mock_service_instance.client = MagicMock()
+        mock_service_instance.get_agent.return_value = None
+        mock_service_instance.save_agent.return_value = True
+        mock_service_instance.find_relevant_rules.return_value = []
+        mock_get_es_service.return_value = mock_service_instance
+
+    def test_trace_tree_endpoint(self):
+        client = TestClient(main_module.app)
+        response = client.post("/workflow/run_main_task", json={"user_query": "Report", "overall_goal_desc": "Report"})
+        self.assertEqual(response.status_code, 200)
+        main_task_id = response.json()["main_task_id"]
+
+        trace = client.get(f"/tasks/{main_task_id}/trace").json()
+        self.assertEqual(trace["trace_id"], response.headers["x-trace-id"])
+        root = trace["spans"][0]
+        self.assertEqual(root["name"], "http.request")
+        names = [node["name"] for node in _walk(trace["spans"])]
+        for expected in ("workflow.run", "workflow.iteration", "workflow.plan", "workflow.execute", "subtask.execute"):
+            self.assertIn(expected, names)
+        self.assertEqual(names.count("subtask.execute"), 3)
+
+        self.assertEqual(client.get("/tasks/unknown/trace").status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
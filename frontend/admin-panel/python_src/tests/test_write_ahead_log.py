@@ -0,0 +1,187 @@
+import unittest
+import json
+import os
+import time
+import tempfile
+from unittest.mock import MagicMock, patch
+from app.agents.base import AbstractAgent, flush_write_ahead_log
+from app.agents.manager import ManagerAgent
+from app.models.task import Rule
+from app.services.in_memory_service import InMemoryStorageService
+from app.services.write_ahead_log import WriteAheadLog, FALLBACK, GROUP_COMMIT
+from app.workflow_manager import WorkflowManager
+
+class WalTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "agents.wal")
+
+    def open_wal(self, mode=FALLBACK) -> WriteAheadLog:
+        wal = WriteAheadLog(self.path, mode=mode)
+        self.addCleanup(wal.close)
+        return wal
+
+class TestWriteAheadLog(WalTestCase):
+    def test_replays_in_order_after_reopen_and_coalesces_agent_saves(self):
+        wal = self.open_wal()
+        agent = AbstractAgent(id="agent_1", name="v1")
+        lsn = wal.append_agent(agent)
+        base_state = agent._document()
+        agent.name = "v2"
+        wal.append_agent(agent, base_lsn=lsn, base_state=base_state) # Same writer: supersedes the first write
+        wal.append_rules([Rule(id="rule_1", description="d", actionable_guideline="g", context="c", source="test")])
+        wal.close()
+
+        reopened = self.open_wal()
+        self.assertEqual(reopened.pending(), 3)
+        self.assertEqual(reopened.pending_agent("agent_1")["name"], "v2")
+        backend = InMemoryStorageService()
+        self.assertEqual(reopened.replay(backend), 3)
+
+        self.assertEqual(backend.calls["save_agent"], 1)
+        self.assertEqual(backend.get_agent("agent_1")["name"], "v2")
+        self.assertEqual([rule.id for rule in backend.find_relevant_rules("d")], ["rule_1"])
+        self.assertEqual(reopened.pending(), 0)
+        self.assertIsNone(reopened.pending_agent("agent_1"))
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(reopened.append_agent(agent), 4) # LSNs keep increasing
+
+    def test_failed_batch_stays_pending(self):
+        wal = self.open_wal()
+        wal.append_agent(AbstractAgent(id="agent_1"))
+        backend = MagicMock()
+        backend.save_agent.return_value = False
+        self.assertEqual(wal.replay(backend), 0)
+        self.assertEqual(wal.pending(), 1)
+
+    def test_poison_record_does_not_block_the_others_and_is_quarantined(self):
+        wal = self.open_wal()
+        wal.max_replay_attempts = 2
+        backend = InMemoryStorageService()
+        wal.append("save_agent", {"id": "poison", "stm": "not a memory"}) # Fails validation on every replay
+        wal.append_agent(AbstractAgent(id="agent_1"))
+        self.assertEqual(wal.replay(backend), 1)
+        self.assertEqual(backend.get_agent("agent_1")["id"], "agent_1")
+        self.assertEqual(wal.pending(), 1)
+
+        with self.assertLogs("app.services.write_ahead_log", level="ERROR"):
+            self.assertEqual(wal.replay(backend), 1)
+        self.assertEqual(wal.pending(), 0)
+        with open(wal.quarantine_path, "rb") as quarantine_file:
+            quarantined = [json.loads(line) for line in quarantine_file]
+        self.assertEqual([(entry["key"], entry["attempts"]) for entry in quarantined], [("agent:poison", 2)])
+
+    def test_rejected_write_is_quarantined_only_while_storage_takes_others(self):
+        wal = self.open_wal()
+        wal.max_replay_attempts = 2
+        wal.append_agent(AbstractAgent(id="rejected"))
+        wal.append_rules([Rule(id="rule_1", description="d", actionable_guideline="g", context="c", source="test")])
+        backend = MagicMock()
+        backend.save_agent.return_value = False
+        backend.save_rules.return_value = False
+        for _ in range(3): # Storage down: nothing succeeds, so the failures do not count
+            self.assertEqual(wal.replay(backend), 0)
+        self.assertFalse(os.path.exists(wal.quarantine_path))
+
+        backend.save_rules.return_value = True
+        backend.save_agent.side_effect = lambda agent, *args, **kwargs: agent.id != "rejected"
+        self.assertEqual(wal.replay(backend), 1) # The rules
+        with self.assertLogs("app.services.write_ahead_log", level="ERROR"):
+            wal.append_agent(AbstractAgent(id="agent_1"))
+            self.assertEqual(wal.replay(backend), 2)
+        self.assertEqual(wal.pending(), 0)
+        self.assertTrue(os.path.exists(wal.quarantine_path))
+
+    def test_last_append_is_fsynced_without_further_appends(self):
+        wal = WriteAheadLog(self.path, fsync_interval=0.05)
+        self.addCleanup(wal.close)
+        with patch('app.services.write_ahead_log.os.fsync') as mock_fsync:
+            wal.append_agent(AbstractAgent(id="agent_1")) # Within the interval of the initial sync
+            self.assertEqual(mock_fsync.call_count, 0)
+            time.sleep(0.2)
+            self.assertEqual(mock_fsync.call_count, 1)
+
+    def test_skips_torn_record(self):
+        wal = self.open_wal()
+        wal.append_agent(AbstractAgent(id="agent_1"))
+        wal.close()
+        with open(self.path, "ab") as wal_file:
+            wal_file.write(b'{"lsn": 2, "op": "save_ag')
+        with self.assertLogs("app.services.write_ahead_log", level="WARNING"):
+            self.assertEqual(self.open_wal().pending(), 1)
+
+class TestAgentWriteAheadLog(WalTestCase):
+    def test_fallback_captures_writes_while_storage_is_down(self):
+        wal = self.open_wal()
+        backend = InMemoryStorageService()
+        unavailable = MagicMock(client=None)
+        with patch('app.agents.base._write_ahead_log', wal):
+            with patch('app.agents.base.get_es_service', return_value=unavailable):
+                agent = AbstractAgent(id="agent_1", name="Offline")
+                self.assertTrue(agent.save_state())
+                reloaded = AbstractAgent(id="agent_1")
+                self.assertTrue(reloaded.load_state()) # Read from the log
+                self.assertEqual(reloaded.name, "Offline")
+                self.assertEqual(flush_write_ahead_log(), 0)
+
+            with patch('app.agents.base.get_es_service', return_value=backend):
+                agent.name = "Back online"
+                self.assertTrue(agent.save_state()) # Queued behind the pending record, not written ahead of it
+                self.assertEqual(backend.calls["save_agent"], 0)
+                self.assertEqual(flush_write_ahead_log(), 2)
+        self.assertEqual(backend.get_agent("agent_1")["name"], "Back online")
+
+    def test_group_commit_batches_workflow_saves(self):
+        wal = self.open_wal(mode=GROUP_COMMIT)
+        backend = InMemoryStorageService()
+        with patch('app.agents.base._write_ahead_log', wal), patch('app.agents.base.get_es_service', return_value=backend):
+            result = WorkflowManager(manager_agent=ManagerAgent(id="wal_manager")).run_main_task_loop("Generate the weekly report", [], "Report")
+        self.assertEqual(backend.calls["save_agent"], 1)
+        self.assertEqual(result["storage_ops"]["by_operation"]["save_agent"]["calls"], 1)
+        self.assertEqual(backend.get_agent("wal_manager")["id"], "wal_manager")
+        self.assertEqual(wal.pending(), 0)
+
+    def test_group_commit_replay_merges_concurrent_writers(self):
+        wal = self.open_wal(mode=GROUP_COMMIT)
+        backend = InMemoryStorageService()
+        self.assertTrue(backend.save_agent(AbstractAgent(id="agent_1")))
+        with patch('app.agents.base._write_ahead_log', wal), patch('app.agents.base.get_es_service', return_value=backend):
+            first, second = AbstractAgent(id="agent_1"), AbstractAgent(id="agent_1")
+            self.assertTrue(first.load_state())
+            self.assertTrue(second.load_state())
+            first.stm.scratchpad["first"] = 1
+            self.assertTrue(first.save_state())
+            first.stm.scratchpad["first"] = 2
+            self.assertTrue(first.save_state()) # Supersedes its previous write
+            second.config["second"] = True
+            self.assertTrue(second.save_state()) # Based on the same stored version as the first writer's
+            self.assertEqual(flush_write_ahead_log(), 3)
+            self.assertEqual(backend.calls["save_agent"], 1 + 3) # The second writer's save conflicts once
+            stored = backend.get_agent("agent_1")
+            self.assertEqual((stored["stm"]["scratchpad"], stored["config"]), ({"first": 2}, {"second": True}))
+
+            first.stm.scratchpad["first"] = 3
+            self.assertTrue(first.save_state()) # Based on its replayed write, at a version changed since by second's
+            self.assertEqual(flush_write_ahead_log(), 1)
+        stored = backend.get_agent("agent_1")
+        self.assertEqual((stored["stm"]["scratchpad"], stored["config"]), ({"first": 3}, {"second": True}))
+
+    def test_group_commit_replay_is_conditional_on_the_writers_replayed_version(self):
+        wal = self.open_wal(mode=GROUP_COMMIT)
+        backend = InMemoryStorageService()
+        with patch('app.agents.base._write_ahead_log', wal), patch('app.agents.base.get_es_service', return_value=backend):
+            agent = AbstractAgent(id="agent_1")
+            self.assertTrue(agent.save_state())
+            self.assertEqual(flush_write_ahead_log(), 1)
+            replayed_version = backend.get_agent("agent_1")["version"]
+            agent.name = "Renamed"
+            self.assertTrue(agent.save_state())
+            with patch.object(backend, 'save_agent', wraps=backend.save_agent) as save_agent:
+                self.assertEqual(flush_write_ahead_log(), 1)
+        save_agent.assert_called_once()
+        self.assertEqual(save_agent.call_args.kwargs, {"expected_version": replayed_version})
+        self.assertEqual(backend.get_agent("agent_1")["name"], "Renamed")
+
+if __name__ == '__main__':
+    unittest.main()